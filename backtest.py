@@ -0,0 +1,440 @@
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from candle_store import CANDLE_DTYPE, CandleBuffer, bar_to_ms
+from data_collector import DataCollector, TechnicalIndicators
+from okx_trade import AccountSnapshot, okxbot
+from prompt_generator import PromptGenerator
+
+
+class SimulatedExchange:
+    """
+    回测用的模拟交易所：按回测时钟只暴露已收盘的K线，市价单按最新收盘价成交并扣手续费
+    spot 模式维护 USDT 和各币种余额；swap 模式维护带方向的净持仓（1张=1个币）
+    """
+
+    def __init__(self, history, trade_mode="spot", initial_cash=10000.0, fee_rate=0.001, slippage=0.0,
+                 leverage=1.0, funding_rate=0.0):
+        self.history = history
+        self.trade_mode = trade_mode
+        self.fee_rate = fee_rate
+        self.slippage = slippage
+        self.leverage = leverage
+        self.funding_rate = funding_rate
+        self.now = 0
+        self.cash = float(initial_cash)
+        self.holdings = {}
+        self.positions = {}
+        self.trades = []
+        self.fees = 0.0
+        self.order_id = 0
+        # 预先转换为OKX接口返回的字符串格式，回测时只需切片
+        self.rows = {}
+        self.close_times = {}
+        for instId, bars in history.items():
+            for bar, candles in bars.items():
+                self.rows[(instId, bar)] = [
+                    [str(c['timestamp']), repr(float(c['open'])), repr(float(c['high'])), repr(float(c['low'])),
+                     repr(float(c['close'])), repr(float(c['volume'])), repr(float(c['vol_ccy'])),
+                     repr(float(c['vol_ccy'])), '1']
+                    for c in candles
+                ]
+                self.close_times[(instId, bar)] = candles['timestamp'] + bar_to_ms(bar)
+
+    def _resolve(self, instId):
+        for candidate in (instId, instId + '-SWAP', instId.replace('-SWAP', '')):
+            if candidate in self.history:
+                return candidate
+        raise KeyError(f"no history for {instId}")
+
+    def visible_count(self, instId, bar):
+        return int(np.searchsorted(self.close_times[(instId, bar)], self.now, side='right'))
+
+    def candles(self, instId, bar, limit):
+        instId = self._resolve(instId)
+        end = self.visible_count(instId, bar)
+        return self.rows[(instId, bar)][max(end - int(limit), 0):end][::-1]
+
+    def price(self, instId):
+        instId = self._resolve(instId)
+        bar = min(self.history[instId], key=bar_to_ms)
+        end = self.visible_count(instId, bar)
+        if end == 0:
+            return None
+        return float(self.history[instId][bar]['close'][end - 1])
+
+    def equity(self):
+        total = self.cash
+        for ccy, amount in self.holdings.items():
+            total += amount * self.price(ccy + '-USDT')
+        for instId, pos in self.positions.items():
+            total += pos['qty'] * (self.price(instId) - pos['avg_px'])
+        return total
+
+    @staticmethod
+    def _order_error(code, msg):
+        return {'code': '1', 'msg': 'All operations failed', 'data': [{'ordId': '', 'sCode': code, 'sMsg': msg}]}
+
+    def _order_ok(self):
+        self.order_id += 1
+        return {'code': '0', 'msg': '', 'data': [{'ordId': str(self.order_id), 'sCode': '0', 'sMsg': 'Order placed'}]}
+
+    def place_order(self, instId, side, sz, **kwargs):
+        try:
+            sz = float(sz)
+        except (TypeError, ValueError):
+            sz = 0.0
+        if sz <= 0:
+            return self._order_error('51000', 'Parameter sz error')
+        px = self.price(instId)
+        if px is None:
+            return self._order_error('51001', 'Instrument ID does not exist')
+        px *= (1 + self.slippage) if side == 'buy' else (1 - self.slippage)
+        fee = sz * px * self.fee_rate
+        if self.trade_mode == "swap":
+            result = self._fill_swap(instId, side, sz, px, fee)
+        else:
+            result = self._fill_spot(instId, side, sz, px, fee)
+        if result['code'] == '0':
+            self.fees += fee
+            self.trades.append({'time': self.now, 'instId': instId, 'side': side, 'sz': sz, 'px': px, 'fee': fee})
+        return result
+
+    def _fill_spot(self, instId, side, sz, px, fee):
+        ccy = instId.split('-')[0]
+        if side == 'buy':
+            if sz * px + fee > self.cash:
+                return self._order_error('51008', 'Order failed. Insufficient USDT balance')
+            self.cash -= sz * px + fee
+            self.holdings[ccy] = self.holdings.get(ccy, 0.0) + sz
+        else:
+            if self.holdings.get(ccy, 0.0) < sz:
+                return self._order_error('51008', f'Order failed. Insufficient {ccy} balance')
+            self.holdings[ccy] -= sz
+            self.cash += sz * px - fee
+        return self._order_ok()
+
+    def _fill_swap(self, instId, side, sz, px, fee):
+        instId = self._resolve(instId)
+        pos = self.positions.get(instId, {'qty': 0.0, 'avg_px': px})
+        delta = sz if side == 'buy' else -sz
+        qty = pos['qty'] + delta
+        if abs(qty) * px / self.leverage > self.equity() - fee:
+            return self._order_error('51008', 'Order failed. Insufficient margin')
+        if pos['qty'] == 0 or pos['qty'] * delta > 0:
+            # 开仓或加仓，更新持仓均价
+            pos['avg_px'] = (abs(pos['qty']) * pos['avg_px'] + sz * px) / abs(qty)
+        else:
+            closed = min(abs(delta), abs(pos['qty']))
+            self.cash += closed * (px - pos['avg_px']) * (1 if pos['qty'] > 0 else -1)
+            if abs(delta) > abs(pos['qty']):
+                pos['avg_px'] = px
+        self.cash -= fee
+        pos['qty'] = qty
+        if qty == 0:
+            self.positions.pop(instId, None)
+        else:
+            self.positions[instId] = pos
+        return self._order_ok()
+
+    def close_positions(self, instId, mgnMode, **kwargs):
+        if self.trade_mode != "swap":
+            return {'code': '51000', 'msg': 'Parameter mgnMode error', 'data': []}
+        instId = self._resolve(instId)
+        pos = self.positions.get(instId)
+        if not pos:
+            return {'code': '51023', 'msg': 'Position does not exist', 'data': []}
+        self.place_order(instId, 'sell' if pos['qty'] > 0 else 'buy', abs(pos['qty']))
+        return {'code': '0', 'msg': '', 'data': [{'instId': instId, 'posSide': 'net'}]}
+
+    def balance_response(self):
+        details = [{'ccy': 'USDT', 'availBal': repr(self.cash), 'frozenBal': '0', 'eq': repr(self.cash)}]
+        for ccy, amount in self.holdings.items():
+            details.append({'ccy': ccy, 'availBal': repr(amount), 'frozenBal': '0', 'eq': repr(amount)})
+        return {'code': '0', 'msg': '', 'data': [{'totalEq': repr(self.equity()), 'details': details}]}
+
+    def positions_response(self):
+        data = []
+        for instId, pos in self.positions.items():
+            mark = self.price(instId)
+            upl = pos['qty'] * (mark - pos['avg_px'])
+            data.append({
+                'instId': instId, 'pos': repr(pos['qty']), 'posSide': 'net', 'avgPx': repr(pos['avg_px']),
+                'markPx': repr(mark), 'liqPx': '', 'upl': repr(upl), 'lever': repr(self.leverage),
+                'notionalUsd': repr(abs(pos['qty']) * mark), 'mgnMode': 'cross',
+                'uplRatio': repr(upl / (abs(pos['qty']) * pos['avg_px'] / self.leverage))
+            })
+        return {'code': '0', 'msg': '', 'data': data}
+
+
+class _SimAccountAPI:
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def get_account_balance(self, ccy=''):
+        return self.exchange.balance_response()
+
+    def get_positions(self, instType='', instId='', posId=''):
+        return self.exchange.positions_response()
+
+    def set_leverage(self, lever, mgnMode, instId='', ccy='', posSide=''):
+        self.exchange.leverage = float(lever)
+        return {'code': '0', 'msg': '', 'data': [{'lever': str(lever), 'mgnMode': mgnMode, 'instId': instId}]}
+
+
+class _SimTradeAPI:
+    def __init__(self, exchange):
+        self.exchange = exchange
+        # execute_decision 会并发下单和平仓，模拟撮合逐个处理
+        self.lock = threading.RLock()
+
+    def place_order(self, instId, tdMode, side, ordType, sz, **kwargs):
+        with self.lock:
+            return self.exchange.place_order(instId, side, sz, tdMode=tdMode, ordType=ordType, **kwargs)
+
+    def place_multiple_orders(self, orders_data):
+        with self.lock:
+            data = []
+            for order in orders_data:
+                order = dict(order)
+                res = self.exchange.place_order(order.pop('instId'), order.pop('side'), order.pop('sz'), **order)
+                data.append(res['data'][0])
+        failed = sum(item['sCode'] != '0' for item in data)
+        code = '0' if failed == 0 else ('1' if failed == len(data) else '2')
+        return {'code': code, 'msg': '', 'data': data}
+
+    def close_positions(self, instId, mgnMode, **kwargs):
+        with self.lock:
+            return self.exchange.close_positions(instId, mgnMode, **kwargs)
+
+
+class _SimPublicAPI:
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def get_funding_rate(self, instId):
+        rate = repr(float(self.exchange.funding_rate))
+        return {'code': '0', 'data': [{'instId': instId, 'fundingRate': rate, 'nextFundingRate': '', 'fundingTime': '0'}]}
+
+    def get_open_interest(self, instType='', uly='', instId='', instFamily=''):
+        return {'code': '0', 'data': [{'instId': instId, 'oi': '0'}]}
+
+
+class _SimMarketAPI:
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def get_candlesticks(self, instId, after='', before='', bar='', limit=''):
+        return {'code': '0', 'msg': '', 'data': self.exchange.candles(instId, bar or '1m', limit or 100)}
+
+    def get_ticker(self, instId):
+        return {'code': '0', 'msg': '', 'data': [{'instId': instId, 'last': repr(self.exchange.price(instId))}]}
+
+
+class SimulatedOkxBot(okxbot):
+    """接口与 okxbot 相同，请求全部由 SimulatedExchange 处理，下单/解析等逻辑沿用 okxbot"""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.flag = "1"
+        self.account = _SimAccountAPI(exchange)
+        self.tradeapi = _SimTradeAPI(exchange)
+        self.publicDataAPI = _SimPublicAPI(exchange)
+        self.marketDataAPI = _SimMarketAPI(exchange)
+        self.funding = None
+        self.snapshot = AccountSnapshot(self.account)
+
+
+class RuleDecision:
+    """
+    确定性的规则决策，代替大模型：收盘价上穿EMA20且RSI14<70时买入，跌破EMA20时卖出
+    返回与大模型相同格式的JSON文本
+    """
+
+    def __init__(self, coin_list, bar='3m', position_fraction=0.9):
+        self.coin_list = coin_list
+        self.bar = bar
+        self.position_fraction = position_fraction
+
+    def __call__(self, prompt, backtest):
+        exchange = backtest.exchange
+        decision = {}
+        for instId in self.coin_list:
+            coin = instId.split('-')[0]
+            rows = exchange.candles(instId, self.bar, 50)
+            if len(rows) < 20:
+                continue
+            closes = [float(row[4]) for row in reversed(rows)]
+            ema20 = TechnicalIndicators.calculate_ema(closes, 20)
+            rsi14 = TechnicalIndicators.calculate_rsi(closes, 14)
+            if exchange.trade_mode == "swap":
+                pos = exchange.positions.get(exchange._resolve(instId), {'qty': 0.0})
+                holding = pos['qty']
+            else:
+                holding = exchange.holdings.get(coin, 0.0)
+            signal, quantity = 'hold', 0
+            if closes[-1] > ema20 and rsi14 < 70 and holding <= 0:
+                budget = exchange.cash * self.position_fraction / len(self.coin_list)
+                signal, quantity = 'buy', round(budget / closes[-1], 6)
+            elif closes[-1] < ema20 and holding > 0:
+                signal, quantity = 'sell', holding
+            decision[coin] = {'signal': signal, 'quantity': quantity, 'confidence': 0.5, 'coin': coin,
+                              'justification': f'close={closes[-1]:.6f} ema20={ema20:.6f} rsi14={rsi14:.2f}'}
+        return "```json\n" + json.dumps(decision) + "\n```"
+
+
+class RecordedDecision:
+    """按顺序回放保存的大模型原始回复（trading_record JSON 或 TradeJournal），用完后一律 hold"""
+
+    def __init__(self, pattern="./trading_record/*.json", journal=None, **query):
+        if journal is not None:
+            records = journal.query(**query)
+        else:
+            records = []
+            for path in sorted(glob.glob(pattern)):
+                with open(path, 'r', encoding='utf-8') as f:
+                    records.append(json.load(f))
+        self.responses = [record['ai_response'] for record in records if record.get('ai_response')]
+        self.index = 0
+
+    def __call__(self, prompt, backtest):
+        if self.index >= len(self.responses):
+            return "{}"
+        self.index += 1
+        return self.responses[self.index - 1]
+
+
+class Backtest:
+    """
+    离线回测：历史K线 -> 模拟 okxbot -> DataCollector/PromptGenerator -> 决策函数 -> okxbot 下单逻辑
+    history: {instId: {bar: CANDLE_DTYPE 结构化数组(旧→新)}}，第一个粒度 base_bar 为回测步长
+    decision_fn(prompt, backtest) 返回大模型格式的回复文本
+    """
+
+    def __init__(self, history, decision_fn, coin_list=None, trade_mode="spot", base_bar='3m', **exchange_kwargs):
+        self.coin_list = coin_list or list(history)
+        self.base_bar = base_bar
+        self.decision_fn = decision_fn
+        self.exchange = SimulatedExchange(history, trade_mode=trade_mode, **exchange_kwargs)
+        self.bot = SimulatedOkxBot(self.exchange)
+        self.data_collector = DataCollector(self.bot, self.coin_list, trade_mode=trade_mode)
+        self.prompt_generator = PromptGenerator(self.data_collector, trade_mode=trade_mode)
+        self.equity_curve = []
+        self.decisions = []
+
+    @staticmethod
+    def load_candle_store(root, coin_list, bars=('3m', '4H')):
+        history = {}
+        for instId in coin_list:
+            history[instId] = {}
+            for bar in bars:
+                buffer = CandleBuffer(os.path.join(root, f"{instId}_{bar}.candles"), bar)
+                history[instId][bar] = np.array(buffer.latest(buffer.count), dtype=CANDLE_DTYPE)
+        return history
+
+    def run(self, start=None, end=None, step=1, warmup=50, quiet=True):
+        """
+        step: 每隔多少根 base_bar 决策一次
+        warmup: 每个粒度开始前至少需要的已收盘K线数量
+        """
+        times = self.history_close_times()[::step]
+        # 所有币种、所有粒度都至少有 warmup 根已收盘K线后才开始
+        if warmup:
+            for key, close_times in self.exchange.close_times.items():
+                if len(close_times) < warmup:
+                    raise ValueError(f"{key} has only {len(close_times)} candles, warmup needs {warmup}")
+                times = times[times >= close_times[warmup - 1]]
+        if start is not None:
+            times = times[times >= start]
+        if end is not None:
+            times = times[times <= end]
+        started = time.time()
+        devnull = open(os.devnull, 'w') if quiet else None
+        with contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+            for now in times:
+                self.step(int(now))
+        if devnull:
+            devnull.close()
+        return self.summary(time.time() - started)
+
+    def history_close_times(self):
+        instId = self.exchange._resolve(self.coin_list[0])
+        return self.exchange.close_times[(instId, self.base_bar)]
+
+    def step(self, now):
+        self.exchange.now = now
+        self.bot.snapshot.begin_cycle()
+        try:
+            prompt = self.prompt_generator.generate_trading_prompt()
+            ai_response = self.decision_fn(prompt, self)
+            decision = self.bot.parse_decision(ai_response, self.exchange.trade_mode)
+            if decision:
+                self.bot.execute_decision(decision)
+            self.decisions.append((now, decision))
+        finally:
+            self.bot.snapshot.end_cycle()
+        self.equity_curve.append((now, self.exchange.equity()))
+
+    def summary(self, elapsed=0.0):
+        equity = np.array([value for _, value in self.equity_curve])
+        if len(equity) == 0:
+            return {'cycles': 0, 'elapsed': elapsed}
+        peak = np.maximum.accumulate(equity)
+        return {
+            'cycles': len(equity),
+            'elapsed': elapsed,
+            'start_equity': float(equity[0]),
+            'final_equity': float(equity[-1]),
+            'return': float(equity[-1] / equity[0] - 1),
+            'max_drawdown': float(((peak - equity) / peak).max()),
+            'trades': len(self.exchange.trades),
+            'fees': self.exchange.fees
+        }
+
+
+def synthetic_history(coin_list, days=30, bars=('3m', '4H'), seed=0, start_price=1.0):
+    """生成随机游走的K线，用于没有历史数据时的演示"""
+    rng = np.random.default_rng(seed)
+    history = {}
+    base_ms = bar_to_ms(bars[0])
+    n = int(days * 24 * 60 * 60 * 1000 // base_ms)
+    start = 1_700_000_000_000 // bar_to_ms(bars[-1]) * bar_to_ms(bars[-1])
+    for instId in coin_list:
+        close = start_price * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+        open_ = np.concatenate([[start_price], close[:-1]])
+        base = np.zeros(n, dtype=CANDLE_DTYPE)
+        base['timestamp'] = start + np.arange(n) * base_ms
+        base['open'] = open_
+        base['close'] = close
+        base['high'] = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, n)))
+        base['low'] = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, n)))
+        base['volume'] = rng.uniform(100, 1000, n)
+        base['vol_ccy'] = base['volume'] * close
+        history[instId] = {bars[0]: base}
+        for bar in bars[1:]:
+            # 由基础K线聚合出更大周期
+            group = (base['timestamp'] - start) // bar_to_ms(bar)
+            edges = np.flatnonzero(np.diff(group)) + 1
+            starts = np.concatenate([[0], edges])
+            agg = np.zeros(len(starts), dtype=CANDLE_DTYPE)
+            agg['timestamp'] = start + group[starts] * bar_to_ms(bar)
+            agg['open'] = base['open'][starts]
+            agg['close'] = base['close'][np.concatenate([edges - 1, [n - 1]])]
+            agg['high'] = np.maximum.reduceat(base['high'], starts)
+            agg['low'] = np.minimum.reduceat(base['low'], starts)
+            agg['volume'] = np.add.reduceat(base['volume'], starts)
+            agg['vol_ccy'] = np.add.reduceat(base['vol_ccy'], starts)
+            history[instId][bar] = agg
+    return history
+
+
+if __name__ == '__main__':
+    coins = ["DOGE-USDT"]
+    bt = Backtest(synthetic_history(coins, days=30), RuleDecision(coins), coin_list=coins)
+    print(bt.run())
@@ -0,0 +1,323 @@
+"""
+离线性能基准：指标计算、提示词生成、决策解析
+使用合成K线和模拟 okxbot，不需要网络和API Key
+
+    python benchmark.py                              # 完整扫描，结果写入 benchmark_results.json
+    python benchmark.py --quick                      # 小规模扫描
+    python benchmark.py --baseline old.json          # 与基准结果对比，变慢超过阈值时标记并返回非0
+启动耗时（全新解释器中导入入口模块并创建对象）超出 STARTUP_BUDGET_MS 或提前加载了 LAZY_MODULES 时同样返回非0
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from backtest import SimulatedExchange, SimulatedOkxBot, synthetic_history
+from data_collector import DataCollector, TechnicalIndicators
+from decision_parser import StreamingDecisionParser
+from prompt_encoder import PromptEncoder
+from prompt_generator import PromptGenerator
+
+COIN_COUNTS = (1, 5, 20, 50, 200)
+WINDOWS = (50, 300, 1000, 5000)
+QUICK_COIN_COUNTS = (1, 20)
+QUICK_WINDOWS = (50, 1000)
+
+# 入口的启动耗时上限（毫秒）：全新解释器中导入模块并执行创建语句
+STARTUP_BUDGET_MS = {'okx_trade': 150, 'trade_bot': 400}
+STARTUP_STATEMENTS = {
+    'okx_trade': "okx_trade.okxbot(True)",
+    'trade_bot': "trade_bot.TradingBot(journal_dir=tempfile.mkdtemp())",
+}
+# 这些依赖导入很慢，只应在第一次请求/订阅时加载
+LAZY_MODULES = ('openai', 'okx', 'websockets')
+_STARTUP_PROBE = """
+import json, sys, tempfile, time
+start = time.perf_counter()
+import {module}
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(fn, repeat=5, min_time=0.05):
+    """类似 timeit：先确定循环次数使单次测量不少于 min_time 秒，再重复 repeat 次，返回每次调用的耗时（秒）"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 10000:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return timings, loops
+
+
+def startup_time(module, statement='', repeat=5):
+    """在全新解释器中导入 module 并执行 statement，返回各次耗时（毫秒）和已加载的 LAZY_MODULES"""
+    code = _STARTUP_PROBE.format(module=module, statement=statement, lazy=LAZY_MODULES)
+    timings, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        probe = json.loads(output.strip().splitlines()[-1])
+        timings.append(probe['ms'])
+        loaded.update(probe['loaded'])
+    return timings, sorted(loaded)
+
+
+def coin_names(count):
+    return [f"C{i:03d}-USDT" for i in range(count)]
+
+
+def price_data_list(history, coins, bar, window):
+    """与 TradingDataCollector.get_price_data 返回格式相同的K线（CANDLE_DTYPE 结构化数组视图）"""
+    return [history[instId][bar][-window:] for instId in coins]
+
+
+def decision_response(coins):
+    decision = {
+        instId.split('-')[0]: {
+            "quantity": 0.5, "signal": "hold", "price_target": 1.1, "stop_loss": 0.9,
+            "invalidation_condition": "Price closes below 0.9 on 3-minute candle",
+            "justification": "EMA20 above EMA50, RSI neutral", "confidence": 0.6,
+            "risk_percent": 1.0, "timeframe": "4h", "coin": instId.split('-')[0]
+        }
+        for instId in coins
+    }
+    return "```json\n" + json.dumps(decision, indent=2) + "\n```"
+
+
+class BenchmarkSuite:
+    def __init__(self, coin_counts=COIN_COUNTS, windows=WINDOWS, repeat=5, min_time=0.05):
+        self.coin_counts = coin_counts
+        self.windows = windows
+        self.repeat = repeat
+        self.min_time = min_time
+        self.results = []
+        # 3m 至少 max(windows) 根，4H 至少60根
+        days = max(windows) / 480 + 11
+        self.history = synthetic_history(coin_names(max(coin_counts)), days=days, bars=('3m', '4H'), seed=1)
+
+    def record(self, name, fn, coins=None, window=None):
+        # 被测代码会打印大量进度信息，计时期间丢弃
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            timings, loops = measure(fn, self.repeat, self.min_time)
+        result = {
+            'name': name,
+            'coins': coins,
+            'window': window,
+            'best_ms': min(timings) * 1000,
+            'median_ms': float(np.median(timings)) * 1000,
+            'loops': loops
+        }
+        self.results.append(result)
+        print(f"{name:<40} coins={str(coins):>4} window={str(window):>5} "
+              f"best={result['best_ms']:10.3f}ms median={result['median_ms']:10.3f}ms")
+        return result
+
+    def bench_indicators(self):
+        for count in self.coin_counts:
+            for window in self.windows:
+                columns = {key: np.stack([self.history[instId]['3m'][key][-window:] for instId in coin_names(count)])
+                           for key in ('high', 'low', 'close', 'volume')}
+                self.record('indicators.calculate_batch', lambda: TechnicalIndicators.calculate_batch(
+                    columns['high'], columns['low'], columns['close'], columns['volume']), count, window)
+                self.record('indicators.calculate_batch+extended', lambda: TechnicalIndicators.calculate_batch(
+                    columns['high'], columns['low'], columns['close'], columns['volume'],
+                    tuple(TechnicalIndicators.EXTENDED)), count, window)
+        for window in self.windows:
+            candles = self.history[coin_names(1)[0]]['3m'][-window:]
+            close, high, low = candles['close'], candles['high'], candles['low']
+
+            def single():
+                TechnicalIndicators.calculate_ema(close, 20)
+                TechnicalIndicators.calculate_macd(close)
+                TechnicalIndicators.calculate_rsi(close, 14)
+                TechnicalIndicators.calculate_atr(high, low, close, 14)
+            self.record('indicators.single_coin', single, 1, window)
+
+    def bench_scalar_cutover(self):
+        """分别强制走逐行标量递推/逐列 numpy，用于校准 TechnicalIndicators.SCALAR_ROWS"""
+        threshold = TechnicalIndicators.SCALAR_ROWS
+        try:
+            for count in self.coin_counts:
+                for window in self.windows:
+                    columns = {key: np.stack([self.history[instId]['3m'][key][-window:] for instId in coin_names(count)])
+                               for key in ('high', 'low', 'close', 'volume')}
+                    for path, rows in (('scalar', count), ('numpy', count - 1)):
+                        TechnicalIndicators.SCALAR_ROWS = rows
+                        self.record(f'indicators.calculate_batch.{path}', lambda: TechnicalIndicators.calculate_batch(
+                            columns['high'], columns['low'], columns['close'], columns['volume']), count, window)
+        finally:
+            TechnicalIndicators.SCALAR_ROWS = threshold
+
+    def bench_prompt_indicators(self):
+        generator = PromptGenerator(None)
+        for window in self.windows:
+            # 指标计算与K线粒度无关，4H 版本同样用 window 根3m K线测
+            data = price_data_list(self.history, coin_names(1), '3m', window)[0]
+            self.record('prompt._calculate_indicators', lambda: generator._calculate_indicators(data), 1, window)
+            self.record('prompt._calculate_indicators_4h', lambda: generator._calculate_indicators_4h(data), 1, window)
+        for count in self.coin_counts:
+            data = price_data_list(self.history, coin_names(count), '3m', 50)
+            self.record('prompt._calculate_indicators_batch', lambda: generator._calculate_indicators_batch(data),
+                        count, 50)
+
+    def bench_generate_prompt(self):
+        for count in self.coin_counts:
+            coins = coin_names(count)
+            # 提示词只用最近50根K线，只保留所需的部分，避免模拟交易所预处理全部历史
+            history = {instId: {'3m': self.history[instId]['3m'][-100:], '4H': self.history[instId]['4H'][-60:]}
+                       for instId in coins}
+            exchange = SimulatedExchange(history)
+            exchange.now = int(history[coins[0]]['3m']['timestamp'][-1]) + 3 * 60 * 1000
+            bot = SimulatedOkxBot(exchange)
+            collector = DataCollector(bot, coins)
+            for name, encoder in (('prompt.generate_trading_prompt', None),
+                                  ('prompt.generate_trading_prompt.compact', PromptEncoder(6000))):
+                generator = PromptGenerator(collector, encoder=encoder)
+
+                def generate():
+                    bot.snapshot.begin_cycle()
+                    try:
+                        generator.generate_trading_prompt()
+                    finally:
+                        bot.snapshot.end_cycle()
+                self.record(name, generate, count, 50)
+
+    def bench_parse_decision(self):
+        bot = SimulatedOkxBot(SimulatedExchange({}))
+        for count in self.coin_counts:
+            response = decision_response(coin_names(count))
+            self.record('okxbot.parse_decision', lambda: bot.parse_decision(response), count)
+            # 流式回复按约4个字符一段到达
+            chunks = [response[i:i + 4] for i in range(0, len(response), 4)]
+
+            def stream():
+                parser = StreamingDecisionParser()
+                for chunk in chunks:
+                    parser.feed(chunk)
+            self.record('StreamingDecisionParser.feed', stream, count)
+
+    def bench_startup(self):
+        for module, statement in STARTUP_STATEMENTS.items():
+            timings, loaded = startup_time(module, statement, self.repeat)
+            result = {
+                'name': f'startup.{module}',
+                'coins': None,
+                'window': None,
+                'best_ms': min(timings),
+                'median_ms': float(np.median(timings)),
+                'loops': 1,
+                'budget_ms': STARTUP_BUDGET_MS.get(module),
+                'loaded': loaded
+            }
+            self.results.append(result)
+            print(f"{result['name']:<40} best={result['best_ms']:10.3f}ms median={result['median_ms']:10.3f}ms "
+                  f"budget={result['budget_ms']}ms loaded={loaded}")
+
+    def run(self):
+        for bench in (self.bench_startup, self.bench_indicators, self.bench_scalar_cutover,
+                      self.bench_prompt_indicators, self.bench_generate_prompt, self.bench_parse_decision):
+            bench()
+        return self.results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold=0.2):
+    """按 (name, coins, window) 与基准结果比较 median，变慢超过 threshold 标记为 regression"""
+    base = {(r['name'], r['coins'], r['window']): r for r in baseline['results']}
+    comparisons = []
+    for result in results:
+        old = base.get((result['name'], result['coins'], result['window']))
+        if old is None or not old['median_ms']:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        status = 'regression' if ratio > 1 + threshold else ('improvement' if ratio < 1 - threshold else 'ok')
+        comparisons.append({'name': result['name'], 'coins': result['coins'], 'window': result['window'],
+                            'baseline_ms': old['median_ms'], 'median_ms': result['median_ms'],
+                            'ratio': ratio, 'status': status})
+    return comparisons
+
+
+def over_budget(results):
+    """启动耗时超出预算或提前加载了重量级依赖的结果"""
+    return [r for r in results if r.get('budget_ms') is not None and
+            (r['median_ms'] > r['budget_ms'] or r.get('loaded'))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="offline benchmarks for indicators, prompt generation and parsing")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="previous results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="relative slowdown flagged as regression")
+    parser.add_argument('--quick', action='store_true', help="small sweep for a fast check")
+    parser.add_argument('--coins', type=int, nargs='+', help="coin counts to sweep")
+    parser.add_argument('--windows', type=int, nargs='+', help="candle windows to sweep")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    coin_counts = args.coins or (QUICK_COIN_COUNTS if args.quick else COIN_COUNTS)
+    windows = args.windows or (QUICK_WINDOWS if args.quick else WINDOWS)
+    suite = BenchmarkSuite(coin_counts, windows, repeat=args.repeat)
+    results = suite.run()
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'coin_counts': list(coin_counts),
+            'windows': list(windows)
+        },
+        'results': results
+    }
+    exit_code = 0
+    for result in over_budget(results):
+        print(f"OVER BUDGET  {result['name']} {result['median_ms']:.1f}ms (budget {result['budget_ms']}ms) "
+              f"loaded={result['loaded']}")
+        exit_code = 1
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['comparison'] = compare(results, baseline, args.threshold)
+        report['meta']['baseline'] = args.baseline
+        for item in report['comparison']:
+            if item['status'] != 'ok':
+                print(f"{item['status'].upper():<12} {item['name']} coins={item['coins']} window={item['window']} "
+                      f"{item['baseline_ms']:.3f}ms -> {item['median_ms']:.3f}ms ({item['ratio']:.2f}x)")
+        regressions = sum(item['status'] == 'regression' for item in report['comparison'])
+        print(f"{len(report['comparison'])} compared, {regressions} regressions")
+        exit_code = 1 if regressions else exit_code
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"results saved at: {args.output}")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
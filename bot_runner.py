@@ -0,0 +1,104 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from market_bus import MarketDataBus
+from okx_gateway import OkxGateway
+from okx_trade import okxbot
+from scheduler import CandleScheduler
+from trade_bot import TradingBot
+
+__all__ = ['MultiBotRunner']
+
+
+class MultiBotRunner:
+    """
+    一个进程内运行多个 TradingBot（不同策略/模拟盘与实盘）
+    - 同一环境的机器人共用一个 MarketDataBus，相同的 (instId, bar) 每根K线只请求一次
+    - 每个机器人有自己的 okxbot（凭证、账户快照、下单）和交易日志目录，所有 okxbot 共用一个 OkxGateway 限速
+    - 所有机器人由同一个 CandleScheduler 触发：收盘后先刷新共享行情，再并发运行各机器人的交易周期
+    """
+
+    def __init__(self, bar='3m', journal_root="./trade_journal", max_workers=8, settle=1.0, prefetch_lead=10.0,
+                 overrun='skip', candle_limit=100):
+        self.bar = bar
+        self.journal_root = journal_root
+        self.max_workers = max_workers
+        self.settle = settle
+        self.prefetch_lead = prefetch_lead
+        self.overrun = overrun
+        self.candle_limit = candle_limit
+        self.bots = {}
+        self.buses = {}
+        # 公共接口按IP限速，所有机器人和行情总线合计；私有接口在网关内按账户分别限速
+        self.gateway = OkxGateway()
+        self.scheduler = None
+
+    def bus(self, is_simulated=True):
+        """模拟盘和实盘的行情不同，各用一个总线"""
+        flag = "1" if is_simulated else "0"
+        if flag not in self.buses:
+            self.buses[flag] = MarketDataBus(okxbot(is_simulated, self.gateway), candle_limit=self.candle_limit,
+                                             settle=self.settle, max_workers=self.max_workers)
+        return self.buses[flag]
+
+    def add_bot(self, name, is_simulated=True, **kwargs):
+        """kwargs 传给 TradingBot；未指定 journal_dir 时每个机器人写入 journal_root/name"""
+        if name in self.bots:
+            raise ValueError(f"duplicate bot name: {name}")
+        kwargs.setdefault('journal_dir', os.path.join(self.journal_root, name))
+        kwargs.setdefault('gateway', self.gateway)
+        bot = TradingBot(is_simulated=is_simulated, market_bus=self.bus(is_simulated), **kwargs)
+        self.bots[name] = bot
+        return bot
+
+    def _each_bot(self, fn):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {name: executor.submit(fn, bot) for name, bot in self.bots.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print(f"❌ bot {name} failed: {e}")
+                results[name] = False
+        return results
+
+    def prefetch(self, close_ms=None):
+        """收盘前各机器人预取自己的账户余额/持仓"""
+        self._each_bot(lambda bot: bot.prefetch())
+
+    def run_cycle(self, close_ms=None):
+        """刷新共享行情后并发运行所有机器人的一个交易周期，返回 {name: 执行结果}"""
+        for bus in self.buses.values():
+            bus.refresh()
+        results = self._each_bot(lambda bot: bot.run_single_cycle())
+        for flag, bus in self.buses.items():
+            print(f"market bus {'simulated' if flag == '1' else 'live'}: {bus.stats()}")
+        return results
+
+    def run(self):
+        """阻塞运行，每根 bar 收盘后运行一次所有机器人"""
+        self.scheduler = CandleScheduler(settle=self.settle, prefetch_lead=self.prefetch_lead, overrun=self.overrun)
+        self.scheduler.add(f"{self.bar} {','.join(self.bots)}", self.bar, self.run_cycle, prefetch=self.prefetch)
+        for bot in self.bots.values():
+            threading.Thread(target=bot.model.warm_up, daemon=True).start()
+        self.scheduler.run()
+
+    def stop(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+    def stats(self):
+        return {
+            'buses': {flag: bus.stats() for flag, bus in self.buses.items()},
+            'gateway': self.gateway.stats(),
+            'scheduler': self.scheduler.stats() if self.scheduler is not None else None
+        }
+
+
+if __name__ == '__main__':
+    runner = MultiBotRunner()
+    runner.add_bot("spot", is_simulated=True, coin_list=["DOGE-USDT", "BTC-USDT"])
+    runner.add_bot("spot-compact", is_simulated=True, coin_list=["DOGE-USDT", "BTC-USDT"], prompt_token_budget=4000)
+    runner.run()
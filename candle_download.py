@@ -0,0 +1,327 @@
+"""
+批量下载历史K线：按 history-candles 接口向前翻页，多个 (instId, bar) 和多页并发请求（经 OkxGateway 限速）
+结果按列压缩保存为 .npz（timestamp/open/high/low/close/volume/vol_ccy），np.load 直接得到数组
+中断后重新运行只补缺失的部分；页之间重叠的K线按时间戳去重
+
+    python candle_download.py --coins BTC-USDT ETH-USDT --bars 3m 1H --days 365     # 写入 ./candle_history
+    python candle_download.py --stand-in --coins DOGE-USDT --days 30                # 本地模拟服务离线演示
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from candle_store import CANDLE_DTYPE, bar_to_ms, merge_candles, parse_okx_candles
+
+__all__ = ['HistoryDownloader', 'StandInCandleServer', 'load_candles', 'save_candles', 'history_path']
+
+# history-candles 接口单次最多返回100根
+HISTORY_PAGE_LIMIT = 100
+
+
+def history_path(root, instId, bar):
+    return os.path.join(root, f"{instId}_{bar}.npz")
+
+
+def save_candles(path, candles, exhausted=False):
+    """按列压缩保存；先写临时文件再替换，中断时不会留下损坏的文件"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, exhausted=np.array(exhausted), **{name: candles[name] for name in CANDLE_DTYPE.names})
+    os.replace(tmp_path, path)
+
+
+def load_candles(path):
+    """读取 .npz 为 CANDLE_DTYPE 结构化数组（旧→新）；只需某几列时可直接 np.load(path)['close']"""
+    candles, _ = _load(path)
+    return candles
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=CANDLE_DTYPE), False
+    with np.load(path) as data:
+        candles = np.empty(len(data['timestamp']), dtype=CANDLE_DTYPE)
+        for name in CANDLE_DTYPE.names:
+            candles[name] = data[name]
+        return candles, bool(data['exhausted'])
+
+
+class HistoryDownloader:
+    """
+    market_api: 有 get_history_candlesticks(instId, after, before, bar, limit) 的客户端，如 okxbot().marketDataAPI
+    每个 (instId, bar) 先补上次下载之后的新K线，再从已有数据最早的K线继续向前，直到 start_ms 或没有更多数据
+    每批 batch_pages 页并发请求；失败的页重试 retries 次，仍失败时保存失败页之前已完成的部分
+    """
+
+    def __init__(self, market_api, root="./candle_history", max_workers=8, batch_pages=8, retries=3,
+                 retry_delay=1.0, page_limit=HISTORY_PAGE_LIMIT, checkpoint_interval=10.0):
+        self.market_api = market_api
+        self.root = root
+        self.max_workers = max_workers
+        self.batch_pages = batch_pages
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.page_limit = page_limit
+        # 向前翻页时每隔多少秒写一次文件
+        self.checkpoint_interval = checkpoint_interval
+        self.pages = 0
+        self.retried = 0
+        self.lock = threading.Lock()
+        self.page_executor = None
+
+    def _fetch_page(self, instId, bar, after):
+        """返回 after 之前（不含）最多 page_limit 根已收盘K线，旧→新"""
+        for attempt in range(self.retries + 1):
+            try:
+                result = self.market_api.get_history_candlesticks(instId=instId, after=str(after), bar=bar,
+                                                                  limit=str(self.page_limit))
+                if result.get('code') == '0':
+                    with self.lock:
+                        self.pages += 1
+                    rows = [row for row in result.get('data', []) if len(row) < 9 or row[8] == '1']
+                    return parse_okx_candles(rows)
+                error = f"code={result.get('code')} msg={result.get('msg')}"
+            except Exception as e:
+                error = str(e)
+            if attempt < self.retries:
+                with self.lock:
+                    self.retried += 1
+                time.sleep(self.retry_delay * (attempt + 1))
+        raise RuntimeError(f"history candles {instId} {bar} after={after} failed: {error}")
+
+    def _fetch_back(self, instId, bar, after, stop_ms, on_batch):
+        """
+        从 after 向前翻页直到 stop_ms；每批页按固定间隔的游标并发请求，返回是否已没有更早的数据
+        K线有缺口时一页覆盖的时间更长，与下一页重叠的部分在合并时去重
+        """
+        step = self.page_limit * bar_to_ms(bar)
+        while after > stop_ms:
+            cursors = [after - i * step for i in range(self.batch_pages) if after - i * step > stop_ms]
+            futures = [self.page_executor.submit(contextvars.copy_context().run, self._fetch_page, instId, bar, cursor)
+                       for cursor in cursors]
+            pages = []
+            failure = None
+            for future in futures:
+                try:
+                    pages.append(future.result())
+                except Exception as e:
+                    # 只保留失败页之前（更新的一侧）连续的部分
+                    failure = e
+                    break
+            if pages:
+                on_batch(merge_candles(*reversed(pages)))
+            if failure is not None:
+                raise failure
+            if any(not len(page) for page in pages):
+                return True
+            after = min(int(page['timestamp'][0]) for page in pages)
+        return False
+
+    def download(self, instId, bar, start_ms, end_ms=None):
+        """下载 [start_ms, end_ms) 的已收盘K线，返回统计"""
+        if self.page_executor is not None:
+            return self._download(instId, bar, start_ms, end_ms)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as page_executor:
+            self.page_executor = page_executor
+            try:
+                return self._download(instId, bar, start_ms, end_ms)
+            finally:
+                self.page_executor = None
+
+    def _download(self, instId, bar, start_ms, end_ms):
+        path = history_path(self.root, instId, bar)
+        end_ms = int(time.time() * 1000) if end_ms is None else int(end_ms)
+        candles, exhausted = _load(path)
+        before = len(candles)
+        state = {'candles': candles, 'exhausted': exhausted, 'pending': [], 'saved': time.time()}
+
+        def save():
+            state['candles'] = merge_candles(*reversed(state['pending']), state['candles'])
+            state['pending'] = []
+            state['saved'] = time.time()
+            save_candles(path, state['candles'], state['exhausted'])
+
+        if len(candles):
+            # 上次下载之后的新K线：全部取完后再写入，中途失败不会在中间留下缺口
+            last_ts = int(candles['timestamp'][-1])
+            if end_ms > last_ts + bar_to_ms(bar):
+                newer = []
+                self._fetch_back(instId, bar, end_ms, last_ts, newer.append)
+                state['candles'] = merge_candles(state['candles'], *reversed(newer))
+                save()
+            after = int(state['candles']['timestamp'][0])
+        else:
+            after = end_ms
+
+        def checkpoint(batch):
+            # 向前翻页的数据总是与已有数据连续，定期写入文件，中断后从最早的K线继续
+            state['pending'].append(batch)
+            if time.time() - state['saved'] >= self.checkpoint_interval:
+                save()
+
+        if not state['exhausted'] and after > start_ms:
+            try:
+                state['exhausted'] = self._fetch_back(instId, bar, after, start_ms, checkpoint)
+            finally:
+                save()
+        candles = state['candles']
+        return {
+            'instId': instId,
+            'bar': bar,
+            'path': path,
+            'candles': len(candles),
+            'added': len(candles) - before,
+            'first': int(candles['timestamp'][0]) if len(candles) else None,
+            'last': int(candles['timestamp'][-1]) if len(candles) else None,
+            'exhausted': state['exhausted']
+        }
+
+    def download_all(self, coin_list, bars, start_ms, end_ms=None):
+        """并发下载所有 (instId, bar)，返回 {(instId, bar): 统计或 {'error': ...}}；失败的重新运行即可续传"""
+        jobs = [(instId, bar) for instId in coin_list for bar in bars]
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as page_executor, \
+                ThreadPoolExecutor(max_workers=max(1, len(jobs))) as job_executor:
+            self.page_executor = page_executor
+            futures = {job: job_executor.submit(contextvars.copy_context().run, self._download, *job, start_ms, end_ms)
+                       for job in jobs}
+            for job, future in futures.items():
+                try:
+                    results[job] = future.result()
+                except Exception as e:
+                    print(f"❌ {job[0]} {job[1]} download failed, rerun to resume: {e}")
+                    results[job] = {'instId': job[0], 'bar': job[1], 'error': str(e)}
+        self.page_executor = None
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {'pages': self.pages, 'retried': self.retried}
+
+
+class StandInCandleServer:
+    """
+    本地模拟的 OKX history-candles HTTP 接口，用于离线测试下载器
+    history: {instId: {bar: CANDLE_DTYPE 数组}}（如 backtest.synthetic_history 的结果）
+    fail_every: 每隔多少个请求返回一次限速错误（HTTP 429, code 50011），用于测试重试
+    """
+
+    def __init__(self, history, host="127.0.0.1", port=0, fail_every=None):
+        self.history = history
+        self.fail_every = fail_every
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.handle(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.host, self.port = self.httpd.server_address[:2]
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def handle(self, path):
+        with self.lock:
+            self.requests += 1
+            fail = self.fail_every and self.requests % self.fail_every == 0
+        if fail:
+            return 429, {'code': '50011', 'msg': 'Too Many Requests', 'data': []}
+        url = urlparse(path)
+        if url.path != '/api/v5/market/history-candles':
+            return 404, {'code': '50000', 'msg': 'not found', 'data': []}
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        candles = self.history.get(query.get('instId'), {}).get(query.get('bar', '1m'))
+        if candles is None:
+            return 200, {'code': '51001', 'msg': 'Instrument ID does not exist', 'data': []}
+        limit = min(int(query.get('limit') or HISTORY_PAGE_LIMIT), HISTORY_PAGE_LIMIT)
+        end = len(candles)
+        if query.get('after'):
+            end = int(np.searchsorted(candles['timestamp'], int(query['after']), side='left'))
+        page = candles[max(end - limit, 0):end][::-1]
+        data = [[str(c['timestamp']), repr(float(c['open'])), repr(float(c['high'])), repr(float(c['low'])),
+                 repr(float(c['close'])), repr(float(c['volume'])), repr(float(c['vol_ccy'])),
+                 repr(float(c['vol_ccy'])), '1'] for c in page]
+        return 200, {'code': '0', 'msg': '', 'data': data}
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="download OKX history candles into compressed columnar files")
+    parser.add_argument('--coins', nargs='+', default=["BTC-USDT"])
+    parser.add_argument('--bars', nargs='+', default=['3m'])
+    parser.add_argument('--days', type=float, default=30, help="how far back to download")
+    parser.add_argument('--output', default='./candle_history')
+    parser.add_argument('--workers', type=int, default=8, help="concurrent page requests")
+    parser.add_argument('--simulated', action='store_true', help="use the simulated trading environment")
+    parser.add_argument('--stand-in', action='store_true', help="download from a local stand-in server (offline)")
+    args = parser.parse_args(argv)
+
+    end_ms = int(time.time() * 1000)
+    start_ms = end_ms - int(args.days * 24 * 60 * 60 * 1000)
+    server = None
+    if args.stand_in:
+        from backtest import synthetic_history
+        from okx.MarketData import MarketAPI
+        from okx_gateway import OkxGateway
+        bars = sorted(args.bars, key=bar_to_ms)
+        history = synthetic_history(args.coins, days=args.days + 1, bars=tuple(bars))
+        # 合成K线的时间移到最近，与真实接口一样截止到当前时间
+        align = bar_to_ms(bars[-1])
+        for instId_bars in history.values():
+            shift = (end_ms - int(instId_bars[bars[0]]['timestamp'][-1])) // align * align
+            for candles in instId_bars.values():
+                candles['timestamp'] += shift
+        server = StandInCandleServer(history, fail_every=7).start()
+        market_api = OkxGateway().wrap(MarketAPI(flag="1", domain=server.url))
+        print(f"stand-in server at {server.url}")
+    else:
+        from okx_trade import okxbot
+        market_api = okxbot(args.simulated).marketDataAPI
+
+    downloader = HistoryDownloader(market_api, args.output, max_workers=args.workers, retry_delay=0.1 if server else 1.0)
+    started = time.time()
+    results = downloader.download_all(args.coins, args.bars, start_ms, end_ms)
+    for result in results.values():
+        if 'error' in result:
+            print(f"{result['instId']} {result['bar']}: failed ({result['error']})")
+        else:
+            print(f"{result['instId']} {result['bar']}: {result['candles']} candles (+{result['added']}) "
+                  f"exhausted={result['exhausted']} -> {result['path']}")
+    print(f"{downloader.stats()} in {time.time() - started:.1f}s")
+    if server is not None:
+        server.stop()
+    return 1 if any('error' in result for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import numpy as np
+
+from candle_store import CANDLE_DTYPE, OKX_MAX_CANDLES, bar_offset_ms, bar_to_ms, closed_candles, merge_candles
+
+__all__ = ['CandleResampler', 'resample_candles']
+
+
+def _period_starts(timestamps, bar):
+    period, offset = bar_to_ms(bar), bar_offset_ms(bar)
+    return (timestamps - offset) // period * period + offset
+
+
+def _aggregate(candles, bar):
+    """按 bar 的周期分组聚合（candles 旧→新），返回 (聚合K线, 每组第一根的索引, 每组最后一根的索引)"""
+    starts = _period_starts(candles['timestamp'], bar)
+    edges = np.flatnonzero(np.diff(starts)) + 1
+    first = np.concatenate([[0], edges])
+    last = np.concatenate([edges - 1, [len(candles) - 1]])
+    groups = np.zeros(len(first), dtype=CANDLE_DTYPE)
+    groups['timestamp'] = starts[first]
+    groups['open'] = candles['open'][first]
+    groups['high'] = np.maximum.reduceat(candles['high'], first)
+    groups['low'] = np.minimum.reduceat(candles['low'], first)
+    groups['close'] = candles['close'][last]
+    groups['volume'] = np.add.reduceat(candles['volume'], first)
+    groups['vol_ccy'] = np.add.reduceat(candles['vol_ccy'], first)
+    return groups, first, last
+
+
+def resample_candles(candles, bar, base_bar):
+    """
+    把基础K线（旧→新，已收盘）聚合为 bar 周期的K线，按OKX的K线边界对齐
+    只返回从周期开头开始、且周期已结束的完整K线
+    """
+    if candles is None or not len(candles):
+        return np.zeros(0, dtype=CANDLE_DTYPE)
+    groups, first, last = _aggregate(candles, bar)
+    base_ms = bar_to_ms(base_bar)
+    complete = ((candles['timestamp'][first] == groups['timestamp']) &
+                (candles['timestamp'][last] + base_ms >= groups['timestamp'] + bar_to_ms(bar)))
+    return groups[complete]
+
+
+class CandleResampler:
+    """
+    由基础K线（如3m）在本地维护更大周期的K线（如15m/1H/4H），每个周期只需请求基础K线
+    - 按OKX的K线边界对齐（1H及以上按UTC+8），开=首根开、高=最高、低=最低、收=末根收、量=求和
+    - update() 传入最新的基础K线，只处理上次之后新收盘的部分；周期最后一根基础K线收盘时该周期完成
+    - 基础K线没有覆盖到周期开头（刚启动）或中间有缺口（停机）时无法精确聚合，该周期需 seed() 用接口返回的K线补上
+    """
+
+    def __init__(self, base_bar='3m', bars=('4H',), capacity=1000):
+        self.base_bar = base_bar
+        self.base_ms = bar_to_ms(base_bar)
+        base_offset = bar_offset_ms(base_bar)
+        for bar in bars:
+            period = bar_to_ms(bar)
+            if period <= self.base_ms or period % self.base_ms or (bar_offset_ms(bar) - base_offset) % self.base_ms:
+                raise ValueError(f"{bar} candles cannot be built from {base_bar} candles")
+        self.bars = tuple(bars)
+        self.capacity = capacity
+        self.closed = {bar: np.zeros(0, dtype=CANDLE_DTYPE) for bar in self.bars}
+        # 当前未结束的周期: (聚合K线, 是否从周期开头开始)
+        self.current = {bar: None for bar in self.bars}
+        # 有周期没能精确聚合、需要重新 seed 的粒度
+        self.stale = set()
+        self.last_ts = None
+        self.live = None
+        self.lock = threading.Lock()
+
+    def warmup_size(self, now_ms=None):
+        """第一次需要的基础K线数量：覆盖每个粒度当前周期的开头（OKX单次最多300根）"""
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        needed = max(int((now_ms - _period_starts(np.int64(now_ms), bar)) // self.base_ms) + 2 for bar in self.bars)
+        return min(needed, OKX_MAX_CANDLES)
+
+    def update(self, candles, now_ms=None):
+        """candles: 最新的基础K线（旧→新），最后一根可以是未收盘的K线"""
+        if candles is None or not len(candles):
+            return
+        closed = closed_candles(candles, self.base_bar, now_ms)
+        with self.lock:
+            self.live = np.array(candles[-1:], dtype=CANDLE_DTYPE) if len(closed) < len(candles) else None
+            if self.last_ts is not None:
+                closed = closed[closed['timestamp'] > self.last_ts]
+                if len(closed) and int(closed['timestamp'][0]) > self.last_ts + self.base_ms:
+                    print(f"{self.base_bar} candles have a gap, {','.join(self.bars)} candles need reseeding")
+                    self.stale.update(self.bars)
+                    self.current = {bar: None for bar in self.bars}
+            if not len(closed):
+                return
+            for bar in self.bars:
+                self._update_bar(bar, closed)
+            self.last_ts = int(closed['timestamp'][-1])
+
+    def _update_bar(self, bar, candles):
+        groups, first, last = _aggregate(candles, bar)
+        exact = candles['timestamp'][first] == groups['timestamp']
+        current = self.current[bar]
+        if current is not None and current[0]['timestamp'][0] == groups['timestamp'][0]:
+            # 接上一次未结束的周期
+            previous, previous_exact = current
+            groups['open'][0] = previous['open'][0]
+            groups['high'][0] = max(previous['high'][0], groups['high'][0])
+            groups['low'][0] = min(previous['low'][0], groups['low'][0])
+            groups['volume'][0] = previous['volume'][0] + groups['volume'][0]
+            groups['vol_ccy'][0] = previous['vol_ccy'][0] + groups['vol_ccy'][0]
+            exact[0] = previous_exact
+        complete = candles['timestamp'][last] + self.base_ms >= groups['timestamp'] + bar_to_ms(bar)
+        finished = groups[complete]
+        # 不是从周期开头开始的（刚启动时的第一个周期）丢弃，由 seed() 补上
+        finished = finished[exact[complete]]
+        if len(finished):
+            self.closed[bar] = merge_candles(self.closed[bar], finished)[-self.capacity:]
+        self.current[bar] = None if complete[-1] else (groups[-1:].copy(), bool(exact[-1]))
+
+    def seed(self, bar, candles):
+        """用接口返回的已收盘K线（旧→新）补齐/覆盖本地的 bar 周期K线"""
+        if candles is None or not len(candles):
+            return
+        with self.lock:
+            self.closed[bar] = merge_candles(self.closed[bar], np.asarray(candles, dtype=CANDLE_DTYPE))[-self.capacity:]
+            self.stale.discard(bar)
+
+    def ready(self, bar, limit):
+        """本地数据足够返回 limit 根且都是精确聚合的结果"""
+        with self.lock:
+            current = self.current[bar]
+            if bar in self.stale or (current is not None and not current[1]):
+                return False
+            return len(self.closed[bar]) + 1 >= limit
+
+    def latest(self, bar, limit):
+        """返回最近 limit 根 bar 周期的K线（旧→新），最后一根为包含未收盘基础K线的当前周期"""
+        with self.lock:
+            partial = self.current[bar][0].copy() if self.current[bar] is not None else None
+            live = self.live
+            if live is not None:
+                start = _period_starts(live['timestamp'], bar)
+                if partial is None or partial['timestamp'][0] != start[0]:
+                    partial = live.copy()
+                    partial['timestamp'] = start
+                else:
+                    partial['high'] = np.maximum(partial['high'], live['high'])
+                    partial['low'] = np.minimum(partial['low'], live['low'])
+                    partial['close'] = live['close']
+                    partial['volume'] += live['volume']
+                    partial['vol_ccy'] += live['vol_ccy']
+            closed = self.closed[bar]
+            if partial is None:
+                return closed[-limit:].copy()
+            return np.concatenate([closed[len(closed) - min(limit - 1, len(closed)):], partial])
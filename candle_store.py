@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+CANDLE_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('vol_ccy', '<f8'),
+])
+
+# OKX K线接口单次最多返回300根
+OKX_MAX_CANDLES = 300
+
+_BAR_UNIT_MS = {'m': 60 * 1000, 'H': 60 * 60 * 1000, 'D': 24 * 60 * 60 * 1000, 'W': 7 * 24 * 60 * 60 * 1000,
+                'M': 31 * 24 * 60 * 60 * 1000}
+
+
+def bar_to_ms(bar):
+    """K线粒度转毫秒，如 '3m' -> 180000, '4H' -> 14400000（'1M' 按31天估算）"""
+    bar = bar.replace('utc', '')
+    return int(bar[:-1]) * _BAR_UNIT_MS[bar[-1]]
+
+
+def bar_offset_ms(bar):
+    """
+    K线起始时间相对 UTC 整点的偏移（毫秒）
+    OKX 1H 及以上的K线默认按 UTC+8 对齐（'utc' 后缀的按 UTC 对齐），周线从周一开始
+    """
+    unit = bar.replace('utc', '')[-1]
+    if unit == 'M':
+        raise ValueError(f"monthly bars have no fixed length: {bar}")
+    offset = 0 if unit == 'm' or bar.endswith('utc') else -8 * _BAR_UNIT_MS['H']
+    if unit == 'W':
+        # 1970-01-01 是周四，周一为其后第4天
+        offset += 4 * _BAR_UNIT_MS['D']
+    return offset % bar_to_ms(bar)
+
+
+def closed_candles(candles, bar, now_ms=None):
+    """去掉最后一根尚未收盘的K线（旧→新的结构化数组），返回视图"""
+    if candles is None or not len(candles):
+        return candles
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    if int(candles['timestamp'][-1]) + bar_to_ms(bar) > now_ms:
+        return candles[:-1]
+    return candles
+
+
+def parse_okx_candle(candle):
+    """解析一条OKX K线 [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]，返回 (记录, 是否已收盘)"""
+    record = (int(candle[0]), float(candle[1]), float(candle[2]), float(candle[3]),
+              float(candle[4]), float(candle[5]), float(candle[6]))
+    confirmed = len(candle) < 9 or candle[8] != '0'
+    return record, confirmed
+
+
+def parse_okx_candles(candles):
+    """
+    一次遍历把OKX返回的K线（新→旧）解析为 CANDLE_DTYPE 结构化数组
+    返回旧→新的反向视图，不复制；各列 candles['close'] 等也是视图。解析失败的行跳过
+    """
+    try:
+        parsed = np.fromiter((parse_okx_candle(candle)[0] for candle in candles), dtype=CANDLE_DTYPE,
+                             count=len(candles))
+    except (ValueError, IndexError, TypeError):
+        records = []
+        for candle in candles:
+            try:
+                records.append(parse_okx_candle(candle)[0])
+            except (ValueError, IndexError, TypeError) as e:
+                print(f"Error parsing K-line data: {e}")
+        parsed = np.array(records, dtype=CANDLE_DTYPE)
+    return parsed[::-1]
+
+
+def merge_candles(*parts):
+    """合并多段K线并按时间戳去重（同一时间戳保留靠后参数中的K线），返回旧→新的结构化数组"""
+    candles = np.concatenate(parts) if parts else np.zeros(0, dtype=CANDLE_DTYPE)
+    if not len(candles):
+        return candles
+    # 反转后 np.unique 取到的是每个时间戳最后出现的那一根
+    reversed_candles = candles[::-1]
+    _, index = np.unique(reversed_candles['timestamp'], return_index=True)
+    return reversed_candles[index]
+
+
+class CandleBuffer:
+    """
+    单个 (instId, bar) 的K线环形缓冲区，数据保存在内存映射文件中，重启后可直接复用
+    只持久化已收盘的K线，未收盘的最新K线仅保存在内存里
+    """
+    HEADER_SIZE = 4  # [version, capacity, count, write_pos]
+    VERSION = 1
+
+    def __init__(self, path, bar, capacity=10000):
+        self.path = path
+        self.bar = bar
+        self.bar_ms = bar_to_ms(bar)
+        self.live = None
+        self.lock = threading.Lock()
+        header_bytes = self.HEADER_SIZE * 8
+        if os.path.exists(path):
+            self.header = np.memmap(path, dtype='<i8', mode='r+', shape=(self.HEADER_SIZE,))
+            if self.header[0] != self.VERSION:
+                raise ValueError(f"unsupported candle store file: {path}")
+            capacity = int(self.header[1])
+            self.data = np.memmap(path, dtype=CANDLE_DTYPE, mode='r+', offset=header_bytes, shape=(capacity,))
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as f:
+                f.truncate(header_bytes + capacity * CANDLE_DTYPE.itemsize)
+            self.header = np.memmap(path, dtype='<i8', mode='r+', shape=(self.HEADER_SIZE,))
+            self.header[:] = [self.VERSION, capacity, 0, 0]
+            self.data = np.memmap(path, dtype=CANDLE_DTYPE, mode='r+', offset=header_bytes, shape=(capacity,))
+            self.header.flush()
+        self.capacity = capacity
+
+    @property
+    def count(self):
+        return int(self.header[2])
+
+    @property
+    def last_timestamp(self):
+        if self.count == 0:
+            return None
+        return int(self.data[(int(self.header[3]) - 1) % self.capacity]['timestamp'])
+
+    @property
+    def first_timestamp(self):
+        if self.count == 0:
+            return None
+        return int(self.data[(int(self.header[3]) - self.count) % self.capacity]['timestamp'])
+
+    def clear(self):
+        self.header[2] = 0
+        self.header[3] = 0
+        self.live = None
+
+    def _append(self, record):
+        write_pos = int(self.header[3])
+        self.data[write_pos] = record
+        self.header[3] = (write_pos + 1) % self.capacity
+        self.header[2] = min(self.count + 1, self.capacity)
+
+    def fetch_size(self, limit, now_ms=None):
+        """本地已有数据时只需请求上次收盘之后的K线（多取一根用于校验连续性）"""
+        last_ts = self.last_timestamp
+        if last_ts is None or self.count < limit - 1:
+            return limit
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        missing = max(now_ms - last_ts, 0) // self.bar_ms + 1
+        return int(min(missing, OKX_MAX_CANDLES))
+
+    def merge(self, okx_candles):
+        """
+        合并OKX返回的K线（新→旧），跳过已存在的部分
+        与本地数据不连续、或返回的数据比本地更长时，用返回的数据重建
+        """
+        parsed = []
+        for candle in reversed(okx_candles):
+            try:
+                parsed.append(parse_okx_candle(candle))
+            except (ValueError, IndexError) as e:
+                print(f"Error parsing K-line data: {e}")
+        with self.lock:
+            closed = [record for record, confirmed in parsed if confirmed]
+            last_ts = self.last_timestamp
+            if closed and last_ts is not None:
+                if closed[0][0] > last_ts + self.bar_ms:
+                    print(f"{self.path} K-line gap detected, rebuilding local store")
+                    self.clear()
+                    last_ts = None
+                elif closed[0][0] < self.first_timestamp:
+                    self.clear()
+                    last_ts = None
+            for record in closed:
+                if last_ts is None or record[0] > last_ts:
+                    self._append(record)
+                    last_ts = record[0]
+            live = [record for record, confirmed in parsed if not confirmed]
+            self.live = live[-1] if live else None
+            if self.live is not None and last_ts is not None and self.live[0] <= last_ts:
+                self.live = None
+            self.header.flush()
+            self.data.flush()
+
+    def latest(self, limit):
+        """返回最近 limit 根K线（旧→新，含未收盘K线）的结构化数组"""
+        with self.lock:
+            closed_limit = limit - 1 if self.live is not None else limit
+            k = max(min(closed_limit, self.count), 0)
+            start = int(self.header[3]) - k
+            candles = self.data[np.arange(start, start + k) % self.capacity]
+            if self.live is not None:
+                candles = np.concatenate([candles, np.array([self.live], dtype=CANDLE_DTYPE)])
+        return candles
+
+
+class CandleStore:
+    def __init__(self, root="./candle_store", capacity=10000):
+        self.root = root
+        self.capacity = capacity
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def get_buffer(self, instId, bar):
+        key = (instId, bar)
+        with self.lock:
+            if key not in self.buffers:
+                path = os.path.join(self.root, f"{instId}_{bar}.candles")
+                self.buffers[key] = CandleBuffer(path, bar, self.capacity)
+            return self.buffers[key]
@@ -1,17 +1,84 @@
+import threading
+import time
+
+from candle_resample import CandleResampler
+from candle_store import closed_candles, parse_okx_candles
+from tracing import traced
+
+__all__ = ['DataCollector', 'TradingDataCollector', 'TechnicalIndicators']
+
+
 class DataCollector:
-    def __init__(self, okxbot,coin_list, trade_mode="spot"):
+    def __init__(self, okxbot,coin_list, trade_mode="spot", candle_store=None, market_stream=None, resample_bars=None, base_bar='3m'):
         self.data_collectors=[]
         for each in coin_list:
-            self.data_collectors.append(TradingDataCollector(okxbot,each,trade_mode))
+            self.data_collectors.append(TradingDataCollector(okxbot,each,trade_mode,candle_store,market_stream,resample_bars,base_bar))
 
 
 
 class TradingDataCollector:
-    def __init__(self,okxbot,instId,trade_mode="spot"):
+    # 同一时刻（如并发获取3m和4H）的基础K线请求在这段时间内共用一次
+    BASE_TTL = 2.0
+
+    def __init__(self,okxbot,instId,trade_mode="spot",candle_store=None,market_stream=None,resample_bars=None,base_bar='3m'):
         self.instId=instId
         self.okxbot=okxbot
+        self.candle_store=candle_store
+        self.market_stream=market_stream
+        # resample_bars=('4H',) 时大周期K线由基础K线在本地聚合，每个周期只请求 base_bar 的K线
+        self.resampler = CandleResampler(base_bar, resample_bars) if resample_bars else None
+        self._base_lock = threading.Lock()
+        self._base_cache = None
 
+    @traced("data.price_data")
     def get_price_data(self, bar='3m', limit=50):
+        if self.resampler is not None:
+            if bar == self.resampler.base_bar:
+                return self._get_base(limit)
+            if bar in self.resampler.bars:
+                return self._get_resampled(bar, limit)
+        return self._fetch_price_data(bar, limit)
+
+    def _get_base(self, limit):
+        """获取基础K线并更新本地聚合；缓存中的数据足够且仍在同一根K线内时直接复用"""
+        resampler = self.resampler
+        with self._base_lock:
+            now = time.time()
+            cached = self._base_cache
+            if (cached is not None and now - cached[0] < self.BASE_TTL and len(cached[1]) >= limit
+                    and int(now * 1000) // resampler.base_ms == int(cached[0] * 1000) // resampler.base_ms):
+                return cached[1][-limit:]
+            if resampler.last_ts is None:
+                fetch_size = max(limit, resampler.warmup_size())
+            else:
+                # 停了一段时间后多取一些，补上中间缺少的K线
+                missed = (int(now * 1000) - resampler.last_ts) // resampler.base_ms + 1
+                fetch_size = max(limit, min(missed, resampler.warmup_size()))
+            # 预热/补缺口是一次性的大请求，走自己的REST，不让共享的行情源（MarketDataBus）之后都按这个数量请求
+            candles = self._fetch_price_data(resampler.base_bar, fetch_size, shared=fetch_size <= limit)
+            if candles is None or not len(candles):
+                return candles
+            resampler.update(candles)
+            self._base_cache = (now, candles)
+            return candles[-limit:]
+
+    def _get_resampled(self, bar, limit):
+        """本地聚合的K线足够时直接返回，否则（刚启动/有缺口）请求一次接口并补到本地"""
+        self._get_base(limit)
+        if self.resampler.ready(bar, limit):
+            return self.resampler.latest(bar, limit)
+        candles = self._fetch_price_data(bar, limit)
+        if candles is not None and len(candles):
+            self.resampler.seed(bar, closed_candles(candles, bar))
+        return candles
+
+    def _fetch_price_data(self, bar, limit, shared=True):
+        if shared and self.market_stream is not None:
+            candles = self.market_stream.get_candles(self.instId, bar, limit)
+            if candles:
+                return self._parse_candle_data(candles)
+        if self.candle_store is not None:
+            return self._get_price_data_incremental(bar, limit)
         print(f"Requesting {self.instId} K-line data")
         result = self.okxbot.get_coin_kline(self.instId, bar, limit)
         if result and 'data' in result:
@@ -21,26 +88,26 @@ class TradingDataCollector:
             print("failed to retrieve K-line data")
             return None
 
+    def _get_price_data_incremental(self, bar, limit):
+        """只请求本地K线存储中最后一根已收盘K线之后的数据"""
+        buffer = self.candle_store.get_buffer(self.instId, bar)
+        fetch_size = buffer.fetch_size(limit)
+        print(f"Requesting {self.instId} {bar} K-line data, {fetch_size} candles")
+        result = self.okxbot.get_coin_kline(self.instId, bar, fetch_size)
+        if result and 'data' in result:
+            buffer.merge(result['data'])
+        else:
+            print("failed to retrieve K-line data")
+            return None
+        return buffer.latest(limit)
+
     def _parse_candle_data(self, candle_data):
-        candles = []
-        for candle in reversed(candle_data):  # 反转数据，从旧到新
-            try:
-                candles.append({
-                    'timestamp': int(candle[0]),
-                    'open': float(candle[1]),
-                    'high': float(candle[2]),
-                    'low': float(candle[3]),
-                    'close': float(candle[4]),
-                    'volume': float(candle[5]),
-                    'vol_ccy': float(candle[6])
-                })
-            except (ValueError, IndexError) as e:
-                print(f"Error parsing K-line data: {e}")
-                continue
-        return candles
+        """OKX K线（新→旧）-> CANDLE_DTYPE 结构化数组（旧→新的视图）"""
+        return parse_okx_candles(candle_data)
 
+    @traced("data.account_info")
     def get_account_info(self):
-        result = self.okxbot.account.get_account_balance()
+        result = self.okxbot.snapshot.get_account_balance()
         if result and 'data' in result and result['data']:
             return self._parse_account_data(result['data'][0])
         return None
@@ -69,9 +136,10 @@ class TradingDataCollector:
             print(f"Error parsing account data: {e}")
             return None
 
+    @traced("data.positions")
     def get_positions(self):
         try:
-            result = self.okxbot.account.get_positions()
+            result = self.okxbot.snapshot.get_positions()
 
             if result and 'data' in result:
                 all_positions = result['data']
@@ -127,11 +195,19 @@ class TradingDataCollector:
             print(f"❌ 解析持仓数据错误: {e}")
             return {'btc_position': {'quantity': 0.0}}
 
+    @traced("data.funding_rate")
     def get_funding_rate(self):
+        if self.market_stream is not None:
+            rate_data = self.market_stream.get_funding_rate(self.instId)
+            if rate_data:
+                return self._parse_funding_rate(rate_data)
         print("获取资金费率")
         result = self.okxbot.publicDataAPI.get_funding_rate(self.instId)
         if result and 'data' in result and result['data']:
-            rate_data = result['data'][0]
+            return self._parse_funding_rate(result['data'][0])
+        return {'rate': 1.25e-05, 'next_rate': 1.25e-05, 'time': 0}
+
+    def _parse_funding_rate(self, rate_data):
             funding_rate = rate_data.get('fundingRate', '0')
             next_funding_rate = rate_data.get('nextFundingRate', '0')
             try:
@@ -148,9 +224,17 @@ class TradingDataCollector:
                 'next_rate': next_funding_rate_float,
                 'time': int(rate_data.get('fundingTime', 0))
             }
-        return {'rate': 1.25e-05, 'next_rate': 1.25e-05, 'time': 0}
 
+    @traced("data.open_interest")
     def get_open_interest(self):
+        if self.market_stream is not None:
+            oi_data = self.market_stream.get_open_interest(self.instId)
+            if oi_data:
+                current_oi = float(oi_data.get('oi', 0))
+                return {
+                    'latest': current_oi,
+                    'average': current_oi
+                }
         print("getOpenInterest")
         result = self.okxbot.publicDataAPI.get_open_interest(instId=self.instId)
         if result and 'data' in result and result['data']:
@@ -164,46 +248,358 @@ class TradingDataCollector:
             print()
 
 
-import pandas as pd
+import numpy as np
 
 class TechnicalIndicators:
+    """
+    指标计算内核，输入为二维数组(币种 × K线)，一次调用计算所有币种
+    沿时间轴逐列推进、在币种维度上向量化，运算顺序与 pandas 的 ewm/rolling 相同，结果逐位一致
+    单序列的 calculate_* 方法是对批量内核的简单包装
+    """
+
+    # 币种数不超过该值时走逐行的标量递推；两条路径的交叉点约在30~40个币种，与K线根数关系不大
+    # 可用 benchmark.py 的 indicators.calculate_batch.scalar/numpy 重新校准
+    SCALAR_ROWS = 32
+
+    @staticmethod
+    def _as_2d(values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[np.newaxis, :]
+        return values
+
+    @staticmethod
+    def batch_ema(values, period):
+        return TechnicalIndicators._batch_ewm(values, 2.0 / (period + 1.0))
+
+    @staticmethod
+    def batch_wilder(values, period):
+        """Wilder 平滑（ADX/DMI 使用），即 ewm(alpha=1/period, adjust=False)"""
+        return TechnicalIndicators._batch_ewm(values, 1.0 / period)
+
+    @staticmethod
+    def _batch_ewm(values, alpha):
+        values = TechnicalIndicators._as_2d(values)
+        old_wt = 1.0 - alpha
+        k, n = values.shape
+        out = np.empty_like(values)
+        if k <= TechnicalIndicators.SCALAR_ROWS:
+            # 币种很少时逐行用 Python float 递推，比逐列调用 numpy 快；运算完全相同
+            for r in range(k):
+                row = values[r].tolist()
+                weighted = row[0]
+                result = [weighted]
+                for cur in row[1:]:
+                    if weighted != cur:
+                        weighted = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+                    result.append(weighted)
+                out[r] = result
+            return out
+        weighted = values[:, 0].copy()
+        out[:, 0] = weighted
+        for t in range(1, n):
+            cur = values[:, t]
+            updated = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+            weighted = np.where(weighted != cur, updated, weighted)
+            out[:, t] = weighted
+        return out
+
+    @staticmethod
+    def _window_sums(values, period):
+        """窗口和：先移出旧值再加入新值，加/减各自做Kahan补偿（与 pandas 相同的累加顺序）"""
+        k, n = values.shape
+        sums = np.empty((k, n))
+        if k <= TechnicalIndicators.SCALAR_ROWS:
+            for r in range(k):
+                row = values[r].tolist()
+                sum_x = comp_add = comp_remove = 0.0
+                result = []
+                # 前 period 个只加入，之后每步先移出 period 之前的值
+                for cur in row[:period]:
+                    y = cur - comp_add
+                    s = sum_x + y
+                    comp_add = s - sum_x - y
+                    sum_x = s
+                    result.append(sum_x)
+                for cur, old in zip(row[period:], row):
+                    y = -old - comp_remove
+                    s = sum_x + y
+                    comp_remove = s - sum_x - y
+                    sum_x = s
+                    y = cur - comp_add
+                    s = sum_x + y
+                    comp_add = s - sum_x - y
+                    sum_x = s
+                    result.append(sum_x)
+                sums[r] = result
+            return sums
+        sum_x = np.zeros(k)
+        comp_add = np.zeros(k)
+        comp_remove = np.zeros(k)
+        for t in range(n):
+            if t >= period:
+                y = -values[:, t - period] - comp_remove
+                s = sum_x + y
+                comp_remove = s - sum_x - y
+                sum_x = s
+            y = values[:, t] - comp_add
+            s = sum_x + y
+            comp_add = s - sum_x - y
+            sum_x = s
+            sums[:, t] = sum_x
+        return sums
+
+    @staticmethod
+    def _window_count(flags, period):
+        """每个位置往前 period 个元素中 flags 为真的个数"""
+        counts = np.cumsum(flags, axis=1)
+        counts[:, period:] -= counts[:, :-period].copy()
+        return counts
+
+    @staticmethod
+    def batch_rolling_mean(values, period):
+        """与 rolling(window=period).mean() 逐位一致"""
+        values = TechnicalIndicators._as_2d(values)
+        k, n = values.shape
+        out = np.full((k, n), np.nan)
+        if n < period:
+            return out
+        result = TechnicalIndicators._window_sums(values, period)[:, period - 1:] / period
+        # pandas 的修正规则：窗口全为非负/全为负时消除补偿误差，窗口内数值全相同时直接取该值
+        neg_ct = TechnicalIndicators._window_count(np.signbit(values), period)[:, period - 1:]
+        result = np.where((neg_ct == 0) & (result < 0), 0.0, result)
+        result = np.where((neg_ct == period) & (result > 0), 0.0, result)
+        same = np.zeros((k, n), dtype=bool)
+        same[:, 1:] = values[:, 1:] == values[:, :-1]
+        same_ct = TechnicalIndicators._window_count(same, period - 1)[:, period - 1:] if period > 1 else None
+        if same_ct is not None:
+            result = np.where(same_ct >= period - 1, values[:, period - 1:], result)
+        else:
+            result = values.copy()
+        out[:, period - 1:] = result
+        return out
+
+    @staticmethod
+    def batch_macd(values, fast=12, slow=26, signal=9):
+        values = TechnicalIndicators._as_2d(values)
+        macd_line = TechnicalIndicators.batch_ema(values, fast) - TechnicalIndicators.batch_ema(values, slow)
+        signal_line = TechnicalIndicators.batch_ema(macd_line, signal)
+        return {
+            'macd': macd_line,
+            'signal': signal_line,
+            'histogram': macd_line - signal_line
+        }
+
+    @staticmethod
+    def _delta(values):
+        delta = np.zeros_like(values)
+        delta[:, 1:] = values[:, 1:] - values[:, :-1]
+        return delta
+
+    @staticmethod
+    def _gain_loss(delta):
+        gain = np.where(delta > 0, delta, 0.0)
+        # 与 -delta.where(delta < 0, 0) 相同，非下跌处为 -0.0
+        loss = -np.where(delta < 0, delta, 0.0)
+        return gain, loss
+
+    @staticmethod
+    def _rsi(gain, loss, period):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = TechnicalIndicators.batch_rolling_mean(gain, period) / TechnicalIndicators.batch_rolling_mean(loss, period)
+            return 100 - (100 / (1 + rs))
+
+    @staticmethod
+    def batch_rsi(values, period=14):
+        values = TechnicalIndicators._as_2d(values)
+        gain, loss = TechnicalIndicators._gain_loss(TechnicalIndicators._delta(values))
+        return TechnicalIndicators._rsi(gain, loss, period)
+
+    @staticmethod
+    def _true_range(high, low, close):
+        tr = high - low
+        prev_close = close[:, :-1]
+        tr[:, 1:] = np.maximum(np.maximum(tr[:, 1:], np.abs(high[:, 1:] - prev_close)), np.abs(low[:, 1:] - prev_close))
+        return tr
+
+    @staticmethod
+    def batch_atr(high_prices, low_prices, close_prices, period=14):
+        high = TechnicalIndicators._as_2d(high_prices)
+        low = TechnicalIndicators._as_2d(low_prices)
+        close = TechnicalIndicators._as_2d(close_prices)
+        return TechnicalIndicators.batch_rolling_mean(TechnicalIndicators._true_range(high, low, close), period)
+
+    @staticmethod
+    def _rolling_max(values, period):
+        """窗口最大值，前 period-1 个为 NaN：窗口长度逐次翻倍求最大值，O(n·log period)"""
+        k, n = values.shape
+        out = np.full((k, n), np.nan)
+        if n < period:
+            return out
+        span, peak = 1, values
+        while span * 2 <= period:
+            # peak[:, j] 为 values[:, j:j + span] 的最大值
+            peak = np.maximum(peak[:, :-span], peak[:, span:])
+            span *= 2
+        # 长度为 period 的窗口由首尾两个长度为 span 的窗口覆盖
+        out[:, period - 1:] = np.maximum(peak[:, :n - period + 1], peak[:, period - span:])
+        return out
+
+    @staticmethod
+    def _rolling_mean_std(values, period):
+        """窗口均值和样本标准差(ddof=1)，前 period-1 个为 NaN；由窗口和与平方和得到，O(n)"""
+        k, n = values.shape
+        mean = np.full((k, n), np.nan)
+        std = np.full((k, n), np.nan)
+        if n < period:
+            return mean, std
+        # 减去每个币种的第一个值再求平方和，避免价格量级下相减抵消
+        shift = values[:, :1]
+        deviation = values - shift
+        sums = TechnicalIndicators._window_sums(np.concatenate([deviation, deviation * deviation]), period)
+        total, squares = sums[:k, period - 1:], sums[k:, period - 1:]
+        mean[:, period - 1:] = total / period + shift
+        if period == 1:
+            # 单个值的样本标准差无定义
+            return mean, std
+        std[:, period - 1:] = np.sqrt(np.maximum(squares - total * total / period, 0.0) / (period - 1))
+        # 窗口内数值全相同时均值即该值、标准差为0，不留舍入误差
+        same = np.zeros((k, n), dtype=bool)
+        same[:, 1:] = values[:, 1:] == values[:, :-1]
+        flat = TechnicalIndicators._window_count(same, period - 1)[:, period - 1:] >= period - 1
+        mean[:, period - 1:] = np.where(flat, values[:, period - 1:], mean[:, period - 1:])
+        std[:, period - 1:] = np.where(flat, 0.0, std[:, period - 1:])
+        return mean, std
+
+    @staticmethod
+    def calculate_batch(high_prices, low_prices, close_prices, volumes, extended=()):
+        """
+        一次计算 PromptGenerator 需要的全部指标
+        Args:
+            high_prices, low_prices, close_prices, volumes: 二维数组(币种 × K线)，各币种K线数量相同
+            extended: 额外计算的扩展指标，EXTENDED 中的名称，如 ('bollinger', 'adx')
+        Returns:
+            dict: 序列指标为二维数组，atr3/成交量等标量指标为一维数组(每个币种一个值)
+        """
+        high = TechnicalIndicators._as_2d(high_prices)
+        low = TechnicalIndicators._as_2d(low_prices)
+        close = TechnicalIndicators._as_2d(close_prices)
+        volume = TechnicalIndicators._as_2d(volumes)
+        # 涨跌、真实波幅、EMA20、ATR14 只算一次，基础指标和扩展指标共用
+        delta = TechnicalIndicators._delta(close)
+        gain, loss = TechnicalIndicators._gain_loss(delta)
+        tr = TechnicalIndicators._true_range(high, low, close)
+        macd = TechnicalIndicators.batch_macd(close)
+        result = {
+            'ema20': TechnicalIndicators.batch_ema(close, 20),
+            'ema50': TechnicalIndicators.batch_ema(close, 50),
+            'macd': macd['macd'],
+            'macd_signal': macd['signal'],
+            'macd_histogram': macd['histogram'],
+            'rsi7': TechnicalIndicators._rsi(gain, loss, 7),
+            'rsi14': TechnicalIndicators._rsi(gain, loss, 14),
+            'atr14': TechnicalIndicators.batch_rolling_mean(tr, 14),
+            # 3周期ATR只取最近3根K线计算
+            'atr3': TechnicalIndicators.batch_atr(high[:, -3:], low[:, -3:], close[:, -3:], 3)[:, -1],
+            'current_volume': volume[:, -1],
+            'avg_volume': volume.mean(axis=1)
+        }
+        unknown = set(extended) - set(TechnicalIndicators.EXTENDED)
+        if unknown:
+            raise ValueError(f"unknown indicators: {sorted(unknown)}")
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name in extended:
+                result.update(getattr(TechnicalIndicators, f"_extended_{name}")(high, low, close, volume, delta, tr, result))
+        return result
+
+    # 扩展指标: 名称 -> (提示词中的标题, ((显示名, calculate_batch 结果中的键, 类型), ...))
+    # 类型 price 按价格精度显示，oscillator/ratio 为 0~100 / 0~1 的比值，volume 按成交量显示
+    EXTENDED = {
+        'bollinger': ("Bollinger Bands (20, 2σ)", (('upper', 'bb_upper', 'price'), ('middle', 'bb_middle', 'price'),
+                                                   ('lower', 'bb_lower', 'price'), ('%B', 'bb_percent_b', 'ratio'))),
+        'vwap': ("VWAP (series window)", (('vwap', 'vwap', 'price'),)),
+        'stochastic': ("Stochastic (14, 3)", (('%K', 'stoch_k', 'oscillator'), ('%D', 'stoch_d', 'oscillator'))),
+        'obv': ("On-Balance Volume", (('obv', 'obv', 'volume'),)),
+        'adx': ("ADX/DMI (14)", (('ADX', 'adx', 'oscillator'), ('+DI', 'plus_di', 'oscillator'),
+                                 ('-DI', 'minus_di', 'oscillator'))),
+        'keltner': ("Keltner Channel (EMA20, 2×ATR14)", (('upper', 'keltner_upper', 'price'),
+                                                         ('lower', 'keltner_lower', 'price'))),
+    }
+
+    @staticmethod
+    def _extended_bollinger(high, low, close, volume, delta, tr, base, period=20, width=2.0):
+        middle, std = TechnicalIndicators._rolling_mean_std(close, period)
+        upper, lower = middle + width * std, middle - width * std
+        # 价格不变时上下轨重合，%B 取中轨位置 0.5
+        percent_b = np.where(std == 0, 0.5, (close - lower) / (upper - lower))
+        return {'bb_upper': upper, 'bb_middle': middle, 'bb_lower': lower, 'bb_percent_b': percent_b}
+
+    @staticmethod
+    def _extended_vwap(high, low, close, volume, delta, tr, base):
+        # 从传入的第一根K线开始累计
+        typical = (high + low + close) / 3
+        return {'vwap': np.cumsum(typical * volume, axis=1) / np.cumsum(volume, axis=1)}
+
+    @staticmethod
+    def _extended_stochastic(high, low, close, volume, delta, tr, base, period=14, smooth=3):
+        # 最高价和取负的最低价叠成一个数组，一次求窗口最大值
+        extremes = TechnicalIndicators._rolling_max(np.concatenate([high, -low]), period)
+        highest, lowest = extremes[:len(high)], -extremes[len(high):]
+        k = 100 * (close - lowest) / (highest - lowest)
+        # %D 只平滑几根，直接把错开的几段相加
+        stoch_d = np.full_like(k, np.nan)
+        if k.shape[1] >= smooth:
+            stoch_d[:, smooth - 1:] = sum(k[:, i:k.shape[1] - smooth + 1 + i] for i in range(smooth)) / smooth
+        return {'stoch_k': k, 'stoch_d': stoch_d}
+
+    @staticmethod
+    def _extended_obv(high, low, close, volume, delta, tr, base):
+        return {'obv': np.cumsum(np.sign(delta) * volume, axis=1)}
+
+    @staticmethod
+    def _extended_adx(high, low, close, volume, delta, tr, base, period=14):
+        up = np.zeros_like(high)
+        down = np.zeros_like(low)
+        up[:, 1:] = high[:, 1:] - high[:, :-1]
+        down[:, 1:] = low[:, :-1] - low[:, 1:]
+        plus_dm = np.where((up > down) & (up > 0), up, 0.0)
+        minus_dm = np.where((down > up) & (down > 0), down, 0.0)
+        # 真实波幅和 ±DM 叠成一个数组，一次平滑
+        k = len(tr)
+        smoothed = TechnicalIndicators.batch_wilder(np.concatenate([tr, plus_dm, minus_dm]), period)
+        atr = smoothed[:k]
+        plus_di = 100 * smoothed[k:2 * k] / atr
+        minus_di = 100 * smoothed[2 * k:] / atr
+        total = plus_di + minus_di
+        dx = np.where(total > 0, 100 * np.abs(plus_di - minus_di) / total, 0.0)
+        # 第一根K线没有方向变动，ADX 从第二根开始平滑
+        adx = np.full_like(dx, np.nan)
+        if dx.shape[1] > 1:
+            adx[:, 1:] = TechnicalIndicators.batch_wilder(dx[:, 1:], period)
+        return {'adx': adx, 'plus_di': plus_di, 'minus_di': minus_di}
+
+    @staticmethod
+    def _extended_keltner(high, low, close, volume, delta, tr, base, width=2.0):
+        return {'keltner_upper': base['ema20'] + width * base['atr14'],
+                'keltner_lower': base['ema20'] - width * base['atr14']}
+
     @staticmethod
     def calculate_ema(prices, period):
-        return pd.Series(prices).ewm(span=period, adjust=False).mean().iloc[-1]
+        return TechnicalIndicators.batch_ema(prices, period)[0, -1]
 
     @staticmethod
     def calculate_macd(prices, fast=12, slow=26, signal=9):
-        series = pd.Series(prices)
-        ema_fast = series.ewm(span=fast, adjust=False).mean()
-        ema_slow = series.ewm(span=slow, adjust=False).mean()
-        macd_line = ema_fast - ema_slow
-        signal_line = macd_line.ewm(span=signal, adjust=False).mean()
-        histogram = macd_line - signal_line
+        macd = TechnicalIndicators.batch_macd(prices, fast, slow, signal)
         return {
-            'macd': macd_line.iloc[-1],
-            'signal': signal_line.iloc[-1],
-            'histogram': histogram.iloc[-1]
+            'macd': macd['macd'][0, -1],
+            'signal': macd['signal'][0, -1],
+            'histogram': macd['histogram'][0, -1]
         }
 
     @staticmethod
     def calculate_rsi(prices, period=14):
-        series = pd.Series(prices)
-        delta = series.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        return rsi.iloc[-1]
+        return TechnicalIndicators.batch_rsi(prices, period)[0, -1]
 
     @staticmethod
     def calculate_atr(high_prices, low_prices, close_prices, period=14):
-        high = pd.Series(high_prices)
-        low = pd.Series(low_prices)
-        close = pd.Series(close_prices)
-
-        tr1 = high - low
-        tr2 = abs(high - close.shift())
-        tr3 = abs(low - close.shift())
-        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-        atr = tr.rolling(window=period).mean()
-        return atr.iloc[-1]
+        return TechnicalIndicators.batch_atr(high_prices, low_prices, close_prices, period)[0, -1]
@@ -0,0 +1,191 @@
+import json
+import math
+import re
+
+__all__ = ['DecisionSchema', 'StreamingDecisionParser', 'SPOT_SCHEMA', 'SWAP_SCHEMA', 'decision_schema', 'parse_decisions']
+
+SIGNALS = ('buy', 'sell', 'hold', 'close')
+
+
+def _is_number(value):
+    # bool 是 int 的子类，不算数字；json 允许 NaN/Infinity，也不算
+    return (type(value) is int or type(value) is float) and math.isfinite(value)
+
+
+# 字段类型: (检查函数, 错误说明)
+_CHECKS = {
+    'number': (_is_number, "must be a number"),
+    'non_negative': (lambda v: _is_number(v) and v >= 0, "must be a number >= 0"),
+    'positive': (lambda v: _is_number(v) and v > 0, "must be a number > 0"),
+    'fraction': (lambda v: _is_number(v) and 0 <= v <= 1, "must be a number between 0 and 1"),
+    'text': (lambda v: type(v) is str, "must be a string"),
+}
+
+# 与 SYSTEM_PROMPT_SPOT / SYSTEM_PROMPT_SWAP 中的输出格式一致；只有 signal 必填，买卖时 quantity 必填
+SPOT_FIELDS = {
+    'signal': 'text', 'quantity': 'non_negative', 'price_target': 'non_negative', 'stop_loss': 'non_negative',
+    'invalidation_condition': 'text', 'justification': 'text', 'confidence': 'fraction',
+    'risk_percent': 'non_negative', 'timeframe': 'text', 'coin': 'text',
+}
+SWAP_FIELDS = {
+    'signal': 'text', 'quantity': 'non_negative', 'stop_loss': 'non_negative', 'profit_target': 'non_negative',
+    'invalidation_condition': 'text', 'justification': 'text', 'confidence': 'fraction', 'leverage': 'positive',
+    'risk_usd': 'non_negative', 'coin': 'text',
+}
+
+
+class DecisionSchema:
+    """
+    单个币种决策对象的校验，构造时把字段规则编译成 (字段, 检查函数, 说明) 元组，校验时不再查表
+    未知字段忽略；可选字段为 null 时视为未填写
+    """
+
+    def __init__(self, fields, signals=SIGNALS, required=('signal',), order_signals=('buy', 'sell')):
+        self.checks = tuple((name, *_CHECKS[kind]) for name, kind in fields.items())
+        self.signals = frozenset(signals)
+        self.required = tuple(required)
+        self.order_signals = frozenset(order_signals)
+
+    def validate(self, decision):
+        """返回错误列表，为空表示有效"""
+        if type(decision) is not dict:
+            return ["decision must be an object"]
+        errors = [f"missing '{name}'" for name in self.required if decision.get(name) is None]
+        for name, check, message in self.checks:
+            value = decision.get(name)
+            if value is not None and not check(value):
+                errors.append(f"'{name}' {message}, got {value!r}")
+        signal = decision.get('signal')
+        if signal is not None and signal not in self.signals:
+            errors.append(f"unknown signal {signal!r}, expected one of {sorted(self.signals)}")
+        elif signal in self.order_signals and not decision.get('quantity'):
+            errors.append(f"'{signal}' requires a quantity > 0")
+        return errors
+
+
+SPOT_SCHEMA = DecisionSchema(SPOT_FIELDS)
+SWAP_SCHEMA = DecisionSchema(SWAP_FIELDS)
+
+
+def decision_schema(trade_mode="spot"):
+    return SWAP_SCHEMA if trade_mode == "swap" else SPOT_SCHEMA
+
+
+# 一次匹配一个完整的字符串或结构字符；单独的引号表示字符串还没有结束
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]"]', re.S)
+_DECODER = json.JSONDecoder()
+
+
+class StreamingDecisionParser:
+    """
+    增量解析大模型的决策回复 {"BTC": {...}, "ETH": {...}}
+    每次 feed 一段流式文本，某个币种的对象一结束就解析、校验，有效的立即回调 on_decision(coin, decision)
+    第一个 { 之前（如 ```json）和顶层对象结束之后的文本忽略；顶层中不是对象的值忽略
+    """
+
+    def __init__(self, schema=SPOT_SCHEMA, on_decision=None):
+        self.schema = schema
+        self.on_decision = on_decision
+        self.decisions = {}
+        self.errors = {}
+        self.started = False
+        self.complete = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._key = None
+        self._object_start = None
+
+    def feed(self, chunk):
+        """返回本次新完成的有效决策 [(coin, decision)]"""
+        if self.complete or not chunk:
+            return []
+        self._text += chunk
+        emitted = []
+        text = self._text
+        if not self.started:
+            start = text.find('{', self._pos)
+            if start < 0:
+                # 开头的说明文字不需要保留
+                self._text = ""
+                return emitted
+            self.started, self._depth, self._pos = True, 1, start + 1
+        pos = self._pos
+        while True:
+            match = _TOKEN.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            token = match.group()
+            if token == '"':
+                # 字符串在这一段中没有结束，下一段从引号处重新匹配
+                pos = match.start()
+                break
+            pos = match.end()
+            if token[0] == '"':
+                if self._depth == 1:
+                    self._key = token
+            elif token in '{[':
+                self._depth += 1
+                if self._depth == 2 and token == '{':
+                    # 对象已经完整时由 json 的C实现一次解析到结尾，不完整时继续逐个匹配
+                    try:
+                        decision, pos = _DECODER.raw_decode(text, match.start())
+                    except json.JSONDecodeError:
+                        self._object_start = match.start()
+                        continue
+                    self._depth = 1
+                    decision = self._emit(decision)
+                    if decision is not None:
+                        emitted.append(decision)
+            else:
+                self._depth -= 1
+                if self._depth == 1 and self._object_start is not None:
+                    try:
+                        decision = json.loads(text[self._object_start:pos])
+                    except json.JSONDecodeError as e:
+                        decision = e
+                    decision = self._emit(decision)
+                    if decision is not None:
+                        emitted.append(decision)
+                    self._object_start = None
+                elif self._depth == 0:
+                    self.complete = True
+                    break
+        # 只保留还没解析完的部分
+        cut = pos if self._object_start is None else self._object_start
+        if self._object_start is not None:
+            self._object_start -= cut
+        self._text, self._pos = text[cut:], pos - cut
+        return emitted
+
+    def _emit(self, decision):
+        coin = json.loads(self._key) if self._key else None
+        self._key = None
+        if isinstance(decision, json.JSONDecodeError):
+            self.errors[coin] = [f"invalid JSON: {decision}"]
+            return None
+        if coin in self.decisions:
+            self.errors[coin] = ["duplicate decision, keeping the first one"]
+            return None
+        errors = self.schema.validate(decision)
+        if errors:
+            self.errors[coin] = errors
+            return None
+        self.decisions[coin] = decision
+        if self.on_decision is not None:
+            self.on_decision(coin, decision)
+        return coin, decision
+
+    def close(self):
+        """返回所有有效决策；没有找到 JSON 对象时返回 None"""
+        if not self.started:
+            return None
+        return self.decisions
+
+
+def parse_decisions(text, schema=SPOT_SCHEMA):
+    """一次解析完整回复，返回 (有效决策, {币种: 错误列表})；不是 JSON 时决策为 None"""
+    parser = StreamingDecisionParser(schema)
+    parser.feed(text)
+    return parser.close(), parser.errors
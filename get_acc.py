@@ -1,4 +1,4 @@
-from okx_trade import *
+from okx_trade import okxbot
 if __name__ == '__main__':
     testbot = okxbot(True)
     # 测试余额查询
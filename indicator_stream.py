@@ -0,0 +1,165 @@
+"""
+逐根K线更新的流式指标：EMA、MACD、RSI（简单均值/Wilder平滑）、ATR
+递推与 TechnicalIndicators 批量内核相同：从头逐根更新 N 根K线，结果与对这 N 根调用 calculate_batch 逐位一致
+已有一段K线时先用 IndicatorStream.from_window 以该窗口为种子，之后每根新收盘的K线调用 update
+"""
+import math
+from collections import deque
+
+__all__ = ['EMAStream', 'RollingMean', 'MACDStream', 'RSIStream', 'ATRStream', 'IndicatorStream']
+
+
+class EMAStream:
+    """ewm(adjust=False) 的递推，alpha 默认为 2/(period+1)；Wilder 平滑为 alpha=1/period"""
+
+    def __init__(self, period, alpha=None):
+        self.period = period
+        self.alpha = 2.0 / (period + 1.0) if alpha is None else alpha
+        self.old_wt = 1.0 - self.alpha
+        self.value = None
+
+    def update(self, value):
+        value = float(value)
+        if self.value is None:
+            self.value = value
+        elif self.value != value:
+            # 与批量内核 _batch_ewm 相同的运算顺序
+            self.value = (self.old_wt * self.value + self.alpha * value) / (self.old_wt + self.alpha)
+        return self.value
+
+
+class RollingMean:
+    """定长窗口均值：Kahan补偿的窗口和加上 pandas 的修正规则，与 batch_rolling_mean 逐位一致"""
+
+    def __init__(self, period):
+        self.period = period
+        self.window = deque()
+        self.sum = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.neg_ct = 0
+        self.same_ct = 0
+
+    def update(self, value):
+        value = float(value)
+        # 先移出旧值再加入新值
+        if len(self.window) == self.period:
+            old = self.window.popleft()
+            y = -old - self.comp_remove
+            s = self.sum + y
+            self.comp_remove = s - self.sum - y
+            self.sum = s
+            self.neg_ct -= math.copysign(1.0, old) < 0
+        self.same_ct = self.same_ct + 1 if self.window and self.window[-1] == value else 1
+        self.window.append(value)
+        y = value - self.comp_add
+        s = self.sum + y
+        self.comp_add = s - self.sum - y
+        self.sum = s
+        self.neg_ct += math.copysign(1.0, value) < 0
+        if len(self.window) < self.period:
+            return math.nan
+        if self.same_ct >= self.period:
+            return value
+        result = self.sum / self.period
+        if (self.neg_ct == 0 and result < 0) or (self.neg_ct == self.period and result > 0):
+            return 0.0
+        return result
+
+
+class MACDStream:
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.ema_fast = EMAStream(fast)
+        self.ema_slow = EMAStream(slow)
+        self.ema_signal = EMAStream(signal)
+
+    def update(self, price):
+        macd = self.ema_fast.update(price) - self.ema_slow.update(price)
+        signal = self.ema_signal.update(macd)
+        return {
+            'macd': macd,
+            'signal': signal,
+            'histogram': macd - signal
+        }
+
+
+class RSIStream:
+    """
+    smoothing='sma'    涨跌幅的简单滚动均值，与 calculate_batch 的 rsi7/rsi14 一致
+    smoothing='wilder' 涨跌幅的 Wilder 平滑（与 batch_wilder 相同的递推）
+    """
+
+    def __init__(self, period=14, smoothing='sma'):
+        if smoothing == 'sma':
+            self.gain, self.loss = RollingMean(period), RollingMean(period)
+        elif smoothing == 'wilder':
+            self.gain, self.loss = EMAStream(period, 1.0 / period), EMAStream(period, 1.0 / period)
+        else:
+            raise ValueError(f"unknown RSI smoothing: {smoothing}")
+        self.prev_price = None
+
+    def update(self, price):
+        price = float(price)
+        # 第一根K线的涨跌按0计入
+        delta = 0.0 if self.prev_price is None else price - self.prev_price
+        self.prev_price = price
+        gain = self.gain.update(delta if delta > 0 else 0.0)
+        # 与批量内核相同，非下跌处为 -0.0
+        loss = self.loss.update(-delta if delta < 0 else -0.0)
+        if math.isnan(gain) or math.isnan(loss):
+            return math.nan
+        if loss == 0:
+            # 0/0 -> nan，x/0 -> inf -> 100
+            return math.nan if gain == 0 else 100.0
+        return 100 - (100 / (1 + gain / loss))
+
+
+class ATRStream:
+    """真实波幅的简单滚动均值，与 batch_atr 一致"""
+
+    def __init__(self, period=14):
+        self.tr_mean = RollingMean(period)
+        self.prev_close = None
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        tr = high - low
+        if self.prev_close is not None:
+            tr = max(tr, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        return self.tr_mean.update(tr)
+
+
+class IndicatorStream:
+    """单个币种的一组流式指标，键名与 calculate_batch 的结果相同，每次 update 返回最新一根K线的值"""
+
+    def __init__(self):
+        self.ema20 = EMAStream(20)
+        self.ema50 = EMAStream(50)
+        self.macd = MACDStream()
+        self.rsi7 = RSIStream(7)
+        self.rsi14 = RSIStream(14)
+        self.atr14 = ATRStream(14)
+        self.latest = None
+
+    @classmethod
+    def from_window(cls, high_prices, low_prices, close_prices):
+        """以已有的K线窗口（旧→新）为种子，之后的值与对窗口加新K线调用 calculate_batch 一致"""
+        stream = cls()
+        for high, low, close in zip(high_prices, low_prices, close_prices):
+            stream.update(high, low, close)
+        return stream
+
+    def update(self, high, low, close):
+        macd = self.macd.update(close)
+        self.latest = {
+            'ema20': self.ema20.update(close),
+            'ema50': self.ema50.update(close),
+            'macd': macd['macd'],
+            'macd_signal': macd['signal'],
+            'macd_histogram': macd['histogram'],
+            'rsi7': self.rsi7.update(close),
+            'rsi14': self.rsi14.update(close),
+            'atr14': self.atr14.update(high, low, close)
+        }
+        return self.latest
@@ -0,0 +1,268 @@
+"""
+离线指标参数扫描：在本地K线历史上评估不同参数的 EMA/MACD/RSI/ATR 与未来收益的相关性
+K线放在共享内存中，多个进程并行计算，结果按 |IC| 排名写入CSV
+
+    python indicator_sweep.py --store ./candle_store --coins BTC-USDT ETH-USDT     # CandleStore 中的 3m K线
+    python indicator_sweep.py --store ./candle_history --coins BTC-USDT            # candle_download 下载的历史
+    python indicator_sweep.py --synthetic 365 --coins DOGE-USDT BTC-USDT            # 合成K线演示
+    python indicator_sweep.py --store ./candle_store --coins BTC-USDT --indicators rsi macd --horizons 5 20
+"""
+import argparse
+import csv
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from candle_download import history_path, load_candles
+from candle_store import CANDLE_DTYPE, CandleBuffer
+from data_collector import TechnicalIndicators
+
+__all__ = ['IndicatorSweep', 'SharedHistory', 'default_grid', 'load_history']
+
+FIELDS = ('high', 'low', 'close')
+# 未来收益的周期（K线根数）
+HORIZONS = (1, 5, 20)
+RESULT_COLUMNS = ('rank', 'indicator', 'params', 'horizon', 'target', 'coins', 'samples', 'ic_mean', 'ic_std',
+                  'ic_t', 'hit_rate')
+
+
+def default_grid():
+    """各指标的参数组合，包含 PromptGenerator 当前使用的 EMA20/50、MACD(12,26,9)、RSI7/14、ATR3/14"""
+    return {
+        'ema': [(period,) for period in (5, 10, 20, 30, 50, 100, 200)],
+        'macd': [(fast, slow, signal) for fast in (6, 8, 12, 16) for slow in (20, 26, 35, 50) for signal in (5, 9, 13)
+                 if fast < slow],
+        'rsi': [(period,) for period in (3, 5, 7, 9, 14, 21, 28)],
+        'atr': [(period,) for period in (3, 5, 7, 14, 21, 28)],
+    }
+
+
+def load_history(root, coin_list, bar='3m'):
+    """读取 candle_download 下载的 .npz 或 CandleStore 的 .candles，返回 {instId: CANDLE_DTYPE 数组}（旧→新）"""
+    history = {}
+    for instId in coin_list:
+        npz_path = history_path(root, instId, bar)
+        if os.path.exists(npz_path):
+            history[instId] = load_candles(npz_path)
+            continue
+        path = os.path.join(root, f"{instId}_{bar}.candles")
+        if not os.path.exists(path):
+            print(f"❌ no candle history for {instId} {bar} in {root}, skipping")
+            continue
+        buffer = CandleBuffer(path, bar)
+        history[instId] = np.array(buffer.latest(buffer.count), dtype=CANDLE_DTYPE)
+    return history
+
+
+class SharedHistory:
+    """
+    把所有币种的 high/low/close 放进一块共享内存 (3 × 总K线数)，工作进程按名字映射，不复制数据
+    spec() 传给工作进程；用完后 close() 释放（也可用 with）
+    """
+
+    def __init__(self, history):
+        total = sum(len(candles) for candles in history.values())
+        self.shape = (len(FIELDS), total)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(total, 1) * len(FIELDS) * 8)
+        columns = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+        self.offsets = {}
+        start = 0
+        for instId, candles in history.items():
+            end = start + len(candles)
+            for i, field in enumerate(FIELDS):
+                columns[i, start:end] = candles[field]
+            self.offsets[instId] = (start, end)
+            start = end
+
+    def spec(self):
+        return self.shm.name, self.shape, self.offsets
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# 工作进程中映射的共享内存和各币种的列视图
+_worker = {}
+
+
+def _attach(name, shape, offsets):
+    shm = shared_memory.SharedMemory(name=name)
+    columns = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker['shm'] = shm
+    _worker['columns'] = {instId: columns[:, start:end] for instId, (start, end) in offsets.items()}
+
+
+@lru_cache(maxsize=32)
+def _ema(instId, period):
+    # MACD 的不同组合共用同一周期的EMA
+    return TechnicalIndicators.batch_ema(_worker['columns'][instId][2], period)[0]
+
+
+def _feature(indicator, params, instId):
+    """返回 (特征序列, 目标)；目标 'return' 为未来收益，'abs_return' 为未来收益的绝对值（波动）"""
+    high, low, close = _worker['columns'][instId]
+    if indicator == 'ema':
+        return close / _ema(instId, params[0]) - 1, 'return'
+    if indicator == 'macd':
+        fast, slow, signal = params
+        macd = _ema(instId, fast) - _ema(instId, slow)
+        return (macd - TechnicalIndicators.batch_ema(macd, signal)[0]) / close, 'return'
+    if indicator == 'rsi':
+        return TechnicalIndicators.batch_rsi(close, params[0])[0] - 50, 'return'
+    if indicator == 'atr':
+        return TechnicalIndicators.batch_atr(high, low, close, params[0])[0] / close, 'abs_return'
+    raise ValueError(f"unknown indicator: {indicator}")
+
+
+def _score(feature, forward, target):
+    """单个币种、单个周期的 IC（皮尔逊相关）和方向命中率"""
+    if target == 'abs_return':
+        forward = np.abs(forward)
+    valid = np.isfinite(feature) & np.isfinite(forward)
+    x, y = feature[valid], forward[valid]
+    if len(x) < 3 or x.std() == 0 or y.std() == 0:
+        return None
+    ic = float(np.corrcoef(x, y)[0, 1])
+    hit_rate = None
+    if target == 'return':
+        moved = (y != 0) & (x != 0)
+        hit_rate = float(np.mean(np.sign(x[moved]) == np.sign(y[moved]))) if moved.any() else None
+    return ic, hit_rate, len(x)
+
+
+def _evaluate(task):
+    """工作进程中评估一组参数在所有币种、所有周期上的结果"""
+    indicator, params, horizons = task
+    scores = {horizon: [] for horizon in horizons}
+    target = None
+    for instId, columns in _worker['columns'].items():
+        close = columns[2]
+        feature, target = _feature(indicator, params, instId)
+        for horizon in horizons:
+            if len(close) <= horizon:
+                continue
+            forward = np.log(close[horizon:] / close[:-horizon])
+            score = _score(feature[:-horizon], forward, target)
+            if score is not None:
+                scores[horizon].append(score)
+    rows = []
+    for horizon, coin_scores in scores.items():
+        ics = np.array([ic for ic, _, _ in coin_scores])
+        hits = [hit for _, hit, _ in coin_scores if hit is not None]
+        ic_std = float(ics.std(ddof=1)) if len(ics) > 1 else None
+        rows.append({
+            'indicator': indicator,
+            'params': ",".join(str(p) for p in params),
+            'horizon': horizon,
+            'target': target,
+            'coins': len(coin_scores),
+            'samples': sum(n for _, _, n in coin_scores),
+            'ic_mean': float(ics.mean()) if len(ics) else None,
+            'ic_std': ic_std,
+            # 各币种IC的t值，币种越多、方向越一致越可信
+            'ic_t': float(ics.mean() / ic_std * math.sqrt(len(ics))) if ic_std else None,
+            'hit_rate': float(np.mean(hits)) if hits else None
+        })
+    return rows
+
+
+class IndicatorSweep:
+    """
+    history: {instId: CANDLE_DTYPE 数组}，同一粒度，旧→新
+    grid: {指标: [参数元组]}，默认 default_grid()
+    每组参数为一个任务，由 workers 个进程并行计算；K线只在共享内存中保存一份
+    """
+
+    def __init__(self, history, grid=None, horizons=HORIZONS, workers=None):
+        self.history = history
+        self.grid = default_grid() if grid is None else grid
+        self.horizons = tuple(horizons)
+        self.workers = workers or os.cpu_count() or 1
+
+    def tasks(self):
+        # 同一指标的任务相邻，同一进程的EMA缓存更容易命中
+        return [(indicator, tuple(params), self.horizons) for indicator, param_list in self.grid.items()
+                for params in param_list]
+
+    def run(self):
+        """返回按 |ic_mean| 从高到低排名的结果行"""
+        tasks = self.tasks()
+        with SharedHistory(self.history) as shared:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_attach, initargs=shared.spec()) as executor:
+                chunksize = max(1, len(tasks) // (self.workers * 4))
+                rows = [row for task_rows in executor.map(_evaluate, tasks, chunksize=chunksize) for row in task_rows]
+        rows = [row for row in rows if row['ic_mean'] is not None]
+        rows.sort(key=lambda row: -abs(row['ic_mean']))
+        for rank, row in enumerate(rows, 1):
+            row['rank'] = rank
+        return rows
+
+    @staticmethod
+    def save(rows, path):
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({key: '' if row.get(key) is None else row[key] for key in RESULT_COLUMNS})
+
+
+def _format(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="sweep indicator parameters against forward returns")
+    parser.add_argument('--store', default='./candle_store', help="CandleStore or candle_download directory")
+    parser.add_argument('--coins', nargs='+', default=["BTC-USDT"])
+    parser.add_argument('--bar', default='3m')
+    parser.add_argument('--synthetic', type=float, metavar='DAYS', help="use synthetic candles instead of the store")
+    parser.add_argument('--indicators', nargs='+', choices=sorted(default_grid()), help="indicators to sweep")
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(HORIZONS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='sweep_results.csv')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        from backtest import synthetic_history
+        history = {instId: bars[args.bar] for instId, bars in
+                   synthetic_history(args.coins, days=args.synthetic, bars=(args.bar,)).items()}
+    else:
+        history = load_history(args.store, args.coins, args.bar)
+    if not history:
+        print("no candle history to sweep")
+        return 1
+    grid = default_grid()
+    if args.indicators:
+        grid = {indicator: grid[indicator] for indicator in args.indicators}
+
+    sweep = IndicatorSweep(history, grid, args.horizons, args.workers)
+    candles = sum(len(candles) for candles in history.values())
+    print(f"sweeping {len(sweep.tasks())} parameter sets × {len(sweep.horizons)} horizons over "
+          f"{len(history)} coins / {candles} candles with {sweep.workers} workers")
+    started = time.time()
+    rows = sweep.run()
+    IndicatorSweep.save(rows, args.output)
+    print(f"{'rank':>4} {'indicator':<9} {'params':<10} {'horizon':>7} {'ic_mean':>8} {'ic_t':>7} {'hit_rate':>8}")
+    for row in rows[:args.top]:
+        print(f"{row['rank']:>4} {row['indicator']:<9} {row['params']:<10} {row['horizon']:>7} "
+              f"{_format(row['ic_mean'], '.4f'):>8} {_format(row['ic_t'], '.2f'):>7} {_format(row['hit_rate'], '.3f'):>8}")
+    print(f"{len(rows)} results in {time.time() - started:.1f}s, saved at: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
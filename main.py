@@ -1,4 +1,4 @@
-from trade_bot import *
+from trade_bot import TradingBot
 
 # 使用示例
 if __name__ == "__main__":
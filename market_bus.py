@@ -0,0 +1,148 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from candle_store import bar_offset_ms, bar_to_ms
+
+__all__ = ['MarketDataBus']
+
+
+class MarketDataBus:
+    """
+    多个 TradingBot 共用的行情层（REST 拉取，按K线周期缓存）
+    - 同一 (instId, bar) 的K线在一根K线周期内只请求一次，到下一个收盘前所有机器人共用
+    - 缓存中最新一根未收盘的K线超过 live_ttl 秒后单独请求最新一根替换，4H 等大周期的当前K线不会停在获取时的状态
+    - 资金费率、持仓量每 ttl 秒最多请求一次
+    - 同时到来的相同请求只发出一个，其余等待结果
+    接口与 MarketDataStream 相同（get_candles / get_funding_rate / get_open_interest），作为 market_stream
+    传给 DataCollector 即可；账户和下单仍由各机器人自己的 okxbot 处理
+    """
+
+    def __init__(self, okxbot, candle_limit=100, ttl=60.0, settle=1.0, max_workers=8, live_ttl=5.0):
+        # 只使用公共行情接口，不需要凭证；模拟盘与实盘的行情不同，每个环境一个
+        self.okxbot = okxbot
+        self.candle_limit = candle_limit
+        self.ttl_ms = int(ttl * 1000)
+        self.live_ttl_ms = int(live_ttl * 1000)
+        self.settle_ms = int(settle * 1000)
+        self.max_workers = max_workers
+        self.entries = {}
+        self.locks = {}
+        self.limits = {}
+        self.subscriptions = set()
+        self.requests = 0
+        self.fetches = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, coin_list, bars=('3m', '4H')):
+        """登记需要的 (instId, bar)，refresh() 时统一拉取"""
+        with self.lock:
+            self.subscriptions.update((instId, bar) for instId in coin_list for bar in bars)
+
+    def _valid_until(self, bar, fetched_ms):
+        """K线在下一根收盘（再加 settle）之前有效"""
+        period, offset = bar_to_ms(bar), bar_offset_ms(bar)
+        return ((fetched_ms - self.settle_ms - offset) // period + 1) * period + offset + self.settle_ms
+
+    def _cached(self, key, valid_until, fetch, refresh=False):
+        """同一 key 只有一个请求真正发出；valid_until(获取时间) 返回数据的过期时间，fetch 失败返回 None"""
+        with self.lock:
+            self.requests += 1
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            now = int(time.time() * 1000)
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None and not refresh and now < entry[0]:
+                return entry[1]
+            try:
+                data = fetch()
+            except Exception as e:
+                print(f"market bus fetch {key} failed: {e}")
+                data = None
+            with self.lock:
+                self.fetches += 1
+                if data is None:
+                    self.errors += 1
+                    return None
+                self.entries[key] = (valid_until(now), data)
+            return data
+
+    def _fetch_candles(self, instId, bar, limit):
+        result = self.okxbot.get_coin_kline(instId, bar, limit)
+        if result and result.get('data'):
+            return result['data'], limit, int(time.time() * 1000)
+        return None
+
+    def _live_candle(self, instId, bar):
+        """最新一根（未收盘）K线，live_ttl 内共用"""
+        cached = self._cached(('live', instId, bar), lambda now: now + self.live_ttl_ms,
+                              lambda: self._fetch_candles(instId, bar, 1))
+        return cached[0][0] if cached is not None else None
+
+    def get_candles(self, instId, bar, limit, refresh=False):
+        """返回OKX格式的K线（新→旧），失败时返回 None，调用方改用自己的REST请求"""
+        key = ('candles', instId, bar)
+        with self.lock:
+            # 某个机器人需要更多K线时，之后都按较大的数量请求
+            fetch_limit = self.limits[key] = max(self.limits.get(key, self.candle_limit), int(limit))
+            entry = self.entries.get(key)
+            refresh = refresh or (entry is not None and entry[1][1] < limit)
+        valid_until = lambda now: self._valid_until(bar, now)
+        fetch = lambda: self._fetch_candles(instId, bar, fetch_limit)
+        cached = self._cached(key, valid_until, fetch, refresh)
+        if cached is None:
+            return None
+        rows, _, fetched_ms = cached
+        rows = rows[:limit]
+        # OKX K线第9列 confirm 为 '0' 表示未收盘；缓存的未收盘K线过旧时换成最新的
+        if rows and len(rows[0]) > 8 and rows[0][8] == '0' and int(time.time() * 1000) - fetched_ms > self.live_ttl_ms:
+            live = self._live_candle(instId, bar)
+            if live is not None and int(live[0]) == int(rows[0][0]):
+                rows = [live] + rows[1:]
+            elif live is not None and int(live[0]) > int(rows[0][0]):
+                # 缓存过期（收盘后 settle 秒）之前新的一根已经开始，缓存中的上一根不是收盘后的数据，重新请求一次
+                cached = self._cached(key, valid_until, fetch, refresh=True)
+                if cached is None:
+                    return None
+                rows = cached[0][:limit]
+        return [list(row) for row in rows]
+
+    def _public_data(self, name, instId, method, **kwargs):
+        def fetch():
+            result = method(instId=instId, **kwargs)
+            if result and result.get('data'):
+                return result['data'][0]
+            return None
+        return self._cached((name, instId), lambda now: now + self.ttl_ms, fetch)
+
+    def get_funding_rate(self, instId):
+        return self._public_data('funding_rate', instId, self.okxbot.publicDataAPI.get_funding_rate)
+
+    def get_open_interest(self, instId):
+        return self._public_data('open_interest', instId, self.okxbot.publicDataAPI.get_open_interest,
+                                 instType='SWAP')
+
+    def refresh(self, bars=None):
+        """K线收盘后调用：并发拉取所有已登记的 (instId, bar)，之后机器人读取的都是缓存"""
+        with self.lock:
+            keys = sorted(key for key in self.subscriptions if bars is None or key[1] in bars)
+        if not keys:
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self.get_candles, instId, bar,
+                                       self.candle_limit, True) for instId, bar in keys]
+        for future in futures:
+            future.result()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'fetches': self.fetches,
+                'errors': self.errors,
+                'saved': self.requests - self.fetches,
+                'keys': len(self.entries)
+            }
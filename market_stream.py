@@ -0,0 +1,323 @@
+import asyncio
+import json
+import threading
+import time
+
+import websockets
+
+from candle_store import bar_to_ms
+
+PUBLIC_WS_URL = {"0": "wss://ws.okx.com:8443/ws/v5/public", "1": "wss://wspap.okx.com:8443/ws/v5/public"}
+# K线频道在 business 地址上
+BUSINESS_WS_URL = {"0": "wss://ws.okx.com:8443/ws/v5/business", "1": "wss://wspap.okx.com:8443/ws/v5/business"}
+
+
+class MarketDataStream:
+    """
+    WebSocket行情订阅：K线、ticker、资金费率、持仓量
+    后台线程维护最新行情，TradingDataCollector 直接读取内存数据，不再发REST请求
+    断线后自动重连、重新订阅，并通过REST补齐断线期间缺失的K线
+    """
+
+    def __init__(self, okxbot, coin_list, bars=('3m', '4H'), trade_mode="spot", public_url=None,
+                 business_url=None, candle_limit=300, ping_interval=20):
+        self.okxbot = okxbot
+        self.coin_list = list(coin_list)
+        self.bars = list(bars)
+        self.trade_mode = trade_mode
+        flag = getattr(okxbot, 'flag', '1')
+        self.public_url = public_url or PUBLIC_WS_URL[flag]
+        self.business_url = business_url or BUSINESS_WS_URL[flag]
+        self.candle_limit = candle_limit
+        self.ping_interval = ping_interval
+
+        self.lock = threading.Lock()
+        self.candles = {}
+        self.tickers = {}
+        self.funding_rates = {}
+        self.open_interest = {}
+        self.connected = set()
+        self.sockets = set()
+        self.loop = None
+        self.thread = None
+        self.stopping = False
+
+    def _public_args(self):
+        args = [{"channel": "tickers", "instId": instId} for instId in self.coin_list]
+        if self.trade_mode == "swap":
+            args += [{"channel": "funding-rate", "instId": instId} for instId in self.coin_list]
+            args += [{"channel": "open-interest", "instId": instId} for instId in self.coin_list]
+        return args
+
+    def _business_args(self):
+        return [{"channel": f"candle{bar}", "instId": instId} for instId in self.coin_list for bar in self.bars]
+
+    def start(self):
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping = True
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def wait_ready(self, timeout=10):
+        """等待两个连接都建立并且K线已补齐"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                ready = {'public', 'business'} <= self.connected and all(
+                    (instId, bar) in self.candles for instId in self.coin_list for bar in self.bars)
+            if ready:
+                return True
+            time.sleep(0.05)
+        return False
+
+    async def _shutdown(self):
+        # 先完成关闭握手再取消其余任务，否则事件循环关闭后TCP连接不会断开
+        await asyncio.gather(*(ws.close() for ws in list(self.sockets)), return_exceptions=True)
+        for task in asyncio.all_tasks(self.loop):
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            pending = asyncio.all_tasks(self.loop)
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    async def _main(self):
+        await asyncio.gather(
+            self._connection('public', self.public_url, self._public_args()),
+            self._connection('business', self.business_url, self._business_args(), backfill=True)
+        )
+
+    async def _connection(self, name, url, args, backfill=False):
+        if not args:
+            with self.lock:
+                self.connected.add(name)
+            return
+        delay = 1
+        while not self.stopping:
+            try:
+                async with websockets.connect(url) as ws:
+                    self.sockets.add(ws)
+                    await ws.send(json.dumps({"op": "subscribe", "args": args}))
+                    delay = 1
+                    print(f"WebSocket connected: {url}")
+                    if backfill:
+                        # 重连后补齐断线期间的K线
+                        for arg in args:
+                            await asyncio.to_thread(self._backfill, arg["instId"], arg["channel"][len("candle"):])
+                    with self.lock:
+                        self.connected.add(name)
+                    pinger = asyncio.ensure_future(self._keepalive(ws))
+                    try:
+                        async for message in ws:
+                            await self._on_message(message)
+                    finally:
+                        pinger.cancel()
+                        self.sockets.discard(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket error ({url}): {e}")
+            with self.lock:
+                self.connected.discard(name)
+            if self.stopping:
+                break
+            print(f"WebSocket reconnecting in {delay}s: {url}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def _keepalive(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await ws.send("ping")
+
+    async def _on_message(self, message):
+        if message == "pong":
+            return
+        msg = json.loads(message)
+        if msg.get("event") == "error":
+            print(f"WebSocket subscribe error: {msg.get('msg')}")
+            return
+        if "data" not in msg:
+            return
+        channel = msg["arg"]["channel"]
+        instId = msg["arg"]["instId"]
+        if channel.startswith("candle"):
+            bar = channel[len("candle"):]
+            if self._merge_candles(instId, bar, msg["data"]):
+                await asyncio.to_thread(self._backfill, instId, bar)
+            return
+        with self.lock:
+            if channel == "tickers":
+                self.tickers[instId] = msg["data"][0]
+            elif channel == "funding-rate":
+                self.funding_rates[instId] = msg["data"][0]
+            elif channel == "open-interest":
+                self.open_interest[instId] = msg["data"][0]
+
+    def _merge_candles(self, instId, bar, rows):
+        """合并K线（按时间戳覆盖），返回是否出现了缺口"""
+        with self.lock:
+            candles = self.candles.get((instId, bar))
+            if candles is None:
+                return True
+            last_ts = max(candles) if candles else None
+            gap = False
+            for row in rows:
+                ts = int(row[0])
+                if last_ts is not None and ts > last_ts + bar_to_ms(bar):
+                    gap = True
+                candles[ts] = list(row)
+            for ts in sorted(candles)[:-self.candle_limit]:
+                del candles[ts]
+            return gap
+
+    def _backfill(self, instId, bar):
+        result = self.okxbot.get_coin_kline(instId, bar, min(self.candle_limit, 300))
+        if not result or 'data' not in result:
+            print(f"{instId} {bar} K-line backfill failed")
+            return
+        with self.lock:
+            candles = self.candles.setdefault((instId, bar), {})
+            for row in result['data']:
+                candles[int(row[0])] = list(row)
+            for ts in sorted(candles)[:-self.candle_limit]:
+                del candles[ts]
+
+    def get_candles(self, instId, bar, limit):
+        """返回OKX格式的K线（新→旧）；连接断开或数据不足时返回 None，调用方改用REST"""
+        with self.lock:
+            if 'business' not in self.connected:
+                return None
+            candles = self.candles.get((instId, bar))
+            if not candles or len(candles) < limit:
+                return None
+            return [list(candles[ts]) for ts in sorted(candles, reverse=True)[:limit]]
+
+    def _latest(self, table, instId):
+        with self.lock:
+            if 'public' not in self.connected:
+                return None
+            return table.get(instId)
+
+    def get_ticker(self, instId):
+        return self._latest(self.tickers, instId)
+
+    def get_funding_rate(self, instId):
+        return self._latest(self.funding_rates, instId)
+
+    def get_open_interest(self, instId):
+        return self._latest(self.open_interest, instId)
+
+
+class StandInMarketServer:
+    """
+    本地模拟的OKX行情WebSocket服务，用于离线测试 MarketDataStream
+    支持 subscribe / ping，push 向订阅了该频道的连接推送数据，drop_connections 模拟断线
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.subscriptions = {}
+        self.ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._run_loop, daemon=True).start()
+        self.ready.wait(5)
+        return self
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._serve())
+        self.loop.run_forever()
+
+    async def _serve(self):
+        self.server = await websockets.serve(self._handler, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+
+    async def _handler(self, ws, *args):
+        self.subscriptions[ws] = set()
+        try:
+            async for message in ws:
+                if message == "ping":
+                    await ws.send("pong")
+                    continue
+                msg = json.loads(message)
+                if msg.get("op") == "subscribe":
+                    for arg in msg["args"]:
+                        self.subscriptions[ws].add((arg["channel"], arg["instId"]))
+                        await ws.send(json.dumps({"event": "subscribe", "arg": arg, "connId": "stand-in"}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.subscriptions.pop(ws, None)
+
+    async def _push(self, channel, instId, data):
+        message = json.dumps({"arg": {"channel": channel, "instId": instId}, "data": data})
+        for ws, subscribed in list(self.subscriptions.items()):
+            if (channel, instId) in subscribed:
+                await ws.send(message)
+
+    async def _drop(self):
+        for ws in list(self.subscriptions):
+            await ws.close()
+
+    def push(self, channel, instId, data):
+        asyncio.run_coroutine_threadsafe(self._push(channel, instId, data), self.loop).result(5)
+
+    def drop_connections(self):
+        asyncio.run_coroutine_threadsafe(self._drop(), self.loop).result(5)
+
+    def stop(self):
+        async def _close():
+            self.server.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(_close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+if __name__ == '__main__':
+    # 离线演示：本地模拟服务 + 模拟的REST补数
+    class _RestStandIn:
+        flag = "1"
+
+        def get_coin_kline(self, instId, bar, limit=100):
+            now = int(time.time() * 1000) // bar_to_ms(bar) * bar_to_ms(bar)
+            return {'code': '0', 'data': [[str(now - i * bar_to_ms(bar)), '1', '1', '1', '1', '1', '1', '1',
+                                           '0' if i == 0 else '1'] for i in range(int(limit))]}
+
+    server = StandInMarketServer().start()
+    stream = MarketDataStream(_RestStandIn(), ["DOGE-USDT"], bars=('3m',), public_url=server.url,
+                              business_url=server.url).start()
+    print("ready:", stream.wait_ready())
+    server.push("tickers", "DOGE-USDT", [{"instId": "DOGE-USDT", "last": "0.2"}])
+    time.sleep(0.2)
+    print("ticker:", stream.get_ticker("DOGE-USDT"))
+    server.drop_connections()
+    time.sleep(1.5)
+    print("reconnected:", stream.wait_ready(), "candles:", len(stream.get_candles("DOGE-USDT", "3m", 50)))
+    stream.stop()
+    server.stop()
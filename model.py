@@ -1,7 +1,21 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
+import asyncio
+import json
 import os
+import threading
+import time
+from collections import deque
+
+from decision_parser import StreamingDecisionParser, decision_schema
+from prompt_encoder import estimate_tokens
+from response_cache import prompt_fingerprint
+from tracing import tracer
+
+__all__ = ['Mod', 'PrefixTracker', 'SYSTEM_PROMPT_SPOT', 'SYSTEM_PROMPT_SWAP', 'DECISION_TIMEOUT']
+
+# 单次大模型请求的默认超时秒数，超时的币种本周期不做决策
+DECISION_TIMEOUT = 120.0
 
 #修改
 SYSTEM_PROMPT_SWAP = """
@@ -67,32 +81,220 @@ You must respond strictly in the following JSON format and return ONLY JSON data
 }
 """
 
+def shared_prefix_length(a, b):
+    """两个字符串相同前缀的长度（二分查找，每次用切片比较）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PrefixTracker:
+    """
+    统计相邻两次请求（按 key 区分，如每个币种一路）的输入有多长的相同前缀
+    服务端的前缀/KV缓存只能复用相同的前缀，占比越高首token延迟和输入费用越低
+    """
+
+    def __init__(self, window=100):
+        self.previous = {}
+        self.latest = {}
+        self.ratios = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, key, text):
+        with self.lock:
+            previous = self.previous.get(key)
+            self.previous[key] = text
+        shared = shared_prefix_length(previous, text) if previous is not None else 0
+        total_tokens = estimate_tokens(text)
+        shared_tokens = estimate_tokens(text[:shared]) if shared else 0
+        stats = {
+            'shared_chars': shared,
+            'total_chars': len(text),
+            'shared_tokens': shared_tokens,
+            'total_tokens': total_tokens,
+            'ratio': shared_tokens / total_tokens if total_tokens else 0.0
+        }
+        with self.lock:
+            self.latest[key] = stats
+            if previous is not None:
+                self.ratios.append(stats['ratio'])
+        return stats
+
+    def summary(self):
+        """最近一次每路的统计，以及最近 window 次请求的平均相同前缀占比"""
+        with self.lock:
+            ratios = list(self.ratios)
+            return {
+                'compared': len(ratios),
+                'mean_ratio': sum(ratios) / len(ratios) if ratios else None,
+                'latest': dict(self.latest)
+            }
+
+
 class Mod():
-    def __init__(self, prompt_generator, api_key=None, base_url=None,trade_mode="spot"):
+    def __init__(self, prompt_generator, api_key=None, base_url=None,trade_mode="spot",model="qwen3-max",cache=None,
+                 parallel=False,max_concurrency=4,timeout=DECISION_TIMEOUT):
         self.prompt_generator = prompt_generator
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY") if api_key is None else api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1" if base_url is None else base_url,
-        )
+        self.api_key = os.getenv("DASHSCOPE_API_KEY") if api_key is None else api_key
+        self.base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1" if base_url is None else base_url
+        # openai 包导入很慢（约0.5秒），第一次请求时才导入并创建客户端
+        self._client = None
+        self._client_lock = threading.Lock()
         self.trade_mode = trade_mode
+        self.model = model
+        # ResponseCache: 行情相同的提示词直接复用之前的回复
+        self.cache = cache
+        # parallel=True 时每个币种单独请求大模型，最多同时 max_concurrency 个，每个请求最多等待 timeout 秒
+        self.parallel = parallel
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # 相邻两次请求的相同前缀统计: self.prefix.summary()
+        self.prefix = PrefixTracker()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+            return self._client
 
-    def chat(self, message):
-        completion = self.client.chat.completions.create(
-            model="qwen3-max",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT_SPOT if self.trade_mode=="spot" else SYSTEM_PROMPT},
+    def warm_up(self):
+        """提前导入 openai 并创建客户端，可在等待K线收盘时于后台线程调用"""
+        return self.client
+
+    def _request(self, message):
+        kwargs = {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": SYSTEM_PROMPT_SPOT if self.trade_mode=="spot" else SYSTEM_PROMPT_SWAP},
                 {"role": "user", "content": message},
             ]
-        )
-        return completion.choices[0].message.content
+        }
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        return kwargs
 
-    def decide(self):
-        prompt = self.prompt_generator.generate_trading_prompt()
-        res = self.chat(prompt)
-        return prompt, res
+    def _cache_key(self, request):
+        if self.cache is None:
+            return None
+        return prompt_fingerprint(self.model, request['messages'][0]['content'], request['messages'][1]['content'])
 
+    def _observe_prefix(self, request, key):
+        messages = request['messages']
+        stats = self.prefix.observe(key, messages[0]['content'] + "\n" + messages[1]['content'])
+        print(f"prompt prefix shared with previous call: {stats['shared_tokens']}/{stats['total_tokens']} tokens "
+              f"({stats['ratio']:.0%})")
 
+    def chat(self, message, prefix_key='all', parser=None):
+        """
+        parser: StreamingDecisionParser，传入时以流式请求，每个币种的决策一完整就交给 parser 回调
+        返回完整回复文本
+        """
+        request = self._request(message)
+        key = self._cache_key(request)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if parser is not None:
+                    parser.feed(cached)
+                return cached
+        self._observe_prefix(request, prefix_key)
+        with tracer.span("llm.chat"):
+            if parser is None:
+                completion = self.client.chat.completions.create(**request)
+                res = completion.choices[0].message.content
+            else:
+                res = self._stream(request, parser)
+        if key is not None and res:
+            self.cache.put(key, res, self.model)
+        return res
 
+    def _stream(self, request, parser):
+        chunks = []
+        start = time.time()
+        for chunk in self.client.chat.completions.create(stream=True, **request):
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                chunks.append(content)
+                for coin, _ in parser.feed(content):
+                    print(f"{coin} decision streamed after {time.time() - start:.1f}s")
+        return "".join(chunks)
 
+    async def chat_async(self, client, message, prefix_key='all'):
+        request = self._request(message)
+        key = self._cache_key(request)
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        self._observe_prefix(request, prefix_key)
+        with tracer.span("llm.chat"):
+            completion = await client.chat.completions.create(**request)
+        res = completion.choices[0].message.content
+        if key is not None and res:
+            await asyncio.to_thread(self.cache.put, key, res, self.model)
+        return res
 
+    async def decide_async(self, coins=None, on_decision=None):
+        """
+        每个币种一份提示词并发请求，超时或失败的币种本周期不做决策
+        各币种的回复合并成一个JSON，与单次请求的回复格式相同；on_decision 在每个币种的回复到达时回调
+        """
+        with tracer.span("prompt"):
+            prompts = await asyncio.to_thread(self.prompt_generator.generate_coin_prompts, coins)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
 
+        async def decide_coin(client, instId, prompt):
+            async with semaphore:
+                start = time.time()
+                try:
+                    res = await asyncio.wait_for(self.chat_async(client, prompt, instId), self.timeout)
+                except asyncio.TimeoutError:
+                    print(f"❌ {instId} decision timed out after {self.timeout}s, skipping")
+                    return None
+                except Exception as e:
+                    print(f"❌ {instId} decision failed, skipping: {e}")
+                    return None
+                print(f"{instId} decision received in {time.time() - start:.1f}s")
+                if not res:
+                    return None
+                # 与单次请求相同的解析和校验，有效的决策立即回调
+                parser = StreamingDecisionParser(decision_schema(self.trade_mode), on_decision)
+                parser.feed(res)
+                decisions = parser.close()
+                if decisions is None:
+                    print(f"❌ {instId} decision parsing failed, skipping: no JSON object found")
+                for coin, coin_errors in parser.errors.items():
+                    print(f"❌ invalid decision for {coin}, skipping: {'; '.join(coin_errors)}")
+                return decisions
+
+        from openai import AsyncOpenAI
+        async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
+            responses = await asyncio.gather(*[decide_coin(client, instId, prompt) for instId, prompt in prompts.items()])
+
+        merged = {}
+        for decisions in responses:
+            if decisions:
+                merged.update(decisions)
+        return "\n".join(prompts.values()), json.dumps(merged, ensure_ascii=False)
+
+    def decide(self, coins=None, on_decision=None):
+        """
+        coins 为 None 时对所有币种决策，否则只对指定的 instId
+        on_decision(coin, decision): 每个币种的决策一完整并通过校验就回调，不必等整个回复结束
+        """
+        if self.parallel:
+            return asyncio.run(self.decide_async(coins, on_decision))
+        with tracer.span("prompt"):
+            prompt = self.prompt_generator.generate_trading_prompt(coins)
+        parser = StreamingDecisionParser(decision_schema(self.trade_mode), on_decision) if on_decision else None
+        res = self.chat(prompt, parser=parser)
+        return prompt, res
@@ -0,0 +1,188 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from tracing import tracer
+
+# OKX 各接口的限速: 方法名 -> (请求次数, 时间窗口秒)
+RATE_LIMITS = {
+    'get_candlesticks': (40, 2),            # /api/v5/market/candles
+    'get_history_candlesticks': (20, 2),    # /api/v5/market/history-candles
+    'get_ticker': (20, 2),                  # /api/v5/market/ticker
+    'get_funding_rate': (20, 2),            # /api/v5/public/funding-rate
+    'get_open_interest': (20, 2),           # /api/v5/public/open-interest
+    'get_account_balance': (10, 2),         # /api/v5/account/balance
+    'get_positions': (10, 2),               # /api/v5/account/positions
+    'set_leverage': (20, 2),                # /api/v5/account/set-leverage
+    'place_order': (60, 2),                 # /api/v5/trade/order
+    'place_multiple_orders': (300, 2),      # /api/v5/trade/batch-orders
+    'close_positions': (20, 2),             # /api/v5/trade/close-position
+}
+DEFAULT_RATE_LIMIT = (10, 2)
+
+
+class TokenBucket:
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时等待，返回等待的秒数"""
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                sleep_time = (1 - self.tokens) / self.rate
+            time.sleep(sleep_time)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'avg_wait': self.total_wait / self.calls if self.calls else 0.0,
+            'max_wait': self.max_wait
+        }
+
+
+class OkxGateway:
+    """
+    OKX请求的统一出口
+    - 按接口的令牌桶限速，避免触发429
+    - 相同账户、相同参数的查询请求在进行中时合并为一次，其余调用方共享结果（下单等写操作不合并）
+    - 多个 okxbot 共用一个网关时，公共接口共用限速；私有接口 OKX 按账户限速，每个账户（API key + 实盘/模拟盘）单独限速
+    - 记录每个接口的排队深度和等待时间
+    """
+
+    def __init__(self, rate_limits=None):
+        self.rate_limits = dict(RATE_LIMITS)
+        if rate_limits:
+            self.rate_limits.update(rate_limits)
+        self.buckets = {}
+        self.endpoint_stats = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, name, account=None):
+        key = (name, account)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(*self.rate_limits.get(name, DEFAULT_RATE_LIMIT))
+        if name not in self.endpoint_stats:
+            self.endpoint_stats[name] = EndpointStats()
+        return self.buckets[key]
+
+    @staticmethod
+    def _coalesce_key(name, args, kwargs, account=None):
+        if not name.startswith('get_'):
+            return None
+        key = (name, account, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def call(self, name, fn, *args, _account=None, **kwargs):
+        """_account: 私有接口所属的账户，不同账户的请求不合并、分别限速；公共接口为 None"""
+        # 包含限速等待和合并等待在内的整个请求耗时
+        with tracer.span(f"okx.{name}"):
+            return self._call(name, fn, _account, args, kwargs)
+
+    def _call(self, name, fn, account, args, kwargs):
+        key = self._coalesce_key(name, args, kwargs, account)
+        with self.lock:
+            bucket = self._bucket(name, account)
+            stats = self.endpoint_stats[name]
+            if key is not None and key in self.inflight:
+                stats.coalesced += 1
+                future = self.inflight[key]
+                owner = False
+            else:
+                future = Future()
+                if key is not None:
+                    self.inflight[key] = future
+                owner = True
+                stats.queue_depth += 1
+                stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth)
+        if not owner:
+            return future.result()
+
+        wait = bucket.acquire()
+        with self.lock:
+            stats.queue_depth -= 1
+            stats.calls += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            with self.lock:
+                stats.errors += 1
+            future.set_exception(e)
+            raise
+        finally:
+            if key is not None:
+                with self.lock:
+                    self.inflight.pop(key, None)
+
+    def wrap(self, client):
+        return GatewayClient(client, self)
+
+    def stats(self):
+        with self.lock:
+            return {name: stats.to_dict() for name, stats in self.endpoint_stats.items()}
+
+    def print_stats(self):
+        for name, stats in self.stats().items():
+            print(f"{name}: {stats['calls']}次 合并{stats['coalesced']}次 错误{stats['errors']}次 "
+                  f"排队{stats['queue_depth']}/{stats['max_queue_depth']} "
+                  f"平均等待{stats['avg_wait'] * 1000:.1f}ms 最长等待{stats['max_wait'] * 1000:.1f}ms")
+
+
+def account_identity(client):
+    """SDK客户端所属的账户 (API key, flag)；没有配置 API key 的公共客户端返回 None"""
+    api_key = getattr(client, 'API_KEY', None)
+    if not api_key or api_key == '-1':
+        return None
+    return api_key, getattr(client, 'flag', None)
+
+
+class GatewayClient:
+    """OKX SDK客户端的代理，所有方法调用都经过 OkxGateway"""
+
+    def __init__(self, client, gateway):
+        self.client = client
+        self.gateway = gateway
+        self.account = account_identity(client)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def routed(*args, **kwargs):
+            return self.gateway.call(name, attr, *args, _account=self.account, **kwargs)
+        return routed
@@ -1,17 +1,118 @@
+import contextvars
+import importlib
 import json
 import os
-import okx.Account as account
-import okx.Trade as trade
-import okx.Funding as Funding
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decision_parser import decision_schema, parse_decisions
 from dotenv import load_dotenv
-import okx.PublicData as PublicData
-import okx.MarketData as MarketData
+from okx_gateway import OkxGateway
+from tracing import traced
 
 load_dotenv()
 
+__all__ = ['AccountSnapshot', 'okxbot']
+
+
+class AccountSnapshot:
+    """
+    一个交易周期内共享的账户余额/持仓数据
+    begin_cycle 之后同一接口只请求一次，所有币种的数据收集、余额查询共用结果；
+    下单后调用 invalidate 让下一次访问重新请求；周期外直接透传到 AccountAPI
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.enabled = False
+        self.cache = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def begin_cycle(self):
+        with self.lock:
+            self.cache.clear()
+            self.enabled = True
+
+    def end_cycle(self):
+        with self.lock:
+            self.cache.clear()
+            self.enabled = False
+
+    def invalidate(self):
+        with self.lock:
+            self.cache.clear()
+
+    def _cached(self, key, fetch):
+        if not self.enabled:
+            return fetch()
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        # 同一接口的并发请求只有一个真正发出，其余等待结果
+        with key_lock:
+            with self.lock:
+                if key in self.cache:
+                    return self.cache[key]
+            result = fetch()
+            # 失败的响应不缓存，下一次访问重试
+            if result and result.get('code') == '0':
+                with self.lock:
+                    if self.enabled:
+                        self.cache[key] = result
+            return result
+
+    def get_account_balance(self):
+        return self._cached(('balance',), self.account.get_account_balance)
+
+    def get_positions(self, instType=''):
+        return self._cached(('positions', instType), lambda: self.account.get_positions(instType=instType))
+
+
+class _LazyAttribute:
+    """第一次访问时才调用 factory(bot) 创建属性值并保存到实例上，之后直接读实例属性"""
+    lock = threading.RLock()
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, bot, owner=None):
+        if bot is None:
+            return self
+        with self.lock:
+            if self.name not in bot.__dict__:
+                bot.__dict__[self.name] = self.factory(bot)
+        return bot.__dict__[self.name]
+
+
+def _sdk_client(module, cls, private=True):
+    """OKX SDK客户端：导入 okx SDK、创建 httpx 客户端都较慢，用到某个接口时才创建"""
+    def create(bot):
+        api = getattr(importlib.import_module(f"okx.{module}"), cls)
+        if private:
+            client = api(bot.api_key, bot.secret_key, bot.passphrase, False, bot.flag)
+        else:
+            client = api(flag=bot.flag)
+        return bot.gateway.wrap(client)
+    return _LazyAttribute(create)
+
 
 class okxbot():
-    def __init__(self, is_simu):
+    # OKX 批量下单接口单次最多20个订单
+    BATCH_ORDER_LIMIT = 20
+    # 执行决策时最多同时发出的请求数
+    execute_workers = 8
+
+    account = _sdk_client('Account', 'AccountAPI')
+    tradeapi = _sdk_client('Trade', 'TradeAPI')
+    publicDataAPI = _sdk_client('PublicData', 'PublicAPI', private=False)
+    marketDataAPI = _sdk_client('MarketData', 'MarketAPI', private=False)
+    funding = _sdk_client('Funding', 'FundingAPI')
+    snapshot = _LazyAttribute(lambda bot: AccountSnapshot(bot.account))
+
+    def __init__(self, is_simu, gateway=None):
         if is_simu:
             self.api_key = os.getenv("OKX_API_KEY_SIMU")
             self.secret_key = os.getenv("OKX_SECRET_KEY_SIMU")
@@ -22,27 +123,85 @@ class okxbot():
             self.secret_key = os.getenv("OKX_SECRET_KEY1")
             self.passphrase = os.getenv("OKX_PASSPHRASE1")
             self.flag = "0"
-        self.account = account.AccountAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag)
-        self.tradeapi = trade.TradeAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag)
-        self.publicDataAPI = PublicData.PublicAPI(flag=self.flag)
-        self.marketDataAPI = MarketData.MarketAPI(flag=self.flag)
-        self.funding=Funding.FundingAPI(self.api_key, self.secret_key, self.passphrase, False, self.flag)
+        # 所有请求经过网关：按接口限速、合并相同的查询；多个 okxbot 传入同一个网关时共用限速
+        # account/tradeapi/publicDataAPI/marketDataAPI/funding/snapshot 在第一次使用时创建
+        self.gateway = OkxGateway() if gateway is None else gateway
 
-    def execute_decision(self,decision):
+    @traced("execute")
+    def execute_decision(self,decision,batch=True):
+        """
+        执行所有币种的决策：买卖单通过批量下单接口一次发出（每批最多20个），平仓请求同时并发发出
+        batch=False 时每个订单单独调用 place_order，同样并发
+        返回 {币种: {'instId', 'signal', 'ok', 'latency', 'response'}}
+        """
         print(decision)
+        orders = []
+        closes = []
+        results = {}
         for coin in decision:
             trade_info=decision[coin]
             instId=(coin+"-USDT").upper()
-            if trade_info["signal"]=='buy':
-                return self.trade(instId=instId,sz= trade_info["quantity"], side="buy", ordType="market")
-            elif trade_info["signal"]=='sell':
-                return self.trade(instId=instId,sz= trade_info["quantity"], side="sell", ordType="market")
-            elif trade_info["signal"]=='close':
-                self.shijiequanping(instId)
-            elif trade_info["signal"]=='hole':
-                return "waiting"
-        # if decision["signal"]=='buy':
-        #     self.trade()
+            signal=trade_info.get("signal")
+            if signal in ('buy', 'sell'):
+                orders.append((coin, {"instId": instId, "tdMode": "cash", "side": signal, "ordType": "market",
+                                      "sz": str(trade_info["quantity"]), "tgtCcy": "base_ccy"}))
+            elif signal=='close':
+                closes.append((coin, instId))
+            else:
+                results[coin] = {'instId': instId, 'signal': signal, 'ok': True, 'latency': 0.0, 'response': "waiting"}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(orders) + len(closes), self.execute_workers))) as executor:
+            def submit(fn, *args, **kwargs):
+                # 带上当前的追踪上下文，下单请求的 span 挂到本周期下
+                return executor.submit(contextvars.copy_context().run, self._timed, fn, *args, **kwargs)
+
+            futures = []
+            if batch:
+                for i in range(0, len(orders), self.BATCH_ORDER_LIMIT):
+                    chunk = orders[i:i + self.BATCH_ORDER_LIMIT]
+                    futures.append((chunk, submit(self.tradeapi.place_multiple_orders, [order for _, order in chunk])))
+            else:
+                for coin, order in orders:
+                    futures.append(([(coin, order)], submit(self.trade, **order)))
+            for coin, instId in closes:
+                futures.append(([(coin, {"instId": instId, "side": "close"})], submit(self.shijiequanping, instId)))
+
+            for chunk, future in futures:
+                res, latency = future.result()
+                for i, (coin, order) in enumerate(chunk):
+                    results[coin] = {'instId': order["instId"], 'signal': decision[coin].get("signal"),
+                                     'ok': self._order_ok(res, i), 'latency': latency,
+                                     'response': self._order_response(res, i, len(chunk))}
+        for coin, result in results.items():
+            print(f"{result['instId']} {result['signal']}: {'ok' if result['ok'] else 'failed'} "
+                  f"{result['latency'] * 1000:.0f}ms {result['response']}")
+        return results
+
+    @staticmethod
+    def _timed(fn, *args, **kwargs):
+        start = time.time()
+        try:
+            res = fn(*args, **kwargs)
+        except Exception as e:
+            res = {'code': '-1', 'msg': str(e), 'data': []}
+        return res, time.time() - start
+
+    @staticmethod
+    def _order_response(res, i, n):
+        """批量下单的响应拆分给每个订单；单个请求的响应原样返回"""
+        if n > 1 and isinstance(res, dict) and len(res.get('data') or []) == n:
+            return dict(res, data=[res['data'][i]])
+        return res
+
+    @staticmethod
+    def _order_ok(res, i):
+        if not isinstance(res, dict):
+            return False
+        data = res.get('data') or []
+        # 批量下单部分成功时 code 为 '2'，以每个订单的 sCode 为准
+        if i < len(data) and isinstance(data[i], dict) and 'sCode' in data[i]:
+            return data[i]['sCode'] == '0'
+        return res.get('code') == '0'
 
     def get_price(self, instId):
         result = self.marketDataAPI.get_ticker(
@@ -58,7 +217,7 @@ class okxbot():
         Returns:
             dict: 余额信息
         """
-        result = self.account.get_account_balance()
+        result = self.snapshot.get_account_balance()
 
         if result['code'] == '0':
             balance_data = result['data'][0]
@@ -88,7 +247,7 @@ class okxbot():
         Returns:
             list: 持仓列表
         """
-        result = self.account.get_positions(instType=inst_type)
+        result = self.snapshot.get_positions(instType=inst_type)
 
         if result['code'] == '0':
             positions = result['data']
@@ -216,19 +375,24 @@ class okxbot():
             print(f"设置杠杆失败: {result['msg']}")
             return result
 
-    def parse_decision(self, ai_response):
+    @traced("parse")
+    def parse_decision(self, ai_response, trade_mode="spot"):
+        """
+        解析大模型回复并按 trade_mode 的输出格式校验每个币种的决策
+        无效的币种（如 signal 拼错、买卖没有数量）打印原因后跳过，其余币种照常返回
+        """
         try:
-            import re
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', ai_response).strip()
-            decision_data = json.loads(cleaned_response)
-            return decision_data
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Raw response: {ai_response}")
-            return None
+            decision_data, errors = parse_decisions(ai_response, decision_schema(trade_mode))
         except Exception as e:
             print(f"Decision parsing error: {e}")
             return None
+        if decision_data is None:
+            print("JSON parsing error: no JSON object found")
+            print(f"Raw response: {ai_response}")
+            return None
+        for coin, coin_errors in errors.items():
+            print(f"❌ invalid decision for {coin}, skipping: {'; '.join(coin_errors)}")
+        return decision_data
 
     def get_coin_kline(self,instId,bar,limit=100):
         """
@@ -248,7 +412,7 @@ class okxbot():
         Returns:
             dict: {币种: 数量}
         """
-        result = self.account.get_account_balance()
+        result = self.snapshot.get_account_balance()
 
         if result['code'] != '0':
             print(f"获取余额失败: {result['msg']}")
@@ -0,0 +1,248 @@
+import math
+import re
+
+import numpy as np
+
+from data_collector import TechnicalIndicators
+
+__all__ = ['PromptEncoder', 'PromptSection', 'estimate_tokens', 'price_decimals', 'format_number']
+
+# 近似BPE分词：英文按最多6个字母一段、数字按最多3位一段，其余每个非空白字符一个token
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]{1,6}|\d{1,3}|\S")
+
+
+def estimate_tokens(text):
+    """估算token数（与 Qwen/GPT 的BPE分词误差一般在两成以内）；需要精确计数时给 PromptEncoder 传入 token_counter"""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def price_decimals(price, digits):
+    """按价格保留 digits 位有效数字所需的小数位数，如 digits=5 时 67012.3 -> 0, 0.201512 -> 5（可为负数）"""
+    if not price or not math.isfinite(price):
+        return digits
+    return digits - 1 - math.floor(math.log10(abs(price)))
+
+
+def format_number(value, decimals):
+    """按小数位数取整并去掉末尾的0，decimals 为负数时取整到十位/百位..."""
+    value = float(value)
+    if not math.isfinite(value):
+        return 'nan'
+    if decimals <= 0:
+        return str(int(round(value, decimals)))
+    text = f"{value:.{decimals}f}".rstrip('0').rstrip('.')
+    return '0' if text in ('', '-0') else text
+
+
+class PromptSection:
+    """
+    提示词的一段；priority 越大越先被压缩（换成 summary）或删除，0 表示必须保留
+    volatility: 内容变化的频率，0 固定不变、1 每根4H K线变化、2 每个周期变化、3 每次调用变化
+    """
+
+    def __init__(self, name, text, priority=0, summary=None, volatility=2):
+        self.name = name
+        self.text = text
+        self.priority = priority
+        self.summary = summary
+        self.volatility = volatility
+        self.summarized = False
+
+
+class PromptEncoder:
+    """
+    紧凑的多币种提示词编码
+    - 序列按价格保留 price_digits 位有效数字，RSI 保留1位小数，数字之间用空格分隔
+    - 多个币种的数据放在同一张表里（| 分隔，每个币种一行），表头只写一次
+    - 设置 token_budget 后超出预算时，从优先级最低的段落开始先替换为摘要（首/末/最低/最高），仍超出则删除
+    - encode 返回提示词和每段的token数报告
+    """
+
+    SERIES_3M = (('mid_prices', 'mid_prices', 'price'), ('ema20', 'ema_series', 'price'),
+                 ('macd', 'macd_series', 'price'), ('rsi7', 'rsi7_series', 'rsi'), ('rsi14', 'rsi14_series', 'rsi'))
+    SERIES_4H = (('macd', 'macd_4h_series', 'price'), ('rsi14', 'rsi14_4h_series', 'rsi'))
+
+    def __init__(self, token_budget=None, price_digits=5, series_length=10, trade_mode="spot", token_counter=None):
+        self.token_budget = token_budget
+        self.price_digits = price_digits
+        self.series_length = series_length
+        self.trade_mode = trade_mode
+        self.token_counter = token_counter or estimate_tokens
+
+    def _series(self, indicators, key):
+        """优先使用未取整的原始序列，旧格式的指标字典只有取整后的列表"""
+        values = indicators.get('raw', {}).get(key)
+        if values is None or not len(values):
+            values = indicators.get(key, [])
+        return np.asarray(values, dtype=np.float64)[-self.series_length:].tolist()
+
+    def _decimals(self, kind, price):
+        if kind == 'rsi':
+            return 1
+        return max(price_decimals(price, self.price_digits), 0)
+
+    def _snapshot(self, coins):
+        swap = self.trade_mode == "swap"
+        lines = ["coin|price|ema20|macd|rsi7|rsi14|funding" + ("|oi|oi_avg" if swap else "")]
+        for instId, coin_data, indicators_3m, _ in coins:
+            price = indicators_3m['current_price']
+            d = self._decimals('price', price)
+            row = [instId.split('-')[0], format_number(price, d), format_number(indicators_3m['ema20'], d),
+                   format_number(indicators_3m['macd'], d), format_number(indicators_3m['rsi7'], 1),
+                   format_number(indicators_3m['rsi14'], 1),
+                   format_number(coin_data['funding_rate']['rate'], price_decimals(coin_data['funding_rate']['rate'], 3))]
+            if swap:
+                open_interest = coin_data['open_interest'] or {'latest': 0, 'average': 0}
+                row += [format_number(open_interest['latest'], 1), format_number(open_interest['average'], 1)]
+            lines.append("|".join(row))
+        return "CURRENT VALUES (3-minute)\n" + "\n".join(lines)
+
+    def _context_4h(self, coins, title="4-HOUR CONTEXT"):
+        lines = ["coin|ema20|ema50|atr3|atr14|volume|avg_volume"]
+        for instId, _, indicators_3m, indicators_4h in coins:
+            d = self._decimals('price', indicators_3m['current_price'])
+            volume_d = max(price_decimals(indicators_4h['avg_volume'], 4), 0)
+            lines.append("|".join([instId.split('-')[0]] + [format_number(indicators_4h[key], d) for key in
+                                                            ('ema20_4h', 'ema50_4h', 'atr3', 'atr14')] +
+                                  [format_number(indicators_4h[key], volume_d) for key in ('current_volume', 'avg_volume')]))
+        return f"{title}\n" + "\n".join(lines)
+
+    def _extended(self, coins, timeframe, title):
+        """扩展指标的最新值，每个币种一行；没有选择扩展指标时返回 None"""
+        fields = [field for _, fields in TechnicalIndicators.EXTENDED.values() for field in fields]
+        rows = []
+        keys = None
+        for instId, _, indicators_3m, indicators_4h in coins:
+            extended = (indicators_3m if timeframe == '3m' else indicators_4h).get('extended')
+            if not extended:
+                continue
+            if keys is None:
+                keys = [(key, kind) for _, key, kind in fields if key in extended]
+            d = self._decimals('price', indicators_3m['current_price'])
+            row = [instId.split('-')[0]]
+            for key, kind in keys:
+                value = extended[key]
+                if kind == 'price':
+                    row.append(format_number(value, d))
+                elif kind == 'volume':
+                    row.append(format_number(value, max(price_decimals(value, 4), 0)))
+                elif kind == 'ratio':
+                    row.append(format_number(value, 2))
+                else:
+                    row.append(format_number(value, 1))
+            rows.append("|".join(row))
+        if not rows:
+            return None
+        return f"{title}\ncoin|" + "|".join(key for key, _ in keys) + "\n" + "\n".join(rows)
+
+    def _series_section(self, title, coins, name, key, kind, timeframe):
+        """返回 (完整序列文本, 摘要文本)"""
+        full, summary = [f"{title}: {name}"], [f"{title}: {name} summary coin|first|last|min|max"]
+        for instId, _, indicators_3m, indicators_4h in coins:
+            indicators = indicators_3m if timeframe == '3m' else indicators_4h
+            values = self._series(indicators, key)
+            d = self._decimals(kind, indicators_3m['current_price'])
+            coin = instId.split('-')[0]
+            full.append(f"{coin}|" + " ".join(format_number(v, d) for v in values))
+            finite = [v for v in values if math.isfinite(v)]
+            if finite:
+                summary.append("|".join([coin] + [format_number(v, d) for v in
+                                                  (values[0], values[-1], min(finite), max(finite))]))
+        return "\n".join(full), "\n".join(summary)
+
+    def _account(self, coins):
+        _, coin_data, _, _ = coins[0]
+        account_info = coin_data['account_info']
+        lines = [f"ACCOUNT\navailable_cash={account_info.get('available_cash', 0):.2f} "
+                 f"account_value={account_info.get('account_value', 0):.2f}"]
+        if self.trade_mode == "swap":
+            lines.append("positions coin|qty|entry|mark|liq|upl|lev|side")
+            for instId, coin_data, indicators_3m, _ in coins:
+                d = self._decimals('price', indicators_3m['current_price'])
+                for position in coin_data['positions'].values():
+                    fields = [format_number(position.get('quantity', 0), 6)]
+                    fields += [format_number(position[key], d) if key in position else '' for key in
+                               ('entry_price', 'current_price', 'liquidation_price')]
+                    fields += [format_number(position.get('unrealized_pnl', 0), 2) if 'unrealized_pnl' in position else '',
+                               format_number(position.get('leverage', 1), 1) if 'leverage' in position else '',
+                               position.get('pos_side', '')]
+                    lines.append("|".join([position.get('inst_id', instId).split('-')[0]] + fields))
+        else:
+            lines.append("balances coin|balance")
+            for instId, coin_data, _, _ in coins:
+                lines.append(f"{instId.split('-')[0]}|{format_number(coin_data['account_info'].get(instId, 0), 8)}")
+        return "\n".join(lines)
+
+    def sections(self, coins, closed_4h=False):
+        """
+        coins: [(instId, coin_data, indicators_3m, indicators_4h)]，即 PromptGenerator 收集到的数据
+        closed_4h: 4H 指标只用已收盘的K线计算（标题中注明）
+        返回按输出顺序排列的 PromptSection 列表
+        """
+        suffix = " (closed candles)" if closed_4h else ""
+        sections = [
+            PromptSection('legend', "Tables are '|' separated, one row per coin. Series are space separated, "
+                                    f"oldest → newest, last {self.series_length} values.", 0, volatility=0),
+            PromptSection('snapshot', self._snapshot(coins), 0),
+            PromptSection('context_4h', self._context_4h(coins, "4-HOUR CONTEXT" + suffix), 2, volatility=1),
+        ]
+        # 扩展指标的优先级与同一周期的指标序列相同
+        extended_3m = self._extended(coins, '3m', "EXTENDED INDICATORS (3-minute)")
+        if extended_3m:
+            sections.append(PromptSection('extended_3m', extended_3m, 3))
+        extended_4h = self._extended(coins, '4h', "EXTENDED INDICATORS (4-hour)" + suffix)
+        if extended_4h:
+            sections.append(PromptSection('extended_4h', extended_4h, 4, volatility=1))
+        # 3分钟价格序列最重要，其次是3分钟指标序列，4小时序列最先被压缩
+        for name, key, kind in self.SERIES_3M:
+            text, summary = self._series_section('3-MINUTE SERIES', coins, name, key, kind, '3m')
+            sections.append(PromptSection(f'series_3m.{name}', text, 1 if name == 'mid_prices' else 3, summary))
+        for name, key, kind in self.SERIES_4H:
+            text, summary = self._series_section('4-HOUR SERIES' + suffix, coins, name, key, kind, '4h')
+            sections.append(PromptSection(f'series_4h.{name}', text, 4, summary, volatility=1))
+        sections.append(PromptSection('account', self._account(coins), 0))
+        return sections
+
+    def fit(self, sections):
+        """超出预算时先把低优先级段落换成摘要，再删除；返回保留的段落和每段token数"""
+        tokens = {section.name: self.token_counter(section.text) for section in sections}
+        kept = list(sections)
+        if self.token_budget is None:
+            return kept, tokens
+        optional = sorted((s for s in sections if s.priority > 0), key=lambda s: -s.priority)
+        for section in optional:
+            if sum(tokens[s.name] for s in kept) <= self.token_budget:
+                break
+            if section.summary is not None:
+                section.text, section.summarized = section.summary, True
+                tokens[section.name] = self.token_counter(section.text)
+        for section in optional:
+            if sum(tokens[s.name] for s in kept) <= self.token_budget:
+                break
+            kept.remove(section)
+        return kept, tokens
+
+    def encode(self, header, coins, trailer=None, stable_first=False):
+        """
+        返回 (提示词, 报告)；报告包含每段的token数、被摘要/删除的段落，以及总数是否在预算内
+        stable_first: 段落按 volatility 从低到高排列（header 应为固定说明，随时间变化的内容放在 trailer）
+        """
+        sections = [PromptSection('header', header, 0, volatility=0 if stable_first else 3)]
+        sections += self.sections(coins, closed_4h=stable_first)
+        if trailer:
+            sections.append(PromptSection('trailer', trailer, 0, volatility=3))
+        if stable_first:
+            sections.sort(key=lambda section: section.volatility)
+        kept, tokens = self.fit(sections)
+        prompt = "\n\n".join(section.text.strip() for section in kept) + "\n"
+        # 段落之间只有空行，总数按各段之和计
+        total = sum(tokens[section.name] for section in kept)
+        report = {
+            'total_tokens': total,
+            'budget': self.token_budget,
+            'within_budget': self.token_budget is None or total <= self.token_budget,
+            'sections': {section.name: tokens[section.name] for section in kept},
+            'summarized': [section.name for section in kept if section.summarized],
+            'dropped': [section.name for section in sections if section not in kept]
+        }
+        return prompt, report
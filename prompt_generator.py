@@ -2,33 +2,119 @@ import traceback
 from datetime import datetime
 import numpy as np
 import time
-from data_collector import *
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from candle_store import closed_candles
+from data_collector import TechnicalIndicators
+from tracing import tracer
+
+__all__ = ['PromptGenerator', 'PROMPT_INSTRUCTIONS']
+
+# 提示词中不随时间变化的说明
+PROMPT_INSTRUCTIONS = """Below, we are providing you with a variety of state data, price data, and predictive signals so you can discover alpha. Below that is your current account information, value, performance, positions, etc.
+
+ALL OF THE PRICE OR SIGNAL DATA BELOW IS ORDERED: OLDEST → NEWEST
+
+Timeframes note: Unless stated otherwise in a section title, intraday series are provided at 3‑minute intervals. If a coin uses a different interval, it is explicitly stated in that coin’s section.
+
+"""
 
 class PromptGenerator:
-    def __init__(self, data_collector,trade_mode="spot"):
+    # 每个币种提示词使用的K线: (coin_data 中的键, 周期, 根数)
+    PRICE_SERIES = (('price_data_3m', '3m', 50), ('price_data_4h', '4H', 50))
+
+    def __init__(self, data_collector,trade_mode="spot",max_workers=1,encoder=None,layout="default",extended_indicators=()):
         self.data_collector = data_collector
         self.start_time = time.time()
         self.invocation_count = 0
         self.trade_mode=trade_mode
         self.indicators = TechnicalIndicators()
+        # max_workers > 1 时所有币种的所有请求并发发出，最多同时 max_workers 个
+        self.max_workers = max_workers
+        # PromptEncoder: 紧凑表格格式并控制token预算；为 None 时使用原来的逐币种文本格式
+        self.encoder = encoder
+        # 最近一次编码的每段token数（只在使用 encoder 时更新）
+        self.prompt_report = None
+        # layout="stable_first": 按变化频率从低到高排列（固定说明 → 4H背景 → 3m数据和账户 → 时间/调用次数），
+        # 连续请求的相同前缀更长，便于大模型服务端的前缀缓存；4H 数据只用已收盘的K线，4小时内保持不变
+        if layout not in ("default", "stable_first"):
+            raise ValueError(f"unknown prompt layout: {layout}")
+        self.layout = layout
+        # 加入提示词的扩展指标（TechnicalIndicators.EXTENDED 中的名称），与基础指标在同一次批量计算中完成
+        unknown = set(extended_indicators) - set(TechnicalIndicators.EXTENDED)
+        if unknown:
+            raise ValueError(f"unknown indicators: {sorted(unknown)}")
+        self.extended_indicators = tuple(extended_indicators)
+
+    def price_requests(self, data_collector):
+        """生成提示词时会向接口请求的 [(周期, 根数)]；本地聚合的大周期由基础周期K线得到，只需请求基础周期"""
+        requests = {}
+        resampler = data_collector.resampler
+        for _, bar, limit in self.PRICE_SERIES:
+            if resampler is not None and bar in resampler.bars:
+                bar = resampler.base_bar
+            requests[bar] = max(requests.get(bar, 0), limit)
+        return list(requests.items())
+
+    def _coin_data_tasks(self, data_collector):
+        tasks = {key: (lambda bar=bar, limit=limit: data_collector.get_price_data(bar, limit))
+                 for key, bar, limit in self.PRICE_SERIES}
+        tasks.update({
+            'account_info': data_collector.get_account_info,
+            'positions': data_collector.get_positions,
+            'funding_rate': data_collector.get_funding_rate,
+        })
+        if self.trade_mode == "swap":
+            tasks['open_interest'] = data_collector.get_open_interest
+        return tasks
 
-    def generate_coin_data(self,data_collector):
+    def collect_coin_data(self, data_collector):
         print("collection market data...")
-        price_data_3m = data_collector.get_price_data('3m', 50)
-        price_data_4h = data_collector.get_price_data('4H', 50)
-        account_info = data_collector.get_account_info()
-        account_balance=account_info[data_collector.instId]
-        positions = data_collector.get_positions()
-
-        funding_rate = data_collector.get_funding_rate()
-
-        open_interest = data_collector.get_open_interest() if self.trade_mode == "swap" else 0
+        coin_data = {'open_interest': 0}
+        for key, task in self._coin_data_tasks(data_collector).items():
+            coin_data[key] = task()
+        return coin_data
+
+    def collect_all_coin_data(self, collectors):
+        """
+        并发收集所有币种的数据，结果顺序与 collectors 一致
+        某个币种的请求失败时该币种返回 None，其余币种不受影响
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                # 每个任务带上当前的追踪上下文，工作线程中的 span 挂到本周期下
+                {key: executor.submit(contextvars.copy_context().run, task) for key, task in self._coin_data_tasks(each).items()}
+                for each in collectors
+            ]
+        coin_data_list = []
+        for each, coin_futures in zip(collectors, futures):
+            coin_data = {'open_interest': 0}
+            try:
+                for key, future in coin_futures.items():
+                    coin_data[key] = future.result()
+            except Exception as e:
+                print(f"❌ {each.instId} data collection failed, skipping: {e}")
+                coin_data = None
+            coin_data_list.append(coin_data)
+        return coin_data_list
 
-        indicators_3m = self._calculate_indicators(price_data_3m)
-        indicators_4h = self._calculate_indicators_4h(price_data_4h)
-
-
-        coin_prompt=f"""ALL {data_collector.instId} DATA
+    def generate_coin_data(self,data_collector):
+        coin_data = self.collect_coin_data(data_collector)
+        indicators_3m = self._calculate_indicators(coin_data['price_data_3m'])
+        indicators_4h = self._calculate_indicators_4h(coin_data['price_data_4h'])
+        return self.format_coin_data(data_collector, coin_data, indicators_3m, indicators_4h)
+
+    def format_coin_data(self, data_collector, coin_data, indicators_3m, indicators_4h):
+        instId = data_collector.instId
+        return (self._format_intraday(instId, coin_data, indicators_3m) + "\n\n"
+                + self._format_4h(indicators_4h, "Longer‑term context (4‑hour timeframe):") + "\n\n"
+                + self._format_account(coin_data) + self._format_holdings(instId, coin_data))
+
+    def _format_intraday(self, instId, coin_data, indicators_3m):
+        funding_rate = coin_data['funding_rate']
+        open_interest = coin_data['open_interest']
+
+        coin_prompt=f"""ALL {instId} DATA
 current_price = {indicators_3m['current_price']}, current_ema20 = {indicators_3m['ema20']:.3f}, current_macd = {indicators_3m['macd']:.3f}, current_rsi (7 period) = {indicators_3m['rsi7']:.2f}
 
 In addition, here is the latest coin open interest and funding rate for perps (the instrument you are trading):"""
@@ -46,9 +132,11 @@ MACD indicators: {indicators_3m['macd_series']}
 
 RSI indicators (7‑Period): {indicators_3m['rsi7_series']}
 
-RSI indicators (14‑Period): {indicators_3m['rsi14_series']}
+RSI indicators (14‑Period): {indicators_3m['rsi14_series']}"""
+        return coin_prompt + self._format_extended(indicators_3m)
 
-Longer‑term context (4‑hour timeframe):
+    def _format_4h(self, indicators_4h, title):
+        return f"""{title}
 
 20‑Period EMA: {indicators_4h['ema20_4h']:.3f} vs. 50‑Period EMA: {indicators_4h['ema50_4h']:.3f}
 
@@ -58,163 +146,294 @@ Current Volume: {indicators_4h['current_volume']:.3f} vs. Average Volume: {indic
 
 MACD indicators: {indicators_4h['macd_4h_series']}
 
-RSI indicators (14‑Period): {indicators_4h['rsi14_4h_series']}
+RSI indicators (14‑Period): {indicators_4h['rsi14_4h_series']}""" + self._format_extended(indicators_4h)
 
-HERE IS YOUR ACCOUNT INFORMATION & PERFORMANCE
+    def _format_extended(self, indicators):
+        extended = indicators.get('extended')
+        if not extended:
+            return ""
+        lines = []
+        for name in self.extended_indicators:
+            title, fields = TechnicalIndicators.EXTENDED[name]
+            values = ", ".join(f"{label} = {extended[key]:{'.2f' if kind in ('oscillator', 'ratio') else '.3f'}}"
+                               for label, key, kind in fields)
+            lines.append(f"{title}: {values}")
+        return "\n\n" + "\n\n".join(lines)
+
+    def _format_account(self, coin_data):
+        account_info = coin_data['account_info']
+        return f"""HERE IS YOUR ACCOUNT INFORMATION & PERFORMANCE
 
 Available Cash: {account_info.get('available_cash', 15581.17):.2f}
 
 Current Account Value: {account_info.get('account_value', 19527.81):.2f}\n"""
 
+    def _format_holdings(self, instId, coin_data):
         if self.trade_mode == "swap":
-            coin_prompt+=f"""Current live positions & performance: {str(positions)}"""
-        else:
-            coin_prompt+=f"""Current coin balance & performance: {data_collector.instId} Balance: {account_balance} """
-
-        return coin_prompt
-
+            return f"""Current live positions & performance: {str(coin_data['positions'])}"""
+        return f"""Current coin balance & performance: {instId} Balance: {coin_data['account_info'][instId]} """
 
-    def generate_trading_prompt(self):
+    def _prompt_status(self):
+        """每次调用都会变化的部分：运行时长、当前时间、调用次数"""
         self.invocation_count += 1
-        print("collection market data...")
         minutes_running = int((time.time() - self.start_time) / 60)
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-        prompt = f"""It has been {minutes_running} minutes since you started trading. The current time is {current_time} and you've been invoked {self.invocation_count} times. Below, we are providing you with a variety of state data, price data, and predictive signals so you can discover alpha. Below that is your current account information, value, performance, positions, etc.
-
-ALL OF THE PRICE OR SIGNAL DATA BELOW IS ORDERED: OLDEST → NEWEST
+        return f"It has been {minutes_running} minutes since you started trading. The current time is {current_time} and you've been invoked {self.invocation_count} times."
 
-Timeframes note: Unless stated otherwise in a section title, intraday series are provided at 3‑minute intervals. If a coin uses a different interval, it is explicitly stated in that coin’s section.
-
-CURRENT MARKET STATE FOR ALL COINS\n"""
-        for each in self.data_collector.data_collectors:
-            prompt+=self.generate_coin_data(each)
-        return prompt
+    def _prompt_header(self):
+        print("collection market data...")
+        return f"{self._prompt_status()} {PROMPT_INSTRUCTIONS}CURRENT MARKET STATE FOR ALL COINS\n"
+
+    def _collectors(self, coins=None):
+        collectors = self.data_collector.data_collectors
+        if coins is None:
+            return collectors
+        return [each for each in collectors if each.instId in coins]
+
+    def _coin_inputs(self, coins=None):
+        """收集数据并批量计算指标，返回 (collectors, coin_data_list, indicators_3m, indicators_4h, concurrent)"""
+        collectors = self._collectors(coins)
+        concurrent = self.max_workers > 1
+        with tracer.span("prompt.collect"):
+            if concurrent:
+                coin_data_list = self.collect_all_coin_data(collectors)
+            else:
+                coin_data_list = [self.collect_coin_data(each) for each in collectors]
+        price_data_4h = [each['price_data_4h'] if each else None for each in coin_data_list]
+        if self.layout == "stable_first":
+            price_data_4h = [closed_candles(each, '4H') for each in price_data_4h]
+        # 所有币种的指标在一次批量调用中计算
+        with tracer.span("prompt.indicators"):
+            indicators_3m = self._calculate_indicators_batch([each['price_data_3m'] if each else None for each in coin_data_list])
+            indicators_4h = self._calculate_indicators_4h_batch(price_data_4h)
+        return collectors, coin_data_list, indicators_3m, indicators_4h, concurrent
+
+    def _coin_sections(self, coins=None):
+        """返回 [(data_collector, 该币种的提示词段落)]，并发模式下失败的币种段落为 None；coins 指定只生成部分币种"""
+        inputs = self._coin_inputs(coins)
+        with tracer.span("prompt.format"):
+            return self._format_sections(*inputs)
+
+    def _coin_entries(self, coins=None):
+        """[(instId, coin_data, indicators_3m, indicators_4h)]，数据或指标缺失的币种跳过"""
+        collectors, coin_data_list, indicators_3m, indicators_4h, _ = self._coin_inputs(coins)
+        entries = []
+        for i, each in enumerate(collectors):
+            if coin_data_list[i] is None or indicators_3m[i] is None or indicators_4h[i] is None:
+                print(f"❌ {each.instId} data or indicators missing, skipping")
+                continue
+            entries.append((each.instId, coin_data_list[i], indicators_3m[i], indicators_4h[i]))
+        return entries
+
+    def _format_sections(self, collectors, coin_data_list, indicators_3m, indicators_4h, concurrent):
+        sections = []
+        for i, each in enumerate(collectors):
+            if not concurrent:
+                sections.append((each, self.format_coin_data(each, coin_data_list[i], indicators_3m[i], indicators_4h[i])))
+                continue
+            section = None
+            if coin_data_list[i] is not None:
+                try:
+                    section = self.format_coin_data(each, coin_data_list[i], indicators_3m[i], indicators_4h[i])
+                except Exception as e:
+                    print(f"❌ {each.instId} prompt formatting failed, skipping: {e}")
+            sections.append((each, section))
+        return sections
+
+    def _prompt_parts(self):
+        """(开头, 结尾)：默认布局时间/调用次数在开头，stable_first 布局放到最后"""
+        if self.layout == "stable_first":
+            print("collection market data...")
+            return PROMPT_INSTRUCTIONS, self._prompt_status()
+        return self._prompt_header(), None
+
+    def _encode(self, header, trailer, entries):
+        with tracer.span("prompt.format"):
+            prompt, report = self.encoder.encode(header, entries, trailer, self.layout == "stable_first")
+        print(f"prompt tokens: {report['total_tokens']} (budget {report['budget']}), "
+              f"summarized {report['summarized']}, dropped {report['dropped']}")
+        return prompt, report
+
+    def _stable_first_prompt(self, status, entries):
+        """固定说明 → 各币种4H背景（已收盘K线）→ 各币种3m数据 → 账户 → 时间/调用次数"""
+        with tracer.span("prompt.format"):
+            parts = [PROMPT_INSTRUCTIONS + "LONGER‑TERM CONTEXT FOR ALL COINS (4‑hour timeframe, closed candles only)"]
+            parts += [self._format_4h(indicators_4h, f"{instId} longer‑term context:") for instId, _, _, indicators_4h in entries]
+            parts.append("CURRENT MARKET STATE FOR ALL COINS")
+            parts += [self._format_intraday(instId, coin_data, indicators_3m) for instId, coin_data, indicators_3m, _ in entries]
+            if entries:
+                parts.append(self._format_account(entries[0][1])
+                             + "\n".join(self._format_holdings(instId, coin_data) for instId, coin_data, _, _ in entries))
+            parts.append(status)
+        return "\n\n".join(parts)
+
+    def generate_trading_prompt(self, coins=None):
+        if self.encoder is None and self.layout == "default":
+            prompt = self._prompt_header()
+            for _, section in self._coin_sections(coins):
+                if section is not None:
+                    prompt += section
+            return prompt
+        header, trailer = self._prompt_parts()
+        entries = self._coin_entries(coins)
+        if self.encoder is not None:
+            prompt, self.prompt_report = self._encode(header, trailer, entries)
+            return prompt
+        return self._stable_first_prompt(trailer, entries)
+
+    def generate_coin_prompts(self, coins=None):
+        """每个币种单独一份提示词 {instId: prompt}，共用同一段开头，用于按币种并行决策"""
+        if self.encoder is None and self.layout == "default":
+            header = self._prompt_header()
+            return {each.instId: header + section for each, section in self._coin_sections(coins) if section is not None}
+        header, trailer = self._prompt_parts()
+        prompts = {}
+        if self.encoder is not None:
+            self.prompt_report = {}
+        for entry in self._coin_entries(coins):
+            if self.encoder is not None:
+                prompts[entry[0]], self.prompt_report[entry[0]] = self._encode(header, trailer, [entry])
+            else:
+                prompts[entry[0]] = self._stable_first_prompt(trailer, [entry])
+        return prompts
 
 
     def _calculate_indicators(self, price_data):
-        if not price_data or len(price_data) < 30:
-            print(f"Insufficient data, at least 30 entries are required, currently only {len(price_data) if price_data else 0}条")
-
-
-        try:
-            closes = [candle['close'] for candle in price_data]
-            highs = [candle['high'] for candle in price_data]
-            lows = [candle['low'] for candle in price_data]
-
-            current_price = float(closes[-1])
-
-            # calculate indicators
-            ema20 = float(self.indicators.calculate_ema(closes, 20))
-            macd_data = self.indicators.calculate_macd(closes)
-            macd_current = float(macd_data['macd'])
-            rsi7 = float(self.indicators.calculate_rsi(closes, 7))
-            rsi14 = float(self.indicators.calculate_rsi(closes, 14))
-
-            mid_prices = [float(round(candle['close'], 1)) for candle in price_data[-10:]]
-
-            ema_series = []
-            for i in range(20, len(closes)):
-                ema_value = self.indicators.calculate_ema(closes[:i + 1], 20)
-                ema_series.append(float(round(ema_value, 3)))
-            ema_series = ema_series[-10:] if len(ema_series) >= 10 else ema_series
-
-            macd_series = []
-            for i in range(26, len(closes)):
-                macd_value = self.indicators.calculate_macd(closes[:i + 1])['macd']
-                macd_series.append(float(round(macd_value, 3)))
-            macd_series = macd_series[-10:] if len(macd_series) >= 10 else macd_series
-
-            rsi7_series = []
-            for i in range(14, len(closes)):
-                # Use a fixed-length window: take the most recent 14 price points
-                window_data = closes[i - 13:i + 1]
-                rsi_value = self.indicators.calculate_rsi(window_data, 7)
-                rsi7_series.append(float(round(rsi_value, 2)))
-
-            rsi7_series = rsi7_series[-10:] if len(rsi7_series) >= 10 else rsi7_series
-
-            rsi14_series = []
-            for i in range(14, len(closes)):
-                rsi_value = self.indicators.calculate_rsi(closes[:i + 1], 14)
-                rsi14_series.append(float(round(rsi_value, 2)))
-            rsi14_series = rsi14_series[-10:] if len(rsi14_series) >= 10 else rsi14_series
-
-            # If the series data is empty, fill with the current value
-            if not macd_series:
-                macd_series = [float(round(macd_current, 3))] * min(10, len(closes))
-            if not ema_series:
-                ema_series = [float(round(ema20, 3))] * min(10, len(closes))
-            if not rsi7_series:
-                rsi7_series = [float(round(rsi7, 2))] * min(10, len(closes))
-            if not rsi14_series:
-                rsi14_series = [float(round(rsi14, 2))] * min(10, len(closes))
-
-            print(f"Indicator calculation completed: Price={current_price:.6f}, EMA20={ema20:.3f}, MACD={macd_current:.3f}")
-            print(f"Data length - Price:{len(closes)}, EMA:{len(ema_series)}, MACD:{len(macd_series)}")
-
-            return {
-                'current_price': current_price,
-                'ema20': ema20,
-                'macd': macd_current,
-                'rsi7': rsi7,
-                'rsi14': rsi14,
-                'mid_prices': mid_prices,
-                'ema_series': ema_series,
-                'macd_series': macd_series,
-                'rsi7_series': rsi7_series,
-                'rsi14_series': rsi14_series
-            }
-
-        except Exception as e:
-            traceback.print_exc()
+        return self._calculate_indicators_batch([price_data])[0]
 
     def _calculate_indicators_4h(self, price_data):
-        if not price_data or len(price_data) < 30:
-            print(f"Insufficient data, at least 30 entries are required, currently only {len(price_data) if price_data else 0}")
-
-        try:
-            closes = [candle['close'] for candle in price_data]
-            highs = [candle['high'] for candle in price_data]
-            lows = [candle['low'] for candle in price_data]
-            volumes = [candle['volume'] for candle in price_data]
-
-            ema20_4h = float(self.indicators.calculate_ema(closes, 20))
-            ema50_4h = float(self.indicators.calculate_ema(closes, 50))
-
-
-            atr3 = float(self.indicators.calculate_atr(highs[-3:], lows[-3:], closes[-3:], 3))
-            atr14 = float(self.indicators.calculate_atr(highs, lows, closes, 14))
-
-            macd_4h_series = []
-            for i in range(26, len(closes)):
-                macd_value = self.indicators.calculate_macd(closes[:i + 1])['macd']
-                macd_4h_series.append(float(round(macd_value, 3)))
-            macd_4h_series = macd_4h_series[-10:] if len(macd_4h_series) >= 10 else macd_4h_series
-
-            rsi14_4h_series = []
-            for i in range(14, len(closes)):
-                rsi_value = self.indicators.calculate_rsi(closes[:i + 1], 14)
-                rsi14_4h_series.append(float(round(rsi_value, 3)))
-            rsi14_4h_series = rsi14_4h_series[-10:] if len(rsi14_4h_series) >= 10 else rsi14_4h_series
-
-            if not macd_4h_series:
-                current_macd = float(self.indicators.calculate_macd(closes)['macd'])
-                macd_4h_series = [float(round(current_macd, 3))] * min(10, len(closes))
-
-            if not rsi14_4h_series:
-                current_rsi = float(self.indicators.calculate_rsi(closes, 14))
-                rsi14_4h_series = [float(round(current_rsi, 3))] * min(10, len(closes))
-
-            return {
-                'ema20_4h': ema20_4h,
-                'ema50_4h': ema50_4h,
-                'atr3': atr3,
-                'atr14': atr14,
-                'current_volume': float(volumes[-1]) if volumes else 0.0,
-                'avg_volume': float(np.mean(volumes)) if volumes else 0.0,
-                'macd_4h_series': macd_4h_series,
-                'rsi14_4h_series': rsi14_4h_series
-            }
-
-        except Exception as e:
-            print("4H calc error:")
+        return self._calculate_indicators_4h_batch([price_data])[0]
+
+    def _batch_indicators(self, price_data_list):
+        """按K线数量分组堆叠成二维数组，每组调用一次批量指标内核"""
+        groups = {}
+        for index, price_data in enumerate(price_data_list):
+            if price_data is not None and len(price_data):
+                groups.setdefault(len(price_data), []).append(index)
+        for indexes in groups.values():
+            try:
+                # 单个币种直接使用结构化数组的列视图，多个币种才堆叠成二维数组
+                if len(indexes) == 1:
+                    columns = {key: price_data_list[indexes[0]][key][np.newaxis] for key in ('high', 'low', 'close', 'volume')}
+                else:
+                    columns = {key: np.stack([price_data_list[i][key] for i in indexes]) for key in ('high', 'low', 'close', 'volume')}
+                batch = self.indicators.calculate_batch(columns['high'], columns['low'], columns['close'], columns['volume'],
+                                                        self.extended_indicators)
+            except Exception as e:
+                traceback.print_exc()
+                continue
+            for row, index in enumerate(indexes):
+                yield index, columns['close'][row], batch, row
+
+    def _extended_values(self, batch, row):
+        """所选扩展指标的最新值 {键: 值}"""
+        return {key: float(batch[key][row, -1]) for name in self.extended_indicators
+                for _, key, _ in TechnicalIndicators.EXTENDED[name][1]}
+
+    def _calculate_indicators_batch(self, price_data_list):
+        results = [None] * len(price_data_list)
+        for price_data in price_data_list:
+            if price_data is None or len(price_data) < 30:
+                print(f"Insufficient data, at least 30 entries are required, currently only {len(price_data) if price_data is not None else 0}条")
+
+        for index, closes, batch, row in self._batch_indicators(price_data_list):
+            try:
+                price_data = price_data_list[index]
+                current_price = float(closes[-1])
+
+                mid_prices = [float(round(close, 1)) for close in price_data['close'][-10:].tolist()]
+
+                ema_values = batch['ema20'][row]
+                macd_values = batch['macd'][row]
+                rsi7_values = batch['rsi7'][row]
+                rsi14_values = batch['rsi14'][row]
+
+                ema_list = np.round(ema_values[20:][-10:], 3).tolist()
+                macd_list = np.round(macd_values[26:][-10:], 3).tolist()
+                rsi7_list = np.round(rsi7_values[14:][-10:], 2).tolist()
+                rsi14_list = np.round(rsi14_values[14:][-10:], 2).tolist()
+
+                ema20 = float(ema_values[-1])
+                macd_current = float(macd_values[-1])
+                rsi7 = float(rsi7_values[-1])
+                rsi14 = float(rsi14_values[-1])
+
+                # If the series data is empty, fill with the current value
+                if not macd_list:
+                    macd_list = [float(round(macd_current, 3))] * min(10, len(closes))
+                if not ema_list:
+                    ema_list = [float(round(ema20, 3))] * min(10, len(closes))
+                if not rsi7_list:
+                    rsi7_list = [float(round(rsi7, 2))] * min(10, len(closes))
+                if not rsi14_list:
+                    rsi14_list = [float(round(rsi14, 2))] * min(10, len(closes))
+
+                print(f"Indicator calculation completed: Price={current_price:.6f}, EMA20={ema20:.3f}, MACD={macd_current:.3f}")
+                print(f"Data length - Price:{len(closes)}, EMA:{len(ema_list)}, MACD:{len(macd_list)}")
+
+                results[index] = {
+                    'current_price': current_price,
+                    'ema20': ema20,
+                    'macd': macd_current,
+                    'rsi7': rsi7,
+                    'rsi14': rsi14,
+                    'mid_prices': mid_prices,
+                    'ema_series': ema_list,
+                    'macd_series': macd_list,
+                    'rsi7_series': rsi7_list,
+                    'rsi14_series': rsi14_list,
+                    'extended': self._extended_values(batch, row),
+                    # 未取整的序列（视图），供 PromptEncoder 按价格精度量化
+                    'raw': {
+                        'mid_prices': closes,
+                        'ema_series': ema_values[20:],
+                        'macd_series': macd_values[26:],
+                        'rsi7_series': rsi7_values[14:],
+                        'rsi14_series': rsi14_values[14:]
+                    }
+                }
+
+            except Exception as e:
+                traceback.print_exc()
+        return results
+
+    def _calculate_indicators_4h_batch(self, price_data_list):
+        results = [None] * len(price_data_list)
+        for price_data in price_data_list:
+            if price_data is None or len(price_data) < 30:
+                print(f"Insufficient data, at least 30 entries are required, currently only {len(price_data) if price_data is not None else 0}")
+
+        for index, closes, batch, row in self._batch_indicators(price_data_list):
+            try:
+                macd_values = batch['macd'][row]
+                rsi14_values = batch['rsi14'][row]
+                macd_4h_series = np.round(macd_values[26:][-10:], 3).tolist()
+                rsi14_4h_series = np.round(rsi14_values[14:][-10:], 3).tolist()
+
+                if not macd_4h_series:
+                    current_macd = float(macd_values[-1])
+                    macd_4h_series = [float(round(current_macd, 3))] * min(10, len(closes))
+
+                if not rsi14_4h_series:
+                    current_rsi = float(rsi14_values[-1])
+                    rsi14_4h_series = [float(round(current_rsi, 3))] * min(10, len(closes))
+
+                results[index] = {
+                    'ema20_4h': float(batch['ema20'][row, -1]),
+                    'ema50_4h': float(batch['ema50'][row, -1]),
+                    'atr3': float(batch['atr3'][row]),
+                    'atr14': float(batch['atr14'][row, -1]),
+                    'current_volume': float(batch['current_volume'][row]),
+                    'avg_volume': float(batch['avg_volume'][row]),
+                    'macd_4h_series': macd_4h_series,
+                    'rsi14_4h_series': rsi14_4h_series,
+                    'extended': self._extended_values(batch, row),
+                    'raw': {
+                        'macd_4h_series': macd_values[26:],
+                        'rsi14_4h_series': rsi14_values[14:]
+                    }
+                }
+
+            except Exception as e:
+                print("4H calc error:")
+        return results
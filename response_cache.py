@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+# 提示词中每次调用都会变化、但与行情无关的内容，计算指纹前去掉
+VOLATILE_PATTERNS = [
+    re.compile(r"It has been \d+ minutes since you started trading\."),
+    re.compile(r"The current time is [\d\-: .]+? and "),
+    re.compile(r"you've been invoked \d+ times\."),
+]
+
+
+def prompt_fingerprint(model, system_prompt, message):
+    """模型 + 系统提示词 + 去掉易变字段后的提示词 -> sha256"""
+    for pattern in VOLATILE_PATTERNS:
+        message = pattern.sub("", message)
+    h = hashlib.sha256()
+    for part in (model, system_prompt, message):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """
+    大模型回复的磁盘缓存，每条回复一个JSON文件
+    - 行情内容相同的提示词直接返回上次的回复，不再请求大模型
+    - 超过 max_age 秒的条目失效；超过 max_entries / max_bytes 时按最近使用时间淘汰
+    """
+
+    def __init__(self, root="./llm_cache", max_entries=1000, max_bytes=50 * 1024 * 1024, max_age=None):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        # key -> [最近使用时间, 文件大小]
+        self.index = {}
+        for name in os.listdir(root):
+            if name.endswith(".json"):
+                st = os.stat(os.path.join(root, name))
+                self.index[name[:-5]] = [st.st_mtime, st.st_size]
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            if self.max_age is not None and time.time() - entry["created"] > self.max_age:
+                self._remove(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            now = time.time()
+            self.index[key][0] = now
+            os.utime(self._path(key), (now, now))
+            self.hits += 1
+            return entry["response"]
+
+    def put(self, key, response, model=None):
+        entry = {"created": time.time(), "model": model, "response": response}
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self.index[key] = [time.time(), len(data)]
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        if self.max_age is not None:
+            for key, (used, _) in list(self.index.items()):
+                # 文件修改时间只在使用时更新，这里按最近使用时间粗略清理，读取时再按创建时间精确判断
+                if now - used > self.max_age:
+                    self._remove(key)
+                    self.evictions += 1
+        total = sum(size for _, size in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k][0]):
+            if len(self.index) <= self.max_entries and total <= self.max_bytes:
+                break
+            total -= self.index[key][1]
+            self._remove(key)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.index):
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.index),
+                'bytes': sum(size for _, size in self.index.values())
+            }
@@ -0,0 +1,143 @@
+import threading
+import time
+import traceback
+
+from candle_store import bar_offset_ms, bar_to_ms
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class ScheduledJob:
+    def __init__(self, name, bar, callback, every=1, prefetch=None):
+        self.name = name
+        self.bar = bar
+        self.callback = callback
+        self.prefetch = prefetch
+        self.period = bar_to_ms(bar) * every
+        self.offset = bar_offset_ms(bar)
+        self.next_close = None
+        self.prefetched = False
+        self.runs = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self.last_duration = 0.0
+
+    def close_after(self, ms):
+        """ms 之后（不含）的第一个K线收盘时间"""
+        return ((ms - self.offset) // self.period + 1) * self.period + self.offset
+
+    def to_dict(self):
+        return {
+            'bar': self.bar,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'coalesced': self.coalesced,
+            'avg_delay': self.total_delay / self.runs if self.runs else 0.0,
+            'max_delay': self.max_delay,
+            'last_duration': self.last_duration,
+            'next_close': self.next_close
+        }
+
+
+class CandleScheduler:
+    """
+    按K线收盘时间触发任务，替代固定 sleep 间隔
+    - 按绝对的收盘时间计算下一次触发，任务耗时不会累积成漂移
+    - 收盘后等待 settle 秒（交易所生成已收盘K线）再执行；收盘前 prefetch_lead 秒执行预取
+    - 任务耗时超过一个周期时：overrun='skip' 跳过错过的收盘，等下一个收盘；
+      overrun='coalesce' 错过的多个收盘合并为一次立即执行
+    所有任务在同一线程中依次执行
+    """
+
+    def __init__(self, settle=1.0, prefetch_lead=10.0, overrun='skip'):
+        if overrun not in ('skip', 'coalesce'):
+            raise ValueError(f"unknown overrun policy: {overrun}")
+        self.settle_ms = int(settle * 1000)
+        self.lead_ms = int(prefetch_lead * 1000)
+        self.overrun = overrun
+        self.jobs = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def add(self, name, bar, callback, every=1, prefetch=None):
+        """callback(close_ms) 在每 every 根 bar 收盘后执行，prefetch(close_ms) 在收盘前执行"""
+        job = ScheduledJob(name, bar, callback, every, prefetch)
+        self.jobs.append(job)
+        return job
+
+    def _call(self, job, fn, close_ms):
+        try:
+            fn(close_ms)
+        except Exception:
+            traceback.print_exc()
+
+    def _next_event(self):
+        events = []
+        for job in self.jobs:
+            fire_at = job.next_close + self.settle_ms
+            if job.prefetch is not None and not job.prefetched:
+                events.append((fire_at - self.lead_ms, 0, job))
+            events.append((fire_at, 1, job))
+        return min(events, key=lambda e: (e[0], e[1]))
+
+    def _run_job(self, job):
+        close_ms = job.next_close
+        start = now_ms()
+        delay = (start - close_ms) / 1000
+        job.runs += 1
+        job.total_delay += delay
+        job.max_delay = max(job.max_delay, delay)
+        self._call(job, job.callback, close_ms)
+        end = now_ms()
+        job.last_duration = (end - start) / 1000
+
+        next_close = close_ms + job.period
+        if end >= next_close + self.settle_ms:
+            # 本次执行超过了下一个收盘
+            missed = (end - self.settle_ms - next_close) // job.period + 1
+            if self.overrun == 'coalesce':
+                next_close += (missed - 1) * job.period
+                job.coalesced += missed - 1
+            else:
+                next_close += missed * job.period
+                job.skipped += missed
+            print(f"{job.name}: cycle took {job.last_duration:.1f}s, {self.overrun} {missed} candle close(s)")
+        job.next_close = next_close
+        # 预取时间已过但还没到执行时间时仍然预取
+        job.prefetched = next_close + self.settle_ms <= end
+
+    def run(self):
+        """阻塞运行，直到 stop()"""
+        self.stop_event.clear()
+        start = now_ms()
+        for job in self.jobs:
+            job.next_close = job.close_after(start)
+            job.prefetched = False
+        while self.jobs and not self.stop_event.is_set():
+            fire_at, kind, job = self._next_event()
+            wait = fire_at - now_ms()
+            if wait > 0:
+                self.stop_event.wait(wait / 1000)
+                continue
+            if kind == 0:
+                job.prefetched = True
+                self._call(job, job.prefetch, job.next_close)
+            else:
+                self._run_job(job)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def stats(self):
+        return {job.name: job.to_dict() for job in self.jobs}
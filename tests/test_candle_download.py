@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("okx")
+
+from okx.MarketData import MarketAPI
+
+from backtest import synthetic_history
+from candle_download import HistoryDownloader, StandInCandleServer, history_path, load_candles
+from candle_store import bar_to_ms
+from okx_gateway import OkxGateway
+
+INST_ID = "DOGE-USDT"
+BAR = '3m'
+
+
+class Flaky:
+    """请求 pages 页之后一直失败，模拟下载中途断开"""
+
+    def __init__(self, market_api, pages):
+        self.market_api = market_api
+        self.pages = pages
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get_history_candlesticks(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+            if self.calls > self.pages:
+                raise ConnectionError("connection reset")
+        return self.market_api.get_history_candlesticks(**kwargs)
+
+
+@pytest.fixture
+def source():
+    candles = synthetic_history([INST_ID], days=2, bars=(BAR,))[INST_ID][BAR]
+    # 停牌之类的缺口：一页覆盖的时间更长
+    candles = np.delete(candles, np.r_[100:130, 500:520])
+    server = StandInCandleServer({INST_ID: {BAR: candles}}, fail_every=5).start()
+    market_api = OkxGateway({'get_history_candlesticks': (1000, 1)}).wrap(MarketAPI(flag="1", domain=server.url))
+    yield candles, market_api
+    server.stop()
+
+
+def downloader(market_api, root, **kwargs):
+    return HistoryDownloader(market_api, str(root), max_workers=4, batch_pages=3, retry_delay=0.01, **kwargs)
+
+
+def span(candles):
+    return int(candles['timestamp'][0]), int(candles['timestamp'][-1]) + bar_to_ms(BAR)
+
+
+def assert_same(path, candles):
+    saved = load_candles(path)
+    np.testing.assert_array_equal(saved['timestamp'], candles['timestamp'])
+    np.testing.assert_allclose(saved['close'], candles['close'])
+
+
+def test_download_retries_rate_limited_pages(source, tmp_path):
+    candles, market_api = source
+    loader = downloader(market_api, tmp_path)
+    result = loader.download(INST_ID, BAR, *span(candles))
+    assert result['candles'] == len(candles)
+    assert loader.stats()['retried'] > 0
+    assert_same(result['path'], candles)
+
+
+def test_interrupted_download_resumes(source, tmp_path):
+    candles, market_api = source
+    start_ms, end_ms = span(candles)
+    with pytest.raises(RuntimeError):
+        downloader(Flaky(market_api, 4), tmp_path, retries=0).download(INST_ID, BAR, start_ms, end_ms)
+    # 失败页之前已取到的部分已写入文件，且与源数据最新的一段一致
+    partial = load_candles(history_path(str(tmp_path), INST_ID, BAR))
+    assert 0 < len(partial) < len(candles)
+    np.testing.assert_array_equal(partial['timestamp'], candles['timestamp'][-len(partial):])
+
+    loader = downloader(market_api, tmp_path)
+    result = loader.download(INST_ID, BAR, start_ms, end_ms)
+    assert 0 < result['added'] < len(candles)
+    assert_same(result['path'], candles)
+
+
+def test_extend_range_then_noop(source, tmp_path):
+    candles, market_api = source
+    start_ms, end_ms = span(candles)
+    middle = int(candles['timestamp'][len(candles) // 2])
+    first = downloader(market_api, tmp_path).download(INST_ID, BAR, middle, end_ms)
+    assert first['first'] <= middle and first['candles'] < len(candles)
+
+    result = downloader(market_api, tmp_path).download(INST_ID, BAR, start_ms, end_ms)
+    assert result['added'] == len(candles) - first['candles']
+    assert_same(result['path'], candles)
+
+    loader = downloader(market_api, tmp_path)
+    assert loader.download(INST_ID, BAR, start_ms, end_ms)['added'] == 0
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from data_collector import TechnicalIndicators
+
+pd = pytest.importorskip("pandas")
+
+COINS = 40
+N = 300
+
+
+def random_candles(rng, k, n):
+    close = np.round(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (k, n)), axis=1)), 2)
+    # 一段窗口内收盘价全相同，布林带宽度为0
+    close[:, 100:125] = close[:, 100:101]
+    high = close + np.round(rng.uniform(0.01, 1, (k, n)), 2)
+    low = close - np.round(rng.uniform(0.01, 1, (k, n)), 2)
+    volume = np.round(rng.uniform(0, 1000, (k, n)), 1)
+    return high, low, close, volume
+
+
+def reference(high, low, close, volume):
+    """用 pandas 按定义直接计算单个币种的扩展指标"""
+    high, low, close, volume = map(pd.Series, (high, low, close, volume))
+    prev_close = close.shift()
+    tr = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+
+    middle = close.rolling(20).mean()
+    # 逐窗口求标准差，价格不变的窗口为0（rolling().std() 的递推在这里会留下约1e-6的残差）
+    std = close.rolling(20).apply(lambda window: 0.0 if np.ptp(window) == 0 else window.std(ddof=1), raw=True)
+    upper, lower = middle + 2 * std, middle - 2 * std
+
+    highest, lowest = high.rolling(14).max(), low.rolling(14).min()
+    stoch_k = 100 * (close - lowest) / (highest - lowest)
+
+    up, down = high.diff().fillna(0), -low.diff().fillna(0)
+    plus_dm = up.where((up > down) & (up > 0), 0.0)
+    minus_dm = down.where((down > up) & (down > 0), 0.0)
+    atr = tr.ewm(alpha=1 / 14, adjust=False).mean()
+    plus_di = 100 * plus_dm.ewm(alpha=1 / 14, adjust=False).mean() / atr
+    minus_di = 100 * minus_dm.ewm(alpha=1 / 14, adjust=False).mean() / atr
+    dx = (100 * (plus_di - minus_di).abs() / (plus_di + minus_di)).fillna(0.0)
+    adx = dx.iloc[1:].ewm(alpha=1 / 14, adjust=False).mean().reindex(dx.index)
+
+    ema20 = close.ewm(span=20, adjust=False).mean()
+    atr14 = tr.rolling(14).mean()
+    series = {
+        'bb_upper': upper, 'bb_middle': middle, 'bb_lower': lower,
+        'bb_percent_b': ((close - lower) / (upper - lower)).mask(std == 0, 0.5),
+        'vwap': ((high + low + close) / 3 * volume).cumsum() / volume.cumsum(),
+        'stoch_k': stoch_k, 'stoch_d': stoch_k.rolling(3).mean(),
+        'obv': (np.sign(close.diff().fillna(0)) * volume).cumsum(),
+        'adx': adx, 'plus_di': plus_di, 'minus_di': minus_di,
+        'keltner_upper': ema20 + 2 * atr14, 'keltner_lower': ema20 - 2 * atr14,
+    }
+    return {key: value.to_numpy() for key, value in series.items()}
+
+
+@pytest.fixture(scope="module")
+def candles():
+    return random_candles(np.random.default_rng(7), COINS, N)
+
+
+@pytest.fixture(scope="module")
+def expected(candles):
+    per_coin = [reference(*(values[r] for values in candles)) for r in range(COINS)]
+    return {key: np.vstack([coin[key] for coin in per_coin]) for key in per_coin[0]}
+
+
+@pytest.mark.parametrize("name", sorted(TechnicalIndicators.EXTENDED))
+def test_extended_indicator_matches_pandas(name, candles, expected):
+    keys = [key for _, key, _ in TechnicalIndicators.EXTENDED[name][1]]
+    # 全部币种一起算走逐列 numpy，单个币种走逐行标量递推
+    stacked = TechnicalIndicators.calculate_batch(*candles, (name,))
+    for key in keys:
+        np.testing.assert_allclose(stacked[key], expected[key], rtol=1e-9, atol=1e-9, err_msg=key)
+    for r in (0, COINS - 1):
+        single = TechnicalIndicators.calculate_batch(*(values[r] for values in candles), (name,))
+        for key in keys:
+            np.testing.assert_allclose(single[key][0], expected[key][r], rtol=1e-9, atol=1e-9, err_msg=f"{key} coin={r}")
+
+
+def test_short_series_is_nan():
+    high, low, close, volume = random_candles(np.random.default_rng(8), 2, 10)
+    result = TechnicalIndicators.calculate_batch(high, low, close, volume, ('bollinger', 'stochastic'))
+    for key in ('bb_upper', 'bb_middle', 'bb_lower', 'stoch_k', 'stoch_d'):
+        assert np.isnan(result[key]).all(), key
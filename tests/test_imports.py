@@ -0,0 +1,12 @@
+import pytest
+
+from benchmark import STARTUP_BUDGET_MS, STARTUP_STATEMENTS, startup_time
+
+
+@pytest.mark.parametrize("module", sorted(STARTUP_STATEMENTS))
+def test_entry_module_startup(module):
+    # 全新解释器中导入并创建对象，不应加载 openai/okx/websockets
+    timings, loaded = startup_time(module, STARTUP_STATEMENTS[module], repeat=3)
+    assert loaded == []
+    # 测试机负载不稳定：取最快的一次，并留出一倍余量
+    assert min(timings) < 2 * STARTUP_BUDGET_MS[module]
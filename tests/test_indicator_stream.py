@@ -0,0 +1,48 @@
+import numpy as np
+
+from data_collector import TechnicalIndicators
+from indicator_stream import IndicatorStream, RSIStream
+
+
+def random_candles(rng, n):
+    close = np.round(100 * np.exp(np.cumsum(rng.normal(0, 0.01, n))), 2)
+    # 取整后有连续相同的收盘价，覆盖窗口内数值全相同的分支
+    close[n // 3:n // 3 + 20] = close[n // 3]
+    high = close + np.round(rng.uniform(0, 1, n), 2)
+    low = close - np.round(rng.uniform(0, 1, n), 2)
+    return high, low, close
+
+
+def test_streaming_matches_calculate_batch():
+    rng = np.random.default_rng(1)
+    for n in (1, 5, 14, 60, 300):
+        high, low, close = random_candles(rng, n)
+        stream = IndicatorStream()
+        for i in range(n):
+            latest = stream.update(high[i], low[i], close[i])
+        batch = TechnicalIndicators.calculate_batch(high, low, close, np.ones(n))
+        for key, value in latest.items():
+            np.testing.assert_array_equal(value, batch[key][0, -1], err_msg=f"{key} n={n}")
+
+
+def test_seeded_stream_matches_batch_on_extended_window():
+    rng = np.random.default_rng(2)
+    high, low, close = random_candles(rng, 120)
+    stream = IndicatorStream.from_window(high[:100], low[:100], close[:100])
+    for i in range(100, 120):
+        latest = stream.update(high[i], low[i], close[i])
+        batch = TechnicalIndicators.calculate_batch(high[:i + 1], low[:i + 1], close[:i + 1], np.ones(i + 1))
+        for key, value in latest.items():
+            np.testing.assert_array_equal(value, batch[key][0, -1], err_msg=f"{key} i={i}")
+
+
+def test_wilder_rsi_matches_batch_wilder():
+    rng = np.random.default_rng(3)
+    _, _, close = random_candles(rng, 200)
+    stream = RSIStream(14, smoothing='wilder')
+    values = [stream.update(price) for price in close]
+    delta = np.diff(close, prepend=close[0])
+    gain, loss = TechnicalIndicators._gain_loss(delta[np.newaxis, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = 100 - 100 / (1 + TechnicalIndicators.batch_wilder(gain, 14) / TechnicalIndicators.batch_wilder(loss, 14))
+    np.testing.assert_array_equal(values, expected[0])
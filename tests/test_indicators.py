@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from data_collector import TechnicalIndicators
+
+pd = pytest.importorskip("pandas")
+
+LENGTHS = (1, 13, 60, 250)
+SERIES_PER_LENGTH = 100
+
+
+def random_series(rng, k, n):
+    """一半为取整后的价格（含连续相同值），一半为带正负号和0的涨跌幅"""
+    prices = np.round(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (k // 2, n)), axis=1)), 2)
+    prices[:, n // 3:n // 3 + 20] = prices[:, n // 3:n // 3 + 1]
+    deltas = np.round(rng.normal(0, 1, (k - k // 2, n)), 1)
+    deltas[:, n // 2:n // 2 + 15] = 0.0
+    return np.vstack([prices, deltas])
+
+
+def both_paths(kernel, values, *args):
+    # 多行一起算走逐列 numpy，单行走逐行标量递推
+    assert values.shape[0] > TechnicalIndicators.SCALAR_ROWS
+    stacked = kernel(values, *args)
+    rows = np.vstack([kernel(row, *args) for row in values])
+    return stacked, rows
+
+
+@pytest.mark.parametrize("n", LENGTHS)
+def test_ewm_matches_pandas(n):
+    values = random_series(np.random.default_rng(n), SERIES_PER_LENGTH, n)
+    for span in (12, 20, 26, 50):
+        expected = np.vstack([pd.Series(row).ewm(span=span, adjust=False).mean().to_numpy() for row in values])
+        for result in both_paths(TechnicalIndicators.batch_ema, values, span):
+            np.testing.assert_array_equal(result, expected, err_msg=f"span={span}")
+    expected = np.vstack([pd.Series(row).ewm(alpha=1 / 14, adjust=False).mean().to_numpy() for row in values])
+    for result in both_paths(TechnicalIndicators.batch_wilder, values, 14):
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("n", LENGTHS)
+def test_rolling_mean_matches_pandas(n):
+    values = random_series(np.random.default_rng(100 + n), SERIES_PER_LENGTH, n)
+    for period in (1, 7, 14, 20):
+        expected = np.vstack([pd.Series(row).rolling(window=period).mean().to_numpy() for row in values])
+        for result in both_paths(TechnicalIndicators.batch_rolling_mean, values, period):
+            np.testing.assert_array_equal(result, expected, err_msg=f"period={period}")
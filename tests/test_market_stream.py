@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from candle_store import bar_to_ms
+from market_stream import MarketDataStream, StandInMarketServer
+
+
+class RestStandIn:
+    """记录补数请求的模拟REST接口"""
+    flag = "1"
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get_coin_kline(self, instId, bar, limit=100):
+        with self.lock:
+            self.calls += 1
+        period = bar_to_ms(bar)
+        now = int(time.time() * 1000) // period * period
+        return {'code': '0', 'data': [[str(now - i * period), '1', '1', '1', '1', '1', '1', '1', '0' if i == 0 else '1']
+                                      for i in range(int(limit))]}
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def subscribed(server):
+    """两个连接都已在服务端完成订阅（stream 报告就绪时服务端可能还没处理订阅消息，断开的旧连接也可能还没移除）"""
+    subscriptions = [channels for ws, channels in list(server.subscriptions.items()) if ws.state.name == 'OPEN']
+    return len(subscriptions) == 2 and all(subscriptions)
+
+
+@pytest.fixture
+def stand_in():
+    server = StandInMarketServer().start()
+    rest = RestStandIn()
+    stream = MarketDataStream(rest, ["DOGE-USDT"], bars=('3m',), public_url=server.url, business_url=server.url,
+                              candle_limit=50).start()
+    yield server, rest, stream
+    stream.stop()
+    server.stop()
+
+
+def test_backfill_and_push(stand_in):
+    server, rest, stream = stand_in
+    assert stream.wait_ready()
+    assert rest.calls == 1
+    assert len(stream.get_candles("DOGE-USDT", "3m", 50)) == 50
+
+    assert wait_for(lambda: subscribed(server))
+    server.push("tickers", "DOGE-USDT", [{"instId": "DOGE-USDT", "last": "0.2"}])
+    assert wait_for(lambda: stream.get_ticker("DOGE-USDT") == {"instId": "DOGE-USDT", "last": "0.2"})
+
+    # 推送的K线与已有K线之间有缺口时用REST补齐
+    newest = int(stream.get_candles("DOGE-USDT", "3m", 1)[0][0])
+    server.push("candle3m", "DOGE-USDT", [[str(newest + 5 * bar_to_ms('3m')), '2', '2', '2', '2', '1', '1', '1', '0']])
+    assert wait_for(lambda: rest.calls == 2)
+
+
+def test_reconnect_resubscribes_and_backfills(stand_in):
+    server, rest, stream = stand_in
+    assert stream.wait_ready()
+    calls = rest.calls
+
+    server.drop_connections()
+    assert wait_for(lambda: 'business' not in stream.connected, timeout=5)
+    # 断开期间不返回可能过期的K线，调用方改用REST
+    assert stream.get_candles("DOGE-USDT", "3m", 10) is None
+
+    assert wait_for(lambda: rest.calls > calls and stream.wait_ready(timeout=0.1))
+    assert len(stream.get_candles("DOGE-USDT", "3m", 50)) == 50
+    assert wait_for(lambda: subscribed(server))
+    server.push("tickers", "DOGE-USDT", [{"instId": "DOGE-USDT", "last": "0.3"}])
+    assert wait_for(lambda: (stream.get_ticker("DOGE-USDT") or {}).get("last") == "0.3")
@@ -0,0 +1,233 @@
+import bisect
+import contextvars
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+# 延迟直方图的分桶上界（毫秒），最后一个桶为 +inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Span:
+    __slots__ = ('name', 'start', 'end', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin):
+        node = {'name': self.name, 'start_ms': round((self.start - origin) * 1000, 3),
+                'ms': round(self.duration * 1000, 3)}
+        if self.children:
+            node['children'] = [child.to_dict(origin) for child in list(self.children)]
+        return node
+
+
+class LatencyHistogram:
+    """最近 window 次耗时的滚动统计"""
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, ms):
+        self.samples.append(ms)
+        self.count += 1
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': self.count}
+        buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for ms in samples:
+            buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        n = len(samples)
+        return {
+            'count': self.count,
+            'mean': sum(samples) / n,
+            'p50': samples[n // 2],
+            'p90': samples[min(int(n * 0.9), n - 1)],
+            'p99': samples[min(int(n * 0.99), n - 1)],
+            'max': samples[-1],
+            'buckets': dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS] + ["inf"], buckets))
+        }
+
+
+class SamplingProfiler:
+    """后台线程定时采样所有线程的调用栈，输出 collapsed stack 格式（可用 flamegraph.pl / speedscope 查看）"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Tracer:
+    """
+    交易周期的分阶段耗时追踪
+    - span(name) 嵌套记录耗时，子 span 自动挂到当前 span 下（基于 contextvars，asyncio 任务和 to_thread 会继承）
+    - 每个阶段名保留最近 window 次耗时，用于延迟分布统计
+    - cycle() 作为一个交易周期的根 span，可按需开启 cProfile 或采样分析
+    """
+
+    def __init__(self, window=1000):
+        self.enabled = True
+        self.window = window
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.current = contextvars.ContextVar('current_span', default=None)
+        self.last_cycle = None
+        self.profiler_kind = None
+        self.profile_dir = None
+        self.sample_interval = 0.005
+
+    def _record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram(self.window)
+            histogram.add(seconds * 1000)
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield None
+            return
+        span = Span(name)
+        parent = self.current.get()
+        if parent is not None:
+            parent.children.append(span)
+        token = self.current.set(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            self.current.reset(token)
+            self._record(name, span.end - span.start)
+
+    def enable_profiler(self, kind='cprofile', output_dir='./profiles', interval=0.005):
+        """
+        从下一个周期开始对每个周期做性能分析，结果写入 output_dir
+        kind='cprofile': 确定性分析（只覆盖执行周期的线程），输出 .prof
+        kind='sampling': 采样所有线程的调用栈，输出 collapsed stack 文本
+        """
+        if kind not in ('cprofile', 'sampling'):
+            raise ValueError(f"unknown profiler: {kind}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.profiler_kind = kind
+        self.profile_dir = output_dir
+        self.sample_interval = interval
+
+    def disable_profiler(self):
+        self.profiler_kind = None
+
+    @contextmanager
+    def cycle(self, name='cycle'):
+        kind = self.profiler_kind
+        profiler = None
+        if kind == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif kind == 'sampling':
+            profiler = SamplingProfiler(self.sample_interval)
+            profiler.start()
+        try:
+            with self.span(name) as root:
+                self.last_cycle = root
+                yield root
+        finally:
+            if profiler is not None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                if kind == 'cprofile':
+                    profiler.disable()
+                    path = os.path.join(self.profile_dir, f"{name}_{timestamp}.prof")
+                    profiler.dump_stats(path)
+                else:
+                    profiler.stop()
+                    path = os.path.join(self.profile_dir, f"{name}_{timestamp}.collapsed")
+                    profiler.dump(path)
+                print(f"profile saved at: {path}")
+
+    @staticmethod
+    def breakdown(root):
+        """一个周期的耗时明细：总耗时、按阶段名汇总、完整的嵌套 span 树"""
+        if root is None:
+            return None
+        stages = {}
+        pending = [root]
+        while pending:
+            span = pending.pop()
+            stage = stages.setdefault(span.name, {'ms': 0.0, 'count': 0})
+            stage['ms'] = round(stage['ms'] + span.duration * 1000, 3)
+            stage['count'] += 1
+            pending.extend(span.children)
+        return {
+            'total_ms': round(root.duration * 1000, 3),
+            'stages': stages,
+            'spans': root.to_dict(root.start)
+        }
+
+    def stats(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    def print_stats(self):
+        for name, stats in sorted(self.stats().items()):
+            if 'mean' not in stats:
+                continue
+            print(f"{name}: {stats['count']}次 p50={stats['p50']:.1f}ms p90={stats['p90']:.1f}ms "
+                  f"p99={stats['p99']:.1f}ms max={stats['max']:.1f}ms")
+
+
+# 全局追踪器，各模块共用
+tracer = Tracer()
+
+
+def traced(name):
+    """装饰器：函数的每次调用记为一个 span"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
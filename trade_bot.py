@@ -1,75 +1,211 @@
+import contextvars
 import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-from data_collector import *
-from okx_trade import *
-from model import *
-from prompt_generator import *
+from data_collector import DataCollector
+from candle_store import CandleStore
+from response_cache import ResponseCache
+from trade_journal import TradeJournal
+from scheduler import CandleScheduler
+from tracing import tracer, traced
+from okx_trade import okxbot
+from model import DECISION_TIMEOUT, Mod
+from prompt_generator import PromptGenerator
+from prompt_encoder import PromptEncoder
+
+__all__ = ['TradingBot']
 
 class TradingBot:
 
-    def __init__(self,coin_list=None, is_simulated=True,trade_mode='spot'):
+    def __init__(self,coin_list=None, is_simulated=True,trade_mode='spot',candle_store_dir=None,max_workers=1,use_market_stream=False,response_cache_dir=None,
+                 parallel_decisions=False,decision_timeout=DECISION_TIMEOUT,journal_dir="./trade_journal",compact_prompt=False,prompt_token_budget=None,
+                 prompt_layout="default",market_bus=None,stream_decisions=False,resample_bars=None,
+                 extended_indicators=(),gateway=None):
         if coin_list is None:
             coin_list=["BTC-USDT"]
-        self.trading_agent = okxbot(is_simulated)
-        self.data_collector =DataCollector(self.trading_agent,coin_list,trade_mode=trade_mode)
-        self.prompt_generator = PromptGenerator(self.data_collector)
-        self.model = Mod(self.prompt_generator,trade_mode=trade_mode)
+        self.coin_list = coin_list
+        self.trade_mode = trade_mode
+        # stream_decisions=True 时流式接收大模型回复，每个币种的决策一完整就下单，不等其余币种
+        self.stream_decisions = stream_decisions
+        # 已预取、还未运行的周期（按币种组区分，不同周期的币种组各自预取）
+        self._prefetched = set()
+        # gateway: 多个机器人共用的 OkxGateway，限速按所有机器人的请求合计
+        self.trading_agent = okxbot(is_simulated, gateway)
+        # 指定目录后K线保存在本地，每个周期只增量请求新K线
+        candle_store = CandleStore(candle_store_dir) if candle_store_dir else None
+        # WebSocket订阅行情，数据收集直接读取内存中的最新行情（只在启用时导入 websockets）
+        if use_market_stream:
+            from market_stream import MarketDataStream
+        self.market_stream = MarketDataStream(self.trading_agent, coin_list, trade_mode=trade_mode).start() if use_market_stream else None
+        # 多个机器人共用的 MarketDataBus：行情每根K线只请求一次，账户和下单仍用自己的 okxbot
+        if market_bus is not None and self.market_stream is None:
+            market_bus.subscribe(coin_list, bars=('3m',) if resample_bars else ('3m', '4H'))
+            self.market_stream = market_bus
+        # resample_bars=('4H',) 时4H K线由3m K线在本地聚合，每个周期每个币种只请求一次K线
+        self.data_collector =DataCollector(self.trading_agent,coin_list,trade_mode=trade_mode,candle_store=candle_store,market_stream=self.market_stream,
+                                           resample_bars=resample_bars)
+        # compact_prompt=True 或指定 prompt_token_budget 时使用紧凑表格格式，超出预算时压缩/删除低优先级段落
+        encoder = PromptEncoder(prompt_token_budget, trade_mode=trade_mode) if compact_prompt or prompt_token_budget else None
+        # prompt_layout="stable_first": 固定内容在前、时间等易变内容在后，便于大模型服务端复用前缀缓存
+        # extended_indicators=('bollinger', 'adx') 等：在提示词中加入扩展指标（TechnicalIndicators.EXTENDED）
+        self.prompt_generator = PromptGenerator(self.data_collector,max_workers=max_workers,encoder=encoder,layout=prompt_layout,
+                                                extended_indicators=extended_indicators)
+        # 指定目录后缓存大模型回复，行情未变化或回放时不再重复请求
+        response_cache = ResponseCache(response_cache_dir) if response_cache_dir else None
+        # parallel_decisions=True 时每个币种单独并发请求大模型，decision_timeout 为单个请求的超时秒数
+        self.model = Mod(self.prompt_generator,trade_mode=trade_mode,cache=response_cache,
+                         parallel=parallel_decisions,max_concurrency=max(max_workers,4),timeout=decision_timeout)
+        # 交易记录追加写入日志，按时间/币种/信号查询: self.journal.query(coin="DOGE", signal="buy")
+        self.journal = TradeJournal(journal_dir)
+        # 各阶段耗时统计: self.tracer.print_stats()；运行中开启性能分析: self.tracer.enable_profiler('sampling')
+        self.tracer = tracer
 
     def get_decision(self):
         print("1.AI decision generation in progress...")
-        prompt, ai_response = self.model.decide()
+        self.trading_agent.snapshot.begin_cycle()
+        try:
+            prompt, ai_response = self.model.decide()
+        finally:
+            self.trading_agent.snapshot.end_cycle()
         print("2.Parsing trading decision...")
-        decision_data = self.trading_agent.parse_decision(ai_response)
+        decision_data = self.trading_agent.parse_decision(ai_response, self.trade_mode)
         self._save_trading_record(prompt, ai_response, decision_data, True)
         return decision_data
 
-    def run_single_cycle(self):
+    @traced("prefetch")
+    def prefetch(self, coins=None):
+        """
+        K线收盘前预先获取：开始新的账户快照周期并取好余额/持仓，本地K线存储补到最新
+        收盘后同一组币种的 run_single_cycle 直接复用，只需再请求最新的一两根K线
+        """
+        self.trading_agent.snapshot.begin_cycle()
+        self.trading_agent.snapshot.get_account_balance()
+        self.trading_agent.snapshot.get_positions()
+        for each in self.data_collector.data_collectors:
+            if each.candle_store is not None and (coins is None or each.instId in coins):
+                # 与生成提示词时请求的周期和根数相同
+                for bar, limit in self.prompt_generator.price_requests(each):
+                    each.get_price_data(bar, limit)
+        self._prefetched.add(self._cycle_key(coins))
+
+    @staticmethod
+    def _cycle_key(coins):
+        return None if coins is None else frozenset(coins)
+
+    def run_single_cycle(self, coins=None):
+        # 整个周期作为一个根 span，各阶段耗时明细随交易记录保存
+        with tracer.cycle() as cycle:
+            return self._run_single_cycle(coins, cycle)
+
+    def _run_single_cycle(self, coins, cycle):
+        # 本周期内所有币种共用一次账户余额/持仓查询；这组币种已预取时沿用预取开始的周期
+        key = self._cycle_key(coins)
+        if key in self._prefetched:
+            self._prefetched.discard(key)
+        else:
+            self.trading_agent.snapshot.begin_cycle()
         try:
             print("1.AI decision generation in progress...")
-            prompt, ai_response = self.model.decide()
-            print("2.Parsing trading decision...")
-            decision_data = self.trading_agent.parse_decision(ai_response)
+            if self.stream_decisions:
+                prompt, ai_response, decision_data, orders = self._decide_streaming(coins)
+            else:
+                with tracer.span("decide"):
+                    prompt, ai_response = self.model.decide(coins)
+                print("2.Parsing trading decision...")
+                decision_data = self.trading_agent.parse_decision(ai_response, self.trade_mode)
+                orders = self.trading_agent.execute_decision(decision_data) if decision_data else None
             if not decision_data:
                 print("Decision parsing failed, skipping execution")
                 return False
-            success = self.trading_agent.execute_decision(decision_data)
-            acc=self.trading_agent.get_balance()
-            with open("acc.jsonl", "a",encoding="utf-8") as f:
-                acc["time"]=str(datetime.now())
-                acc["timestamp"]=datetime.now().timestamp()
-                f.write(json.dumps(acc, ensure_ascii=False))
-                f.write("\n")
-            self._save_trading_record(prompt, ai_response, decision_data, success,acc)
+            # 下单后账户已变化，重新获取
+            self.trading_agent.snapshot.invalidate()
+            # 下单后的余额快照随交易记录写入日志，不再单独追加 acc.jsonl
+            with tracer.span("balance"):
+                acc=self.trading_agent.get_balance()
+            # 所有币种的订单都成功才算成功，逐币种结果另存在 orders 字段
+            success = bool(orders) and all(result['ok'] for result in orders.values())
+            self._save_trading_record(prompt, ai_response, decision_data, success,acc,timing=tracer.breakdown(cycle),orders=orders)
             return success
         except Exception as e:
             traceback.print_exc()
             return False
+        finally:
+            self.trading_agent.snapshot.end_cycle()
 
-    def trading_cycle(self,time_interval=60*2):
-        while True:
-            self.run_single_cycle()
-            time.sleep(time_interval)
+    def _decide_streaming(self, coins):
+        """
+        每个币种的决策到达后立即在线程池中下单，大模型回复结束后等待所有订单完成
+        回复结尾被截断、无法整体解析时，以已经下单的决策为准；大模型请求中途出错时，已经发出的订单照常记录后再抛出
+        """
+        received = {}
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.trading_agent.execute_workers) as executor:
+                def on_decision(coin, decision):
+                    received[coin] = decision
+                    futures[coin] = executor.submit(contextvars.copy_context().run,
+                                                    self.trading_agent.execute_decision, {coin: decision})
+                with tracer.span("decide"):
+                    prompt, ai_response = self.model.decide(coins, on_decision=on_decision)
+        except Exception:
+            if futures:
+                results = self._order_results(futures)
+                self.trading_agent.snapshot.invalidate()
+                self._save_trading_record(None, None, dict(received), all(result['ok'] for result in results.values()),
+                                          orders=results)
+            raise
+        print("2.Parsing trading decision...")
+        decision_data = self.trading_agent.parse_decision(ai_response, self.trade_mode)
+        if not decision_data and received:
+            print("❌ full response could not be parsed, recording the decisions already executed")
+            decision_data = dict(received)
+        return prompt, ai_response, decision_data, self._order_results(futures)
 
+    @staticmethod
+    def _order_results(futures):
+        results = {}
+        for coin, future in futures.items():
+            try:
+                results.update(future.result())
+            except Exception as e:
+                results[coin] = {'instId': coin, 'signal': None, 'ok': False, 'latency': 0.0, 'response': str(e)}
+        return results
 
-    def _save_trading_record(self, prompt, ai_response, decision_data, success,acc):
-        from datetime import datetime
-        import json
+    def trading_cycle(self,bar='3m',every=1,coin_bars=None,settle=1.0,prefetch_lead=10.0,overrun='skip'):
+        """
+        每根 bar 收盘后立即运行交易周期（每 every 根运行一次），收盘前 prefetch_lead 秒预取数据
+        coin_bars: {instId: bar} 为部分币种指定不同的决策周期，如 {"BTC-USDT": "15m"}
+        overrun: 周期耗时超过一根K线时 'skip' 等下一个收盘，'coalesce' 立即补跑一次
+        """
+        self.scheduler = CandleScheduler(settle=settle, prefetch_lead=prefetch_lead, overrun=overrun)
+        # 等待第一根K线收盘期间在后台导入 openai、创建客户端
+        threading.Thread(target=self.model.warm_up, daemon=True).start()
+        groups = {}
+        for instId in self.coin_list:
+            groups.setdefault((coin_bars or {}).get(instId, bar), []).append(instId)
+        for group_bar, coins in groups.items():
+            self.scheduler.add(f"{group_bar} {','.join(coins)}", group_bar,
+                               lambda close_ms, coins=coins: self.run_single_cycle(coins), every=every,
+                               prefetch=lambda close_ms, coins=coins: self.prefetch(coins))
+        self.scheduler.run()
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        os.makedirs("./trading_record", exist_ok=True)
-        filename = f"./trading_record/{timestamp}.json"
 
+    def _save_trading_record(self, prompt, ai_response, decision_data, success,acc=None,timing=None,orders=None):
         record = {
-            'timestamp': timestamp,
+            'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
             'success': success,
+            'orders': orders,
             'decision': decision_data,
             'prompt': prompt,
             'ai_response': ai_response,
             'execution_time': datetime.now().isoformat(),
-            'acc': acc
+            'acc': acc,
+            'timing': timing,
+            'prompt_tokens': self.prompt_generator.prompt_report,
+            'prompt_prefix': self.model.prefix.summary()
         }
-
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(record, f, indent=2, ensure_ascii=False)
-
-        print(f"record saved at: {filename}")
\ No newline at end of file
+        # 放入队列由后台线程写盘，不阻塞交易周期
+        self.journal.append(record)
@@ -0,0 +1,239 @@
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+# 索引：每条记录的每个币种一行，按时间/币种/信号查询时只扫描索引，命中后再读取压缩的记录
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<i8'),   # 毫秒
+    ('segment', '<i4'),
+    ('offset', '<i8'),
+    ('length', '<i4'),
+    ('coin', 'S16'),
+    ('signal', 'S8'),
+    ('confidence', '<f8'),
+    ('quantity', '<f8'),
+    ('success', 'i1'),
+])
+_LENGTH = struct.Struct('<I')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _is_success(success, coin=''):
+    if isinstance(success, dict):
+        # execute_decision 返回的逐币种结果
+        if isinstance(success.get(coin), dict) and 'ok' in success[coin]:
+            return bool(success[coin]['ok'])
+        if 'code' not in success and success and all(isinstance(v, dict) and 'ok' in v for v in success.values()):
+            return all(v['ok'] for v in success.values())
+        return success.get('code') == '0'
+    return bool(success)
+
+
+def decision_items(decision):
+    """兼容两种决策格式：{币种: {...}} 和旧版单币种 {signal: ..., coin: ...}"""
+    if not isinstance(decision, dict) or not decision:
+        return []
+    if 'signal' in decision:
+        return [(str(decision.get('coin', '')), decision)]
+    return [(str(coin), info) for coin, info in decision.items() if isinstance(info, dict)]
+
+
+class TradeJournal:
+    """
+    追加写入的交易日志，替代每个周期一个格式化JSON文件
+    - 记录以 zlib 压缩后追加到分段日志文件 segment_XXXXXX.log（[长度][压缩数据]）
+    - 每个分段对应一个定长二进制索引 segment_XXXXXX.idx（INDEX_DTYPE），启动时全部载入内存
+    - append 只把记录放入队列，由后台线程批量写盘，不阻塞交易流程
+    """
+
+    def __init__(self, root="./trade_journal", segment_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        indexes = []
+        segments = sorted(int(name[8:14]) for name in os.listdir(root)
+                          if name.startswith('segment_') and name.endswith('.log'))
+        for segment in segments:
+            path = self._path(segment, 'idx')
+            if os.path.exists(path):
+                indexes.append(np.fromfile(path, dtype=INDEX_DTYPE))
+        self.index = np.concatenate(indexes) if indexes else np.empty(0, dtype=INDEX_DTYPE)
+        self.segment = segments[-1] if segments else 0
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _path(self, segment, ext):
+        return os.path.join(self.root, f"segment_{segment:06d}.{ext}")
+
+    def append(self, record, timestamp=None):
+        """record 为原来 trading_record JSON 的内容；timestamp 为毫秒，默认当前时间"""
+        timestamp = int(time.time() * 1000) if timestamp is None else int(timestamp)
+        self.queue.put((timestamp, record))
+
+    def flush(self):
+        """等待队列中的记录全部写盘"""
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.writer.join(timeout=5)
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            batch = [item]
+            # 一次取完队列中已有的记录，合并成一次写入
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    self.queue.task_done()
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Trade journal write failed: {e}")
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_batch(self, batch):
+        log_path = self._path(self.segment, 'log')
+        size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        if size >= self.segment_bytes:
+            self.segment += 1
+            log_path = self._path(self.segment, 'log')
+            size = 0
+        data = bytearray()
+        rows = []
+        for timestamp, record in batch:
+            blob = zlib.compress(json.dumps(record, ensure_ascii=False, default=str).encode('utf-8'))
+            offset = size + len(data)
+            data += _LENGTH.pack(len(blob)) + blob
+            items = decision_items(record.get('decision')) or [('', {})]
+            for coin, info in items:
+                rows.append((timestamp, self.segment, offset, len(blob), coin.upper().encode('utf-8')[:16],
+                             str(info.get('signal', '')).encode('utf-8')[:8], _to_float(info.get('confidence')),
+                             _to_float(info.get('quantity')), _is_success(record.get('orders') or record.get('success'), coin)))
+        rows = np.array(rows, dtype=INDEX_DTYPE)
+        # 先写日志再写索引，中途崩溃时日志里多出的数据没有索引，不会被读到
+        with open(log_path, 'ab') as f:
+            f.write(data)
+        with open(self._path(self.segment, 'idx'), 'ab') as f:
+            rows.tofile(f)
+        with self.lock:
+            self.index = np.concatenate([self.index, rows])
+
+    def _read(self, segment, offset, length):
+        with open(self._path(segment, 'log'), 'rb') as f:
+            f.seek(offset + _LENGTH.size)
+            return json.loads(zlib.decompress(f.read(length)).decode('utf-8'))
+
+    def select(self, start=None, end=None, coin=None, signal=None, min_confidence=None, success=None):
+        """
+        只查询索引，返回满足条件的索引行（INDEX_DTYPE 结构化数组，按时间排序）
+        start/end: datetime 或毫秒时间戳
+        """
+        self.flush()
+        with self.lock:
+            index = self.index
+        mask = np.ones(len(index), dtype=bool)
+        if start is not None:
+            mask &= index['timestamp'] >= self._to_ms(start)
+        if end is not None:
+            mask &= index['timestamp'] < self._to_ms(end)
+        if coin is not None:
+            mask &= index['coin'] == coin.upper().replace('-USDT', '').encode('utf-8')
+        if signal is not None:
+            mask &= index['signal'] == signal.encode('utf-8')
+        if min_confidence is not None:
+            mask &= index['confidence'] >= min_confidence
+        if success is not None:
+            mask &= index['success'] == int(success)
+        rows = index[mask]
+        return rows[np.argsort(rows['timestamp'], kind='stable')]
+
+    def query(self, start=None, end=None, coin=None, signal=None, min_confidence=None, success=None):
+        """返回满足条件的完整记录列表（同一条记录只返回一次）"""
+        records = []
+        seen = set()
+        for row in self.select(start, end, coin, signal, min_confidence, success):
+            key = (int(row['segment']), int(row['offset']))
+            if key in seen:
+                continue
+            seen.add(key)
+            records.append(self._read(*key, int(row['length'])))
+        return records
+
+    def balances(self, start=None, end=None):
+        """每条记录下单后的账户余额快照，返回 [(毫秒时间戳, acc), ...]，按时间排序"""
+        snapshots = []
+        seen = set()
+        for row in self.select(start, end):
+            key = (int(row['segment']), int(row['offset']))
+            if key in seen:
+                continue
+            seen.add(key)
+            acc = self._read(*key, int(row['length'])).get('acc')
+            if acc is not None:
+                snapshots.append((int(row['timestamp']), acc))
+        return snapshots
+
+    @staticmethod
+    def _to_ms(value):
+        if isinstance(value, datetime):
+            return int(value.timestamp() * 1000)
+        return int(value)
+
+    def import_json_records(self, pattern="./trading_record/*.json"):
+        """导入旧的 trading_record/*.json，已导入过的（时间戳相同）跳过，返回导入条数"""
+        self.flush()
+        with self.lock:
+            existing = set(self.index['timestamp'].tolist())
+        count = 0
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                timestamp = int(datetime.strptime(record['timestamp'], "%Y%m%d_%H%M%S").timestamp() * 1000)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            if timestamp in existing:
+                continue
+            existing.add(timestamp)
+            self.append(record, timestamp)
+            count += 1
+        self.flush()
+        return count
+
+
+if __name__ == '__main__':
+    journal = TradeJournal()
+    print(f"imported {journal.import_json_records()} records, {len(journal.index)} index rows")
+    for record in journal.query(signal='buy', min_confidence=0.8):
+        print(record['timestamp'], record['decision'])
+    journal.close()